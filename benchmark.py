@@ -0,0 +1,499 @@
+import io
+import os
+import json
+import time
+import argparse
+import contextlib
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+import gnss_to_csv
+import solution
+from gnssutils import rinex_nav
+from gnssutils.ephemeris_manager import EphemerisManager
+
+"""
+Benchmarks for the positioning pipeline. Everything runs on synthetic data so no log files or
+network access are needed: micro-benchmarks of single kernels, and an end-to-end run over a
+generated GnssLogger log and broadcast file with a known receiver trajectory, whose timings,
+memory and position error are saved as JSON to compare across commits.
+"""
+
+EARTH_RADIUS = 6371000.0
+GPS_ORBIT_RADIUS = 26560000.0
+START = '2024-04-13 10:00:00'  # first epoch of the end-to-end log, GPS time
+# Raw columns of a GnssLogger v3 log
+LOG_COLUMNS = ['utcTimeMillis', 'TimeNanos', 'LeapSecond', 'TimeUncertaintyNanos', 'FullBiasNanos', 'BiasNanos',
+               'BiasUncertaintyNanos', 'DriftNanosPerSecond', 'DriftUncertaintyNanosPerSecond',
+               'HardwareClockDiscontinuityCount', 'Svid', 'TimeOffsetNanos', 'State', 'ReceivedSvTimeNanos',
+               'ReceivedSvTimeUncertaintyNanos', 'Cn0DbHz', 'PseudorangeRateMetersPerSecond',
+               'PseudorangeRateUncertaintyMetersPerSecond', 'AccumulatedDeltaRangeState',
+               'AccumulatedDeltaRangeMeters', 'AccumulatedDeltaRangeUncertaintyMeters', 'CarrierFrequencyHz',
+               'CarrierCycles', 'CarrierPhase', 'CarrierPhaseUncertainty', 'MultipathIndicator', 'SnrInDb',
+               'ConstellationType', 'AgcDb', 'BasebandCn0DbHz', 'FullInterSignalBiasNanos',
+               'FullInterSignalBiasUncertaintyNanos', 'SatelliteInterSignalBiasNanos',
+               'SatelliteInterSignalBiasUncertaintyNanos', 'CodeType', 'ChipsetElapsedRealtimeNanos']
+
+
+def random_receiver(rng):
+    lat = np.radians(rng.uniform(-60, 60))
+    lon = np.radians(rng.uniform(-180, 180))
+    return EARTH_RADIUS * np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def visible_satellites(rng, receiver, n_sats):
+    # Draw satellites on the GPS orbit sphere that are above the receiver's horizon
+    up = receiver / np.linalg.norm(receiver)
+    sats = []
+    while len(sats) < n_sats:
+        direction = rng.normal(size=3)
+        direction /= np.linalg.norm(direction)
+        sat = GPS_ORBIT_RADIUS * direction
+        los = sat - receiver
+        if los @ up / np.linalg.norm(los) > 0.2:
+            sats.append(sat)
+    return np.array(sats)
+
+
+def synthetic_solution_input(n_epochs, n_sats=8, seed=0):
+    # Build a parse_gnss_log-style DataFrame with a static receiver and noisy pseudoranges
+    rng = np.random.default_rng(seed)
+    receiver = random_receiver(rng)
+    rows = []
+    for epoch in range(n_epochs):
+        sats = visible_satellites(rng, receiver, n_sats)
+        bias = rng.uniform(-1e5, 1e5)
+        pr = np.linalg.norm(sats - receiver, axis=1) + bias + rng.normal(scale=3.0, size=n_sats)
+        timestamp = pd.Timestamp('2024-01-01', tz='UTC') + pd.Timedelta(seconds=epoch)
+        for sat, rng_m in zip(sats, pr):
+            rows.append((timestamp.isoformat(), sat[0], sat[1], sat[2], rng_m))
+    frame = pd.DataFrame(rows, columns=['GPS time', 'Sat.X', 'Sat.Y', 'Sat.Z', 'Pseudo-Range'])
+    return frame, receiver
+
+
+def synthetic_ephemeris(n_sats=32, seed=0):
+    # Broadcast-like Keplerian elements for a GPS-style constellation, one row per satellite
+    rng = np.random.default_rng(seed)
+    ephemeris = pd.DataFrame(index=pd.Index(['G%02d' % (i + 1) for i in range(n_sats)], name='sv'))
+    ephemeris['t_oe'] = ephemeris['t_oc'] = 7200.0
+    ephemeris['sqrtA'] = 5153.6 + rng.normal(scale=0.5, size=n_sats)
+    ephemeris['deltaN'] = 4.5e-9
+    ephemeris['M_0'] = rng.uniform(-np.pi, np.pi, n_sats)
+    ephemeris['e'] = rng.uniform(0.001, 0.02, n_sats)
+    ephemeris['omega'] = rng.uniform(-np.pi, np.pi, n_sats)
+    ephemeris['i_0'] = np.radians(55) + rng.normal(scale=0.01, size=n_sats)
+    ephemeris['IDOT'] = 1e-10
+    ephemeris['Omega_0'] = -np.pi + (np.arange(n_sats) % 6) * np.pi / 3
+    ephemeris['OmegaDot'] = -8e-9
+    ephemeris['C_us'], ephemeris['C_uc'] = 5e-6, 1e-6
+    ephemeris['C_rs'], ephemeris['C_rc'] = 20.0, 200.0
+    ephemeris['C_is'], ephemeris['C_ic'] = -1e-8, 1e-8
+    ephemeris['SVclockBias'] = rng.uniform(-3e-4, 3e-4, n_sats)
+    ephemeris['SVclockDrift'] = rng.uniform(-1e-11, 1e-11, n_sats)
+    ephemeris['SVclockDriftRate'] = 0.0
+    return ephemeris
+
+
+def synthetic_glonass_ephemeris(n_sats=24, seed=0):
+    # Broadcast state vectors of circular GLONASS-like orbits in the rotating PZ-90 frame
+    rng = np.random.default_rng(seed)
+    radius, inclination = 25510000.0, np.radians(64.8)
+    node = np.repeat(np.radians([0.0, 120.0, 240.0]), -(-n_sats // 3))[:n_sats]
+    anomaly = rng.uniform(-np.pi, np.pi, n_sats)
+    position = radius * np.array([np.cos(node) * np.cos(anomaly) - np.sin(node) * np.cos(inclination) * np.sin(anomaly),
+                                  np.sin(node) * np.cos(anomaly) + np.cos(node) * np.cos(inclination) * np.sin(anomaly),
+                                  np.sin(inclination) * np.sin(anomaly)])
+    speed = np.sqrt(gnss_to_csv.GLONASS_GM / radius)
+    velocity = speed * np.array([-np.cos(node) * np.sin(anomaly) - np.sin(node) * np.cos(inclination) * np.cos(anomaly),
+                                 -np.sin(node) * np.sin(anomaly) + np.cos(node) * np.cos(inclination) * np.cos(anomaly),
+                                 np.sin(inclination) * np.cos(anomaly)])
+    # Inertial to Earth-fixed velocity
+    velocity[0] += gnss_to_csv.GLONASS_OMEGA * position[1]
+    velocity[1] -= gnss_to_csv.GLONASS_OMEGA * position[0]
+    ephemeris = pd.DataFrame(index=pd.Index(['R%02d' % (i + 1) for i in range(n_sats)], name='sv'))
+    ephemeris['t_oc'] = 7200.0 - 18
+    ephemeris['X'], ephemeris['Y'], ephemeris['Z'] = position
+    ephemeris['dX'], ephemeris['dY'], ephemeris['dZ'] = velocity
+    ephemeris['dX2'] = ephemeris['dY2'] = ephemeris['dZ2'] = 0.0
+    ephemeris['SVclockBias'] = rng.uniform(-3e-4, 3e-4, n_sats)
+    ephemeris['SVrelFreqBias'] = rng.uniform(-1e-11, 1e-11, n_sats)
+    ephemeris['Leap Seconds'] = 18.0
+    return ephemeris
+
+
+def rinex_number(value):
+    return ('%19.12E' % value).replace('E', 'D')
+
+
+def broadcast_records(ephemeris, start, n_records=13, interval=7200):
+    # Uploads of synthetic_ephemeris every interval seconds from start, each with its own reference
+    # time and the elements moved forward to it, so every record describes the same orbits and
+    # clocks (within one GPS week). One row per satellite and record, with the record's 'time'.
+    start = pd.Timestamp(start)
+    A = ephemeris['sqrtA'] ** 2
+    mean_motion = np.sqrt(gnss_to_csv.GM / A ** 3) + ephemeris['deltaN']
+    records = []
+    for k in range(n_records):
+        time_of_clock = start + pd.Timedelta(seconds=k * interval)
+        week, time_of_week = divmod((time_of_clock - pd.Timestamp(gnss_to_csv.GPS_EPOCH)).total_seconds(),
+                                    gnss_to_csv.WEEKSEC)
+        dt = k * interval
+        record = ephemeris.copy()
+        record['M_0'] = (ephemeris['M_0'] + mean_motion * dt + np.pi) % (2 * np.pi) - np.pi
+        record['Omega_0'] = (ephemeris['Omega_0'] + ephemeris['OmegaDot'] * dt + np.pi) % (2 * np.pi) - np.pi
+        record['i_0'] = ephemeris['i_0'] + ephemeris['IDOT'] * dt
+        record['SVclockBias'] = ephemeris['SVclockBias'] + ephemeris['SVclockDrift'] * dt
+        record['t_oe'] = record['t_oc'] = time_of_week
+        record['GPSWeek'] = week
+        record['time'] = time_of_clock
+        records.append(record)
+    return pd.concat(records)
+
+
+def write_rinex_nav(records, filepath, version=2):
+    # Write broadcast_records as a GPS broadcast file
+    if version >= 3:
+        header = '     3.04           N: GNSS NAV DATA    G: GPS              RINEX VERSION / TYPE'
+    else:
+        header = '     2.11           N: GPS NAV DATA                         RINEX VERSION / TYPE'
+    lines = [header, '%6d%54sLEAP SECONDS' % (18, ''), '%60sEND OF HEADER' % '']
+    renamed = records.rename(columns={'M_0': 'M0', 'e': 'Eccentricity', 't_oe': 'Toe', 'deltaN': 'DeltaN',
+                                        'C_uc': 'Cuc', 'C_us': 'Cus', 'C_ic': 'Cic', 'C_rc': 'Crc', 'C_is': 'Cis',
+                                        'C_rs': 'Crs', 'i_0': 'Io', 'Omega_0': 'Omega0'})
+    for time_of_clock, record in renamed.groupby('time', sort=True):
+        for sv, row in record.iterrows():
+            values = [rinex_number(row.get(field, 0.0)) for field in rinex_nav.GPS_FIELDS]
+            t = time_of_clock
+            if version >= 3:
+                epoch_line = '%s %4d %02d %02d %02d %02d %02d' % (sv, t.year, t.month, t.day, t.hour, t.minute, t.second)
+                indent = '    '
+            else:
+                epoch_line = '%2d %02d %2d %2d %2d %2d%5.1f' % (int(sv[1:]), t.year % 100, t.month, t.day, t.hour,
+                                                               t.minute, t.second)
+                indent = '   '
+            lines.append(epoch_line + ''.join(values[:3]))
+            lines.extend(indent + ''.join(values[i:i + 4]) for i in range(3, len(values), 4))
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def geodetic_to_ecef(lat, lon, alt):
+    # WGS84 degrees and meters to ECEF meters
+    lat, lon = np.radians(lat), np.radians(lon)
+    e2 = solution.WGS84_F * (2 - solution.WGS84_F)
+    n = solution.WGS84_A / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    return np.array([(n + alt) * np.cos(lat) * np.cos(lon), (n + alt) * np.cos(lat) * np.sin(lon),
+                     (n * (1 - e2) + alt) * np.sin(lat)])
+
+
+def write_gnss_log(filepath, records, start, n_epochs, origin=(32.1, 34.8, 50.0), speed=10.0, noise=1.0, seed=0,
+                   min_elevation=10.0):
+    # Write a GnssLogger log of a receiver driving east at speed (m/s) from origin (lat, lon, alt),
+    # tracking at 1 Hz every satellite of broadcast_records above min_elevation degrees. Pseudoranges
+    # get noise (m) and a drifting receiver clock, each epoch uses the latest record before it as
+    # EphemerisManager does. Returns the true ECEF receiver position of every epoch, (n_epochs, 3).
+    rng = np.random.default_rng(seed)
+    lat, lon = np.radians(origin[0]), np.radians(origin[1])
+    east = np.array([-np.sin(lon), np.cos(lon), 0.0])
+    up = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    seconds = np.arange(n_epochs, dtype=float)
+    truth = geodetic_to_ecef(*origin) + speed * seconds[:, None] * east
+
+    # Rows of every (epoch, satellite) pair, with the ephemeris of the record in use
+    records = records.sort_values(['time', 'sv'])
+    record_times = records['time'].unique()
+    svs = records.index.unique().sort_values()
+    n_sats = len(svs)
+    epoch_times = pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+    in_use = np.searchsorted(record_times, epoch_times, side='left') - 1
+    if in_use.min() < 0:
+        raise ValueError('the log starts before the first broadcast record')
+    rows = (in_use[:, None] * n_sats + np.arange(n_sats)).ravel()
+    eph = {field: values[rows] for field, values in gnss_to_csv.ephemeris_to_arrays(records).items()}
+    gps_nanos = (epoch_times - pd.Timestamp(gnss_to_csv.GPS_EPOCH)).to_numpy().astype('timedelta64[ns]').astype(np.int64)
+    receive_time = np.repeat(gps_nanos % (gnss_to_csv.WEEKSEC * 10 ** 9) * 1e-9, n_sats)
+    receiver = np.repeat(truth, n_sats, axis=0)
+
+    # Receiver clock in meters, then transmit times by iterating the signal travel time
+    clock_drift = rng.uniform(-100.0, 100.0)
+    clock_bias = np.repeat(rng.uniform(-1e5, 1e5) + clock_drift * seconds, n_sats)
+    errors = rng.normal(scale=noise, size=receive_time.size)
+    transmit_time = receive_time - 0.075
+    for _ in range(3):
+        x_k, y_k, z_k, delT_sv, vx_k, vy_k, vz_k, delT_sv_dot = gnss_to_csv.satellite_states(eph, transmit_time)
+        line_of_sight = np.column_stack([x_k, y_k, z_k]) - receiver
+        distance = np.linalg.norm(line_of_sight, axis=1)
+        pseudorange = distance + clock_bias - gnss_to_csv.LIGHTSPEED * delT_sv + errors
+        transmit_time = receive_time - pseudorange / gnss_to_csv.LIGHTSPEED
+    unit = line_of_sight / distance[:, None]
+    sin_elevation = unit @ up
+    rate = (unit * (np.column_stack([vx_k, vy_k, vz_k]) - speed * east)).sum(axis=1) + clock_drift \
+        - gnss_to_csv.LIGHTSPEED * delT_sv_dot
+    visible = sin_elevation > np.sin(np.radians(min_elevation))
+
+    hardware_nanos = 10 ** 12 + np.repeat(np.arange(n_epochs, dtype=np.int64) * 10 ** 9, n_sats)
+    log = pd.DataFrame({column: '' for column in LOG_COLUMNS}, index=np.flatnonzero(visible))
+    log['utcTimeMillis'] = np.repeat(gps_nanos // 10 ** 6, n_sats)[visible]
+    log['TimeNanos'] = hardware_nanos[visible]
+    log['FullBiasNanos'] = 10 ** 12 - gps_nanos[0]
+    log['BiasNanos'] = 0.0
+    log['BiasUncertaintyNanos'] = 10.0
+    log['HardwareClockDiscontinuityCount'] = 0
+    log['Svid'] = np.tile(svs.str[1:].astype(int), n_epochs)[visible]
+    log['TimeOffsetNanos'] = 0.0
+    log['State'] = gnss_to_csv.STATE_TOW_DECODED | gnss_to_csv.STATE_TOW_KNOWN | 7
+    log['ReceivedSvTimeNanos'] = np.round(transmit_time[visible] * 1e9).astype(np.int64)
+    log['ReceivedSvTimeUncertaintyNanos'] = 20
+    log['Cn0DbHz'] = np.round(25 + 20 * sin_elevation[visible] + rng.normal(scale=2.0, size=visible.sum()), 1)
+    log['PseudorangeRateMetersPerSecond'] = np.round(rate[visible], 4)
+    log['PseudorangeRateUncertaintyMetersPerSecond'] = 0.1
+    log['AccumulatedDeltaRangeState'] = 0
+    log['CarrierFrequencyHz'] = 1575420030.0
+    log['MultipathIndicator'] = 0
+    log['ConstellationType'] = 1
+    log['CodeType'] = 'C'
+    log['ChipsetElapsedRealtimeNanos'] = log['TimeNanos']
+    log.insert(0, 'Type', 'Raw')
+    with open(filepath, 'w') as f:
+        f.write('# Version: v3.0.0.1 Platform: 12 Manufacturer: synthetic Model: benchmark\n')
+        f.write('# Raw,' + ','.join(LOG_COLUMNS) + '\n')
+        log.to_csv(f, header=False, index=False)
+    return truth
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_trilateration(n_epochs=2000, n_sats=8):
+    measurements, receiver = synthetic_solution_input(n_epochs, n_sats)
+    per_epoch, per_epoch_time = timed(solution.calculate_locations_real_time, measurements, batch=False)
+    batch, batch_time = timed(solution.calculate_locations_real_time, measurements, batch=True)
+
+    per_epoch_xyz = np.array([coords[:3] for coords in per_epoch.values()])
+    batch_xyz = np.array([batch[t][:3] for t in per_epoch])
+    max_diff = np.abs(per_epoch_xyz - batch_xyz).max()
+    error = np.linalg.norm(batch_xyz - receiver, axis=1)
+
+    print(f"trilateration, {n_epochs} epochs x {n_sats} satellites")
+    print(f"  per-epoch: {per_epoch_time:.3f} s ({n_epochs / per_epoch_time:.0f} epochs/s)")
+    print(f"  batch:     {batch_time:.3f} s ({n_epochs / batch_time:.0f} epochs/s)")
+    print(f"  speedup:   {per_epoch_time / batch_time:.1f}x")
+    print(f"  max |per-epoch - batch|: {max_diff:.2e} m, mean position error: {error.mean():.2f} m")
+
+
+def benchmark_satellite_position(n_epochs=500, n_sats=32):
+    ephemeris = synthetic_ephemeris(n_sats)
+    transmit_times = 7200.0 + np.arange(n_epochs)[:, None] + np.zeros(n_sats)
+
+    start = time.perf_counter()
+    for t in transmit_times:
+        sv_position = gnss_to_csv.calculate_satellite_position(ephemeris, pd.Series(t, index=ephemeris.index))
+    pandas_time = (time.perf_counter() - start) / n_epochs
+
+    eph = gnss_to_csv.ephemeris_to_arrays(ephemeris)
+    start = time.perf_counter()
+    for t in transmit_times:
+        x_k, y_k, z_k, delT_sv = gnss_to_csv.satellite_position_kernel(eph, t)
+    kernel_time = (time.perf_counter() - start) / n_epochs
+
+    _, all_epochs_time = timed(gnss_to_csv.satellite_position_kernel, eph, transmit_times)
+    all_epochs_time /= n_epochs
+    max_diff = np.abs(sv_position['x_k'].to_numpy() - x_k).max()
+
+    print(f"satellite position, {n_sats} satellites")
+    print(f"  pandas:            {pandas_time * 1e6:.0f} us/epoch")
+    print(f"  kernel per epoch:  {kernel_time * 1e6:.0f} us/epoch")
+    print(f"  kernel all epochs: {all_epochs_time * 1e6:.1f} us/epoch ({n_epochs} epochs in one call)")
+    print(f"  max |pandas - kernel| x: {max_diff:.2e} m")
+
+
+def benchmark_orbit_cache(n_epochs=3600):
+    # One hour at 1 Hz: exact satellite states at every epoch against the interpolating OrbitCache,
+    # which parse_gnss_log only uses for GLONASS
+    print(f"orbit interpolation cache, {n_epochs} epochs")
+    for name, ephemeris in (('GPS', synthetic_ephemeris()), ('GLONASS', synthetic_glonass_ephemeris())):
+        system = ephemeris.index[0][0]
+        eph = gnss_to_csv.ephemeris_to_arrays(ephemeris)
+        n_sats = len(ephemeris)
+        rows = np.tile(np.arange(n_sats), n_epochs)
+        eph = {field: values[rows] for field, values in eph.items()}
+        transmit_time = 7200.0 + np.repeat(np.arange(n_epochs), n_sats) - 0.07
+        exact, exact_time = timed(gnss_to_csv.satellite_states, eph, transmit_time)
+        cache = gnss_to_csv.OrbitCache(systems=system)
+        _, cold_time = timed(cache.states, eph, transmit_time)
+        interpolated, warm_time = timed(cache.states, eph, transmit_time)
+        exact, interpolated = np.array(exact), np.array(interpolated)
+        position_error = np.linalg.norm(exact[:3] - interpolated[:3], axis=0).max()
+        velocity_error = np.linalg.norm(exact[4:7] - interpolated[4:7], axis=0).max()
+        clock_error = np.abs(exact[3] - interpolated[3]).max() * gnss_to_csv.LIGHTSPEED
+        print(f"  {name} ({n_sats} satellites): exact {exact_time / n_epochs * 1e6:.0f} us/epoch, "
+              f"cached {cold_time / n_epochs * 1e6:.0f} us/epoch cold, {warm_time / n_epochs * 1e6:.0f} us/epoch warm, "
+              f"speedup {exact_time / warm_time:.1f}x")
+        print(f"    max error: position {position_error * 1e3:.3f} mm, velocity {velocity_error * 1e3:.3f} mm/s, "
+              f"clock {clock_error * 1e3:.3f} mm")
+
+
+def benchmark_rinex_parser(n_epochs=13, n_sats=32, repeats=5):
+    try:
+        import georinex
+    except ImportError:
+        print("RINEX navigation parser: skipped, georinex is not installed")
+        return
+    ephemeris = synthetic_ephemeris(n_sats)
+    print(f"RINEX navigation parser, {n_epochs} epochs x {n_sats} satellites")
+    with tempfile.TemporaryDirectory() as directory:
+        for version in (2, 3):
+            filepath = os.path.join(directory, 'brdc.nav')
+            write_rinex_nav(broadcast_records(ephemeris, '2024-04-14', n_epochs), filepath, version)
+            native, native_time = timed(lambda: [rinex_nav.read_nav(filepath) for _ in range(repeats)])
+            reference, georinex_time = timed(lambda: [georinex.load(filepath) for _ in range(repeats)])
+            # Cross-check against georinex, whose frame also has the spare fields
+            data = native[0][0]
+            reference = reference[0].to_dataframe().dropna(how='all').reset_index()
+            reference = reference.sort_values(['time', 'sv'], ignore_index=True)[data.columns]
+            identical = data.equals(reference)
+            print(f"  RINEX {version}: native {native_time / repeats * 1e3:.1f} ms, "
+                  f"georinex {georinex_time / repeats * 1e3:.1f} ms, speedup {georinex_time / native_time:.1f}x, "
+                  f"identical: {identical}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_pipeline(log_filepath, data_directory, kml_filepath, trace_memory=False):
+    # Run the pipeline stages on a log the way parse_gnss_log and calculate_locations_real_time do.
+    # Returns ({stage: seconds, or peak traced MB with trace_memory}, coordinates, Raw rows), tracing
+    # slows the stages down several times so a run either times or traces.
+    stages = {}
+
+    def stage(name, func, *args):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        result, seconds = timed(func, *args)
+        stages[name] = tracemalloc.get_traced_memory()[1] / 2 ** 20 if trace_memory else seconds
+        return result
+
+    manager = EphemerisManager(data_directory)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        measurements = stage('read_data', gnss_to_csv.read_data, log_filepath)
+        rows = len(measurements)
+        measurements = stage('preprocess_measurements', gnss_to_csv.preprocess_measurements, measurements)
+        selected = stage('get_ephemeris', gnss_to_csv.epoch_ephemerides, measurements, manager)
+        frame = stage('calculate_satellite_position', gnss_to_csv.satellite_frame, *selected)
+        coordinates = stage('trilateration', solution.calculate_locations_real_time, frame)
+        stage('export_to_kml', solution.export_to_kml, coordinates, kml_filepath)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return stages, coordinates, rows
+
+
+def benchmark_end_to_end(n_epochs=3600, n_sats=32, noise=1.0, speed=10.0, seed=0, repeats=3):
+    # Generate a log and its broadcast file, then time every pipeline stage on it the way
+    # parse_gnss_log and calculate_locations_real_time run them, keeping each stage's best of
+    # repeats runs. Returns a JSON-ready dict.
+    ephemeris = synthetic_ephemeris(n_sats, seed)
+    start = pd.Timestamp(START)
+    n_records = int(np.ceil((start - start.normalize()).total_seconds() + n_epochs) / 7200) + 1
+    with tempfile.TemporaryDirectory() as directory:
+        # The manager finds the broadcast file where it would have downloaded it, so nothing is fetched
+        data_directory = os.path.join(directory, 'data')
+        nav_filepath = os.path.splitext(EphemerisManager(data_directory).file_location(
+            EphemerisManager.select_files(start.tz_localize('UTC').to_pydatetime(), {'G'})[0])[3])[0]
+        log_filepath = os.path.join(directory, 'gnss_log.txt')
+        records = broadcast_records(ephemeris, start.normalize(), n_records)
+        _, generate_time = timed(write_rinex_nav, records, nav_filepath)
+        truth, log_time = timed(write_gnss_log, log_filepath, records, start, n_epochs, speed=speed, noise=noise,
+                                seed=seed)
+        log_size = os.path.getsize(log_filepath)
+        # The first run parses the broadcast file, later ones read the cache it leaves
+        kml_filepath = os.path.join(directory, 'track.kml')
+        with contextlib.redirect_stdout(io.StringIO()):
+            runs = [run_pipeline(log_filepath, data_directory, kml_filepath) for _ in range(repeats)]
+            peak_memory, _, _ = run_pipeline(log_filepath, data_directory, kml_filepath, trace_memory=True)
+    _, coordinates, rows = runs[0]
+    seconds = {name: min(run[0][name] for run in runs) for name in peak_memory}
+    stages = {name: {'seconds': seconds[name], 'epochs_per_second': n_epochs / seconds[name],
+                     'peak_memory_mb': peak_memory[name]} for name in seconds}
+
+    solved = pd.to_datetime(pd.Index(list(coordinates)), utc=True).tz_localize(None)
+    epochs = np.round((solved - start).total_seconds().to_numpy()).astype(int)
+    positions = np.array([coords[:3] for coords in coordinates.values()], dtype=float).reshape(-1, 3)
+    errors = np.linalg.norm(positions - truth[epochs], axis=1)
+    total = sum(result['seconds'] for result in stages.values())
+    return {
+        'commit': git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'config': {'epochs': n_epochs, 'satellites': n_sats, 'noise_m': noise, 'speed_mps': speed, 'seed': seed,
+                   'repeats': repeats},
+        'log': {'raw_rows': rows, 'bytes': log_size, 'generate_seconds': generate_time + log_time},
+        'stages': stages,
+        'total': {'seconds': total, 'epochs_per_second': n_epochs / total,
+                  'peak_memory_mb': max(result['peak_memory_mb'] for result in stages.values())},
+        'position_error_m': {'solved_epochs': int(errors.size), 'mean': float(errors.mean()),
+                             'rms': float(np.sqrt((errors ** 2).mean())), 'p95': float(np.percentile(errors, 95)),
+                             'max': float(errors.max())},
+    }
+
+
+def print_end_to_end(results, baseline=None):
+    # baseline is an earlier benchmark_end_to_end result, each stage's time is shown relative to it
+    config = results['config']
+    print(f"end to end, {config['epochs']} epochs, {config['satellites']} satellites, "
+          f"{results['log']['raw_rows']} Raw rows")
+    for name, result in list(results['stages'].items()) + [('total', results['total'])]:
+        line = f"  {name:<29}{result['seconds']:8.3f} s {result['epochs_per_second']:10.0f} epochs/s " \
+               f"{result['peak_memory_mb']:8.1f} MB peak"
+        previous = baseline and (baseline['total'] if name == 'total' else baseline['stages'].get(name))
+        if previous:
+            line += f"  ({result['seconds'] / previous['seconds'] - 1:+.0%} vs {baseline.get('commit')})"
+        print(line)
+    error = results['position_error_m']
+    print(f"  position error: mean {error['mean']:.2f} m, rms {error['rms']:.2f} m, p95 {error['p95']:.2f} m, "
+          f"max {error['max']:.2f} m over {error['solved_epochs']} epochs")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the positioning pipeline on synthetic data')
+    parser.add_argument('--epochs', type=int, default=3600, help='length of the end-to-end log at 1 Hz')
+    parser.add_argument('--satellites', type=int, default=32, help='satellites in the synthetic constellation')
+    parser.add_argument('--noise', type=float, default=1.0, help='pseudorange noise, meters')
+    parser.add_argument('--speed', type=float, default=10.0, help='receiver speed, m/s')
+    parser.add_argument('--repeats', type=int, default=3, help='end-to-end runs, the best time of each stage is kept')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the end-to-end results')
+    parser.add_argument('--baseline', help='earlier JSON results to compare the stage timings with')
+    parser.add_argument('--skip-micro', action='store_true', help='only run the end-to-end benchmark')
+    args = parser.parse_args()
+
+    if not args.skip_micro:
+        benchmark_trilateration()
+        benchmark_satellite_position()
+        benchmark_orbit_cache()
+        benchmark_rinex_parser()
+    results = benchmark_end_to_end(args.epochs, args.satellites, args.noise, args.speed, repeats=args.repeats)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_end_to_end(results, baseline)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to: {args.output}")
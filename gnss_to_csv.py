@@ -1,10 +1,18 @@
 import os
-import csv
+import io
+import glob
+import time
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 import pandas as pd
 import numpy as np
 
-from gnssutils.ephemeris_manager import EphemerisManager
+from gnssutils.ephemeris_manager import EphemerisManager, PARAMETER_FIELDS
+from gnssutils.shared_arrays import share_arrays, attach_arrays, release
+from gnssutils.columnar_io import FORMATS, FrameWriter
+from gnssutils.log_store import LogStore, open_store
 
 pd.options.mode.chained_assignment = None
 
@@ -12,55 +20,188 @@ pd.options.mode.chained_assignment = None
 WEEKSEC = 604800
 LIGHTSPEED = 2.99792458e8
 GPS_EPOCH = datetime(1980, 1, 6, 0, 0, 0)
+GM = 3.986005e14
+OMEGA_E_DOT = 7.2921151467e-5
+KEPLER_TOLERANCE = 1e-8
+KEPLER_MAX_ITERATIONS = 20
+
+# Multi-GNSS. Android ConstellationType to RINEX system letter; GPS only unless asked for more
+CONSTELLATION_TYPES = {1: 'G', 3: 'R', 4: 'J', 5: 'C', 6: 'E'}
+DEFAULT_CONSTELLATIONS = 'G'
+# Android measurement State bits saying the transmit time is fully resolved
+STATE_TOW_DECODED = 8
+STATE_TOW_KNOWN = 16384
+STATE_GLO_TOD_DECODED = 128
+STATE_GLO_TOD_KNOWN = 32768
+DAYSEC = 86400
+LEAP_SECONDS = 18  # GPS - UTC, for GLONASS time when neither the log nor the ephemeris has it
+BDT_OFFSET = 14.0  # GPS time - BeiDou time, seconds
+# Keplerian systems: (gravitational constant, Earth rotation rate) of each system's ICD
+KEPLER_CONSTANTS = {'G': (GM, OMEGA_E_DOT), 'J': (GM, OMEGA_E_DOT), 'E': (3.986004418e14, 7.2921151467e-5),
+                    'C': (3.986004418e14, 7.292115e-5)}
+BEIDOU_GEO = {1, 2, 3, 4, 5, 59, 60, 61, 62, 63}  # PRNs of BeiDou geostationary satellites
+# GLONASS PZ-90 constants
+GLONASS_GM = 3.9860044e14
+GLONASS_RADIUS = 6378136.0
+GLONASS_J2 = 1.0826257e-3
+GLONASS_OMEGA = 7.292115e-5
+GLONASS_STEP = 60.0  # seconds, longest Runge-Kutta step
+# Orbit interpolation: exact states every ORBIT_STEP seconds of each ephemeris record, cubic Hermite
+# in between (below a millimeter and 0.1 mm/s, see benchmark.py). Only worth it for GLONASS, whose
+# Runge-Kutta integration costs far more than the interpolation (about 20x less time for the orbits).
+# The Keplerian kernel is vectorized over whole chunks and costs about the same as the interpolation,
+# so GPS, Galileo, BeiDou and QZSS are computed exactly. Since the other conversion stages stay as they
+# are, a GLONASS log converts a few times faster end to end, not by the orbit speedup.
+ORBIT_STEP = 60.0
+ORBIT_CACHE_SYSTEMS = 'R'
+ORBIT_CACHE_RECORDS = 2048  # ephemeris records kept by an OrbitCache, least recently used are dropped
+ORBIT_KEY_FIELDS = ['t_oc', 't_oe', 'M_0', 'X']  # change with every new upload of a satellite's ephemeris
+
+# Fixed dtypes for the GnssLogger Raw columns, anything not listed is kept as a string
+RAW_INT_COLUMNS = ['utcTimeMillis', 'TimeNanos', 'LeapSecond', 'FullBiasNanos', 'HardwareClockDiscontinuityCount',
+                   'Svid', 'State', 'ReceivedSvTimeNanos', 'AccumulatedDeltaRangeState', 'CarrierCycles',
+                   'MultipathIndicator', 'ConstellationType', 'ChipsetElapsedRealtimeNanos']
+RAW_FLOAT_COLUMNS = ['TimeUncertaintyNanos', 'BiasNanos', 'BiasUncertaintyNanos', 'DriftNanosPerSecond',
+                     'DriftUncertaintyNanosPerSecond', 'TimeOffsetNanos', 'ReceivedSvTimeUncertaintyNanos', 'Cn0DbHz',
+                     'PseudorangeRateMetersPerSecond', 'PseudorangeRateUncertaintyMetersPerSecond',
+                     'AccumulatedDeltaRangeMeters', 'AccumulatedDeltaRangeUncertaintyMeters', 'CarrierFrequencyHz',
+                     'CarrierPhase', 'CarrierPhaseUncertainty', 'SnrInDb', 'AgcDb', 'BasebandCn0DbHz',
+                     'FullInterSignalBiasNanos', 'FullInterSignalBiasUncertaintyNanos',
+                     'SatelliteInterSignalBiasNanos', 'SatelliteInterSignalBiasUncertaintyNanos']
+RAW_DTYPES = {**{col: 'int64' for col in RAW_INT_COLUMNS}, **{col: 'float64' for col in RAW_FLOAT_COLUMNS}}
+CHUNK_ROWS = 100000
+EPOCHS_PER_TASK = 500
+
+
+def parse_raw_chunk(lines, columns):
+    dtypes = {col: 'Int64' if col in RAW_INT_COLUMNS else 'float64' if col in RAW_FLOAT_COLUMNS else str
+              for col in columns}
+    chunk = pd.read_csv(io.StringIO(''.join(lines)), header=None, names=columns, dtype=dtypes)
+    # Missing integer fields become 0, the same as preprocess_measurements' fillna(0)
+    for col in columns:
+        if col in RAW_INT_COLUMNS:
+            chunk[col] = chunk[col].fillna(0).astype('int64')
+    return chunk
+
+
+def read_data_chunks(input_filepath, chunk_rows=CHUNK_ROWS):
+    # Stream the Raw records as typed DataFrames of at most chunk_rows rows, from a text log or
+    # from the directory of its log store
+    if os.path.isdir(input_filepath):
+        yield from LogStore(input_filepath).iter_chunks('Raw', chunk_rows)
+        return
+    columns, lines = None, []
+    with open(input_filepath) as logfile:
+        for line in logfile:
+            if line.startswith('#'):
+                header = line[1:].strip().split(',')
+                if 'Raw' in header[0]:
+                    columns = header[1:]
+            elif line.startswith('Raw,'):
+                lines.append(line[4:])
+                if len(lines) >= chunk_rows:
+                    yield parse_raw_chunk(lines, columns)
+                    lines = []
+    if lines:
+        yield parse_raw_chunk(lines, columns)
+
 
 def read_data(input_filepath):
-    measurements, android_fixes = [], []
-    with open(input_filepath) as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            if row[0][0] == '#':
-                if 'Fix' in row[0]:
-                    android_fixes = [row[1:]]
-                elif 'Raw' in row[0]:
-                    measurements = [row[1:]]
-            else:
-                if row[0] == 'Fix':
-                    android_fixes.append(row[1:])
-                elif row[0] == 'Raw':
-                    measurements.append(row[1:])
-
-    return pd.DataFrame(measurements[1:], columns=measurements[0])
-
-def preprocess_measurements(measurements):
-    measurements.loc[measurements['Svid'].str.len() == 1, 'Svid'] = '0' + measurements['Svid']
-    measurements['Constellation'] = measurements['ConstellationType'].map({'1': 'G', '3': 'R'})
-    measurements['SvName'] = measurements['Constellation'] + measurements['Svid']
-    measurements = measurements[measurements['Constellation'] == 'G']
+    return pd.concat(read_data_chunks(input_filepath), ignore_index=True)
+
+
+def ingest(input_filepath):
+    # Memory-mapped store of a log with the Raw columns typed as parse_raw_chunk types them,
+    # returns its directory for read_data_chunks. Ingested once, reused until the log changes.
+    return open_store(input_filepath, dtypes={'Raw': RAW_DTYPES}).directory
+
+
+def preprocess_measurements(measurements, state=None, constellations=DEFAULT_CONSTELLATIONS):
+    # state carries the epoch counter and receiver clock reference between chunks of the same log.
+    # constellations holds the RINEX letters of the systems to keep, e.g. 'GREC'.
+    if state is None:
+        state = {}
+    measurements['Constellation'] = measurements['ConstellationType'].map(CONSTELLATION_TYPES)
+    measurements['SvName'] = measurements['Constellation'] + measurements['Svid'].astype(str).str.zfill(2)
+    measurements = measurements[measurements['Constellation'].isin(list(constellations))]
     numeric_cols = ['Cn0DbHz', 'TimeNanos', 'FullBiasNanos', 'ReceivedSvTimeNanos',
                     'PseudorangeRateMetersPerSecond', 'ReceivedSvTimeUncertaintyNanos',
                     'BiasNanos', 'TimeOffsetNanos']
     for col in numeric_cols:
         measurements[col] = pd.to_numeric(measurements[col], errors='coerce').fillna(0)
+    if measurements.empty:
+        return measurements
 
     measurements['GpsTimeNanos'] = measurements['TimeNanos'] - (
                 measurements['FullBiasNanos'] - measurements['BiasNanos'])
     measurements['UnixTime'] = pd.to_datetime(measurements['GpsTimeNanos'], utc=True, origin=GPS_EPOCH)
     measurements['Epoch'] = 0
     time_diff = measurements['UnixTime'] - measurements['UnixTime'].shift()
+    if 'last_time' in state:
+        time_diff.iloc[0] = measurements['UnixTime'].iloc[0] - state['last_time']
     measurements.loc[time_diff > timedelta(milliseconds=200), 'Epoch'] = 1
-    measurements['Epoch'] = measurements['Epoch'].cumsum()
+    measurements['Epoch'] = measurements['Epoch'].cumsum() + state.get('epoch', 0)
+    state['last_time'] = measurements['UnixTime'].iloc[-1]
+    state['epoch'] = measurements['Epoch'].iloc[-1]
 
+    if 'clock_reference' not in state:
+        state['clock_reference'] = measurements['FullBiasNanos'].iloc[0] + measurements['BiasNanos'].iloc[0]
     measurements['tRxGnssNanos'] = measurements['TimeNanos'] + measurements['TimeOffsetNanos'] - \
-                                   (measurements['FullBiasNanos'].iloc[0] + measurements['BiasNanos'].iloc[0])
+                                   state['clock_reference']
     measurements['GpsWeekNumber'] = np.floor(1e-9 * measurements['tRxGnssNanos'] / WEEKSEC)
     measurements['tRxSeconds'] = 1e-9 * measurements['tRxGnssNanos'] - WEEKSEC * measurements['GpsWeekNumber']
     measurements['tTxSeconds'] = 1e-9 * (measurements['ReceivedSvTimeNanos'] + measurements['TimeOffsetNanos'])
+    if set(constellations) != {'G'}:
+        measurements = system_transmit_times(measurements)
     measurements['prSeconds'] = measurements['tRxSeconds'] - measurements['tTxSeconds']
 
     measurements['PrM'] = LIGHTSPEED * measurements['prSeconds']
     measurements['PrSigmaM'] = LIGHTSPEED * 1e-9 * measurements['ReceivedSvTimeUncertaintyNanos']
     return measurements
 
+
+def system_transmit_times(measurements):
+    # Put every system's transmit time on the GPS seconds of week scale of tRxSeconds. BeiDou
+    # time runs 14 s behind GPS, GLONASS counts the time of day in UTC + 3 h. Rows of the other systems
+    # whose transmit time is only known modulo a code period are dropped, GPS rows are left as before.
+    system = measurements['Constellation']
+    glonass = system == 'R'
+    state = measurements['State'].astype('int64')
+    decoded = np.where(glonass, state & (STATE_GLO_TOD_DECODED | STATE_GLO_TOD_KNOWN),
+                       state & (STATE_TOW_DECODED | STATE_TOW_KNOWN)) != 0
+    measurements = measurements.loc[decoded | (system == 'G')]
+    glonass = measurements['Constellation'] == 'R'
+    measurements.loc[measurements['Constellation'] == 'C', 'tTxSeconds'] += BDT_OFFSET
+    if glonass.any():
+        leap_seconds = pd.to_numeric(measurements.loc[glonass, 'LeapSecond'], errors='coerce').fillna(0)
+        leap_seconds = leap_seconds.where(leap_seconds > 0, LEAP_SECONDS)
+        time_of_day = measurements.loc[glonass, 'tTxSeconds'] - 3 * 3600 + leap_seconds
+        # Range of the day-of-week ambiguity, the travel time is far below half a day
+        travel_time = (measurements.loc[glonass, 'tRxSeconds'] - time_of_day + DAYSEC / 2) % DAYSEC - DAYSEC / 2
+        measurements.loc[glonass, 'tTxSeconds'] = measurements.loc[glonass, 'tRxSeconds'] - travel_time
+    return measurements
+
+
+def preprocess_chunks(chunks, constellations=DEFAULT_CONSTELLATIONS):
+    # Yield preprocessed frames that only hold complete epochs, an epoch split across
+    # chunk boundaries is held back and joined with the next chunk
+    state = {}
+    pending = None
+    for chunk in chunks:
+        measurements = preprocess_measurements(chunk, state, constellations)
+        if measurements.empty:
+            continue
+        if pending is not None:
+            measurements = pd.concat([pending, measurements], ignore_index=True)
+        last_epoch = measurements['Epoch'].iloc[-1]
+        complete = measurements['Epoch'] != last_epoch
+        pending = measurements.loc[~complete]
+        if complete.any():
+            yield measurements.loc[complete]
+    if pending is not None:
+        yield pending
+
+
 def calculate_satellite_position(ephemeris, transmit_time):
     mu = 3.986005e14
     OmegaDot_e = 7.2921151467e-5
@@ -76,7 +217,7 @@ def calculate_satellite_position(ephemeris, transmit_time):
     E_k = M_k
     err = pd.Series(data=[1] * len(sv_position.index))
     i = 0
-    while err.abs().min() > 1e-8 and i < 10:
+    while err.abs().max() > 1e-8 and i < 10:
         new_vals = M_k + ephemeris['e'] * np.sin(E_k)
         err = new_vals - E_k
         E_k = new_vals
@@ -117,43 +258,519 @@ def calculate_satellite_position(ephemeris, transmit_time):
     sv_position['z_k'] = y_k_prime * np.sin(i_k)
     return sv_position
 
-def parse_gnss_log(input_filepath, output_path):
-    columns_to_keep = ['UnixTime', 'SvName', 'Sat.X', 'Sat.Y', 'Sat.Z', 'Pseudo-Range', 'Cn0DbHz']
-    rename_columns = {'UnixTime': 'GPS time', 'SvName': 'SatPRN (ID)', 'Cn0DbHz': 'CN0'}
-    unparsed_measurements = read_data(input_filepath)
-    measurements = preprocess_measurements(unparsed_measurements)
+def ephemeris_to_arrays(ephemeris):
+    # Struct-of-arrays view of an ephemeris DataFrame (indexed by satellite) for the position kernels,
+    # see parameters_to_arrays
+    parameters = ephemeris.reindex(columns=PARAMETER_FIELDS).to_numpy(dtype=float)
+    return parameters_to_arrays(parameters, ephemeris.index.to_numpy(dtype=str))
+
+
+def parameters_to_arrays(parameters, svs):
+    # Struct-of-arrays view of EphemerisManager.parameters rows for satellites svs.
+    # Besides the fields, each row gets its system's constants: 'GM', 'OMEGA_E_DOT', 'time_offset'
+    # (GPS minus system time, s) and 'geo' for BeiDou geostationary satellites. Fields a system
+    # doesn't broadcast are NaN.
+    eph = {field: parameters[:, column] for column, field in enumerate(PARAMETER_FIELDS)}
+    svs = pd.Index(svs)
+    systems = svs.str[0].to_numpy(dtype=object)
+    constants = np.array([KEPLER_CONSTANTS.get(system, (GM, OMEGA_E_DOT)) for system in systems]).reshape(-1, 2)
+    eph['GM'], eph['OMEGA_E_DOT'] = constants[:, 0], constants[:, 1]
+    eph['time_offset'] = np.where(systems == 'C', BDT_OFFSET, 0.0)
+    prns = pd.to_numeric(svs.str[1:], errors='coerce')
+    eph['geo'] = (systems == 'C') & np.isin(prns, list(BEIDOU_GEO))
+    eph['system'] = systems
+    eph['sv'] = svs.to_numpy(dtype=str)
+    return eph
+
+
+def satellite_position_kernel(eph, transmit_time, velocity=False):
+    # Satellite ECEF position and clock bias from broadcast Keplerian elements (GPS, QZSS, Galileo,
+    # BeiDou). eph maps each EPHEMERIS_FIELDS name (see ephemeris_manager) to an array over satellites,
+    # optionally with per-satellite 'GM', 'OMEGA_E_DOT' and 'geo' (else GPS constants). transmit_time
+    # is seconds of the week in the satellite's system time, shaped (n_sats,) or (n_epochs, n_sats);
+    # x, y, z and delT_sv come back shaped like transmit_time. With velocity=True the time derivatives vx, vy, vz
+    # (m/s, ECEF) and the clock drift (s/s) follow.
+    transmit_time = np.asarray(transmit_time, dtype=float)
+    gm = eph.get('GM', GM)
+    omega_e = eph.get('OMEGA_E_DOT', OMEGA_E_DOT)
+    geo = eph.get('geo')
+    geo = geo if geo is not None and np.any(geo) else None
+    t_k = transmit_time - eph['t_oe']
+    A = eph['sqrtA'] ** 2
+    n = np.sqrt(gm / A ** 3) + eph['deltaN']
+    M_k = eph['M_0'] + n * t_k
+    e = eph['e']
+
+    # Fixed-point iteration on Kepler's equation until every satellite has converged
+    E_k = M_k
+    for _ in range(KEPLER_MAX_ITERATIONS):
+        new_vals = M_k + e * np.sin(E_k)
+        err = np.abs(new_vals - E_k)
+        E_k = new_vals
+        if not np.nanmax(err, initial=0.0) > KEPLER_TOLERANCE:
+            break
+
+    sinE_k = np.sin(E_k)
+    cosE_k = np.cos(E_k)
+    delT_oc = transmit_time - eph['t_oc']
+    delT_sv = eph['SVclockBias'] + eph['SVclockDrift'] * delT_oc + eph['SVclockDriftRate'] * delT_oc ** 2
+
+    v_k = np.arctan2(np.sqrt(1 - e ** 2) * sinE_k, cosE_k - e)
+    Phi_k = v_k + eph['omega']
+    sin2Phi_k = np.sin(2 * Phi_k)
+    cos2Phi_k = np.cos(2 * Phi_k)
+
+    u_k = Phi_k + eph['C_us'] * sin2Phi_k + eph['C_uc'] * cos2Phi_k
+    r_k = A * (1 - e * cosE_k) + eph['C_rs'] * sin2Phi_k + eph['C_rc'] * cos2Phi_k
+    i_k = eph['i_0'] + eph['C_is'] * sin2Phi_k + eph['C_ic'] * cos2Phi_k + eph['IDOT'] * t_k
+
+    x_k_prime = r_k * np.cos(u_k)
+    y_k_prime = r_k * np.sin(u_k)
+    Omega_k = eph['Omega_0'] + (eph['OmegaDot'] - omega_e) * t_k - omega_e * eph['t_oe']
+    if geo is not None:
+        # BeiDou GEO elements are inertial, the Earth's rotation is applied after the rotation below
+        Omega_k = np.where(geo, eph['Omega_0'] + eph['OmegaDot'] * t_k - omega_e * eph['t_oe'], Omega_k)
+    sinOmega_k = np.sin(Omega_k)
+    cosOmega_k = np.cos(Omega_k)
+    cosi_k = np.cos(i_k)
+
+    x_k = x_k_prime * cosOmega_k - y_k_prime * cosi_k * sinOmega_k
+    y_k = x_k_prime * sinOmega_k + y_k_prime * cosi_k * cosOmega_k
+    z_k = y_k_prime * np.sin(i_k)
+    if geo is not None:
+        # Rotate by -5 degrees about x, then by the Earth's rotation since t_oe about z (BeiDou ICD)
+        tilt, spin = np.radians(-5.0), omega_e * t_k
+        y_tilted = y_k * np.cos(tilt) + z_k * np.sin(tilt)
+        z_tilted = -y_k * np.sin(tilt) + z_k * np.cos(tilt)
+        x_geo = x_k * np.cos(spin) + y_tilted * np.sin(spin)
+        y_geo = -x_k * np.sin(spin) + y_tilted * np.cos(spin)
+        x_k, y_k, z_k = np.where(geo, x_geo, x_k), np.where(geo, y_geo, y_k), np.where(geo, z_tilted, z_k)
+    if not velocity:
+        return x_k, y_k, z_k, delT_sv
+
+    # Analytic derivatives of the orbit above
+    E_k_dot = n / (1 - e * cosE_k)
+    v_k_dot = E_k_dot * np.sqrt(1 - e ** 2) / (1 - e * cosE_k)
+    u_k_dot = v_k_dot * (1 + 2 * (eph['C_us'] * cos2Phi_k - eph['C_uc'] * sin2Phi_k))
+    r_k_dot = A * e * sinE_k * E_k_dot + 2 * v_k_dot * (eph['C_rs'] * cos2Phi_k - eph['C_rc'] * sin2Phi_k)
+    i_k_dot = eph['IDOT'] + 2 * v_k_dot * (eph['C_is'] * cos2Phi_k - eph['C_ic'] * sin2Phi_k)
+    Omega_k_dot = eph['OmegaDot'] - omega_e
+
+    x_k_prime_dot = r_k_dot * np.cos(u_k) - y_k_prime * u_k_dot
+    y_k_prime_dot = r_k_dot * np.sin(u_k) + x_k_prime * u_k_dot
+    vx_k = x_k_prime_dot * cosOmega_k - y_k_prime_dot * cosi_k * sinOmega_k \
+        + y_k_prime * np.sin(i_k) * sinOmega_k * i_k_dot - y_k * Omega_k_dot
+    vy_k = x_k_prime_dot * sinOmega_k + y_k_prime_dot * cosi_k * cosOmega_k \
+        - y_k_prime * np.sin(i_k) * cosOmega_k * i_k_dot + x_k * Omega_k_dot
+    vz_k = y_k_prime_dot * np.sin(i_k) + y_k_prime * cosi_k * i_k_dot
+    delT_sv_dot = eph['SVclockDrift'] + 2 * eph['SVclockDriftRate'] * delT_oc
+    if geo is not None:
+        # Central difference for the rotated GEO orbits
+        ahead = satellite_position_kernel(eph, transmit_time + 0.5)
+        behind = satellite_position_kernel(eph, transmit_time - 0.5)
+        vx_k, vy_k, vz_k = (np.where(geo, ahead[i] - behind[i], v) for i, v in enumerate((vx_k, vy_k, vz_k)))
+    return x_k, y_k, z_k, delT_sv, vx_k, vy_k, vz_k, delT_sv_dot
+
+
+def glonass_acceleration(position, velocity, lunisolar):
+    # PZ-90 equations of motion in the rotating Earth frame: central field, J2 and the broadcast
+    # lunisolar acceleration. Arrays are (3, n).
+    x, y, z = position
+    r2 = (position ** 2).sum(axis=0)
+    r = np.sqrt(r2)
+    central = -GLONASS_GM / (r2 * r)
+    oblate = -1.5 * GLONASS_J2 * GLONASS_GM * GLONASS_RADIUS ** 2 / (r2 ** 2 * r)
+    z2 = 5 * z ** 2 / r2
+    w2 = GLONASS_OMEGA ** 2
+    return np.array([
+        (central + oblate * (1 - z2) + w2) * x + 2 * GLONASS_OMEGA * velocity[1] + lunisolar[0],
+        (central + oblate * (1 - z2) + w2) * y - 2 * GLONASS_OMEGA * velocity[0] + lunisolar[1],
+        (central + oblate * (3 - z2)) * z + lunisolar[2],
+    ])
+
+
+def glonass_position_kernel(eph, transmit_time, velocity=False):
+    # GLONASS satellite position and clock bias by fourth-order Runge-Kutta integration of the
+    # broadcast state from its reference time. All satellites step together, each with its own step
+    # size of at most GLONASS_STEP. eph maps GLONASS_FIELDS (see ephemeris_manager), 't_oc' (the
+    # record's UTC time as seconds of week) and the clock fields to arrays over satellites;
+    # transmit_time is GPS seconds of week.
+    # Returns like satellite_position_kernel.
+    transmit_time = np.asarray(transmit_time, dtype=float)
+    leap_seconds = np.where(np.isfinite(eph['Leap Seconds']), eph['Leap Seconds'], LEAP_SECONDS)
+    t_b = eph['t_oc'] + leap_seconds
+    dt = (transmit_time - t_b + WEEKSEC / 2) % WEEKSEC - WEEKSEC / 2
+    shape = dt.shape
+    dt = dt.ravel()
+
+    def broadcast(field):
+        return np.broadcast_to(eph[field], shape).ravel()
+
+    position = np.array([broadcast('X'), broadcast('Y'), broadcast('Z')])
+    speed = np.array([broadcast('dX'), broadcast('dY'), broadcast('dZ')])
+    lunisolar = np.array([broadcast('dX2'), broadcast('dY2'), broadcast('dZ2')])
+    n_steps = int(np.ceil(np.nanmax(np.abs(dt), initial=0.0) / GLONASS_STEP)) or 1
+    h = np.nan_to_num(dt / n_steps)
+    for _ in range(n_steps):
+        k1_p, k1_v = speed, glonass_acceleration(position, speed, lunisolar)
+        k2_p = speed + h / 2 * k1_v
+        k2_v = glonass_acceleration(position + h / 2 * k1_p, k2_p, lunisolar)
+        k3_p = speed + h / 2 * k2_v
+        k3_v = glonass_acceleration(position + h / 2 * k2_p, k3_p, lunisolar)
+        k4_p = speed + h * k3_v
+        k4_v = glonass_acceleration(position + h * k3_p, k4_p, lunisolar)
+        position = position + h / 6 * (k1_p + 2 * k2_p + 2 * k3_p + k4_p)
+        speed = speed + h / 6 * (k1_v + 2 * k2_v + 2 * k3_v + k4_v)
+
+    # RINEX stores -TauN and GammaN, so the clock model has the same sign convention as GPS
+    delT_sv = (broadcast('SVclockBias') + broadcast('SVrelFreqBias') * dt).reshape(shape)
+    x_k, y_k, z_k = (coordinate.reshape(shape) for coordinate in position)
+    if not velocity:
+        return x_k, y_k, z_k, delT_sv
+    vx_k, vy_k, vz_k = (coordinate.reshape(shape) for coordinate in speed)
+    delT_sv_dot = broadcast('SVrelFreqBias').reshape(shape)
+    return x_k, y_k, z_k, delT_sv, vx_k, vy_k, vz_k, delT_sv_dot
+
+
+def satellite_states(eph, transmit_time):
+    # Positions, clock biases, velocities and clock drifts for rows of any mix of systems, as
+    # satellite_position_kernel(velocity=True) returns them. eph is an ephemeris_to_arrays result
+    # over the rows and transmit_time their GPS seconds of week. Each kind of orbit is one kernel call.
+    transmit_time = np.asarray(transmit_time, dtype=float)
+    glonass = eph['system'] == 'R'
+    if not glonass.any():
+        return satellite_position_kernel(eph, transmit_time - eph['time_offset'], velocity=True)
+    results = [np.full(transmit_time.shape, np.nan) for _ in range(8)]
+    for kernel, rows in ((satellite_position_kernel, ~glonass), (glonass_position_kernel, glonass)):
+        if rows.any():
+            subset = {field: values[rows] for field, values in eph.items()}
+            for result, values in zip(results, kernel(subset, transmit_time[rows] - subset['time_offset'],
+                                                      velocity=True)):
+                result[rows] = values
+    return tuple(results)
+
+
+class OrbitCache():
+    # Satellite states from satellite_states, evaluated exactly on a grid of ORBIT_STEP seconds from
+    # each ephemeris record's t_oc and interpolated in between. Grid nodes are computed once and kept
+    # across calls, so a long log or a stream of epochs pays for one exact evaluation per satellite
+    # and step. A record is identified by its satellite and ORBIT_KEY_FIELDS, so a new ephemeris
+    # (IODE change) starts a new grid instead of reusing the old one. Satellites of other systems
+    # than systems are computed exactly. It serves the log conversion (stream_gnss_log and its
+    # workers); the live server takes the phone's own fix and computes no satellite states.
+    def __init__(self, step=ORBIT_STEP, max_records=ORBIT_CACHE_RECORDS, systems=ORBIT_CACHE_SYSTEMS):
+        self.step = step
+        self.max_records = max_records
+        self.systems = list(systems)
+        self.records = OrderedDict()  # record key -> (first node index, (n_nodes, 8) exact states)
+
+    def states(self, eph, transmit_time):
+        # Same arguments and results as satellite_states, for 1-D rows
+        transmit_time = np.asarray(transmit_time, dtype=float)
+        cached = np.isin(eph['system'], self.systems)
+        if not cached.any():
+            return satellite_states(eph, transmit_time)
+        if cached.all():
+            return self.interpolate(eph, transmit_time)
+        results = np.full((8, transmit_time.size), np.nan)
+        for method, rows in ((satellite_states, ~cached), (self.interpolate, cached)):
+            subset = {field: values[rows] for field, values in eph.items()}
+            results[:, rows] = method(subset, transmit_time[rows])
+        return tuple(results)
+
+    def interpolate(self, eph, transmit_time):
+        # states for rows that are all interpolated
+        results = np.full((8, transmit_time.size), np.nan)
+        usable = np.flatnonzero(np.isfinite(eph['t_oc']) & np.isfinite(transmit_time))
+        if not usable.size:
+            return tuple(results)
+
+        # Number the records by hashing their key columns, as a sort of the rows would cost more than
+        # the interpolation
+        inverse = pd.factorize(eph['sv'][usable])[0]
+        for field in ORBIT_KEY_FIELDS:
+            codes, uniques = pd.factorize(eph[field][usable], use_na_sentinel=False)
+            inverse = pd.factorize(inverse * (len(uniques) + 1) + codes)[0]
+        n_records = inverse.max() + 1
+        first_rows = np.empty(n_records, dtype=np.int64)
+        first_rows[inverse[::-1]] = np.arange(usable.size)[::-1]
+        first_rows = usable[first_rows]
+        keys = [(eph['sv'][row],) + tuple(np.nan_to_num(eph[field][row], nan=-1.0) for field in ORBIT_KEY_FIELDS)
+                for row in first_rows]
+        # Interval of each row on its record's grid, nodes at t_oc + k * step
+        offset = (transmit_time[usable] - eph['t_oc'][usable]) / self.step
+        node = np.floor(offset).astype(np.int64)
+        lowest = np.full(n_records, np.iinfo(np.int64).max)
+        highest = np.full(n_records, np.iinfo(np.int64).min)
+        np.minimum.at(lowest, inverse, node)
+        np.maximum.at(highest, inverse, node + 1)
+
+        self.fill(eph, first_rows, keys, lowest, highest)
+        tables, bases, base = [], np.empty(n_records, dtype=np.int64), 0
+        for i, key in enumerate(keys):
+            first, table = self.records[key]
+            self.records.move_to_end(key)
+            tables.append(table)
+            bases[i] = base - first
+            base += len(table)
+        table = np.concatenate(tables)
+        index = bases[inverse] + node
+        results[:, usable] = hermite(table[index], table[index + 1], offset - node, self.step).T
+        while len(self.records) > self.max_records:
+            self.records.popitem(last=False)
+        return tuple(results)
+
+    def fill(self, eph, rows, keys, lowest, highest):
+        # Extend each record's grid to cover nodes lowest..highest, the missing nodes of all records
+        # are computed in one satellite_states call. rows holds a row of eph for each record.
+        requests = []
+        for row, key, low, high in zip(rows, keys, lowest, highest):
+            if key in self.records:
+                first, table = self.records[key]
+                missing = np.r_[np.arange(low, first), np.arange(first + len(table), high + 1)]
+            else:
+                missing = np.arange(low, high + 1)
+            if missing.size:
+                requests.append((row, key, missing))
+        if not requests:
+            return
+        rows = np.concatenate([np.full(nodes.size, row) for row, _, nodes in requests])
+        nodes = np.concatenate([nodes for _, _, nodes in requests])
+        subset = {field: values[rows] for field, values in eph.items()}
+        states = np.array(satellite_states(subset, subset['t_oc'] + nodes * self.step)).T
+        start = 0
+        for _, key, nodes in requests:
+            new_states = states[start:start + nodes.size]
+            start += nodes.size
+            if key in self.records:
+                first, table = self.records[key]
+                before = nodes < first
+                self.records[key] = (min(first, nodes[0]),
+                                     np.concatenate([new_states[before], table, new_states[~before]]))
+            else:
+                self.records[key] = (nodes[0], new_states)
+
+
+def hermite(start, end, fraction, step):
+    # Cubic Hermite interpolation between two (n, 8) satellite_states rows at fraction (n,) of the
+    # step. The first four columns (position, clock) are interpolated from themselves and their
+    # derivatives in the last four (velocity, clock drift), which come from the cubic's slope.
+    s = fraction[:, None]
+    s2, s3 = s ** 2, s ** 3
+    p0, p1 = start[:, :4], end[:, :4]
+    m0, m1 = start[:, 4:] * step, end[:, 4:] * step
+    value = (2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * m0 + (3 * s2 - 2 * s3) * p1 + (s3 - s2) * m1
+    slope = ((6 * s2 - 6 * s) * (p0 - p1) + (3 * s2 - 4 * s + 1) * m0 + (3 * s2 - 2 * s) * m1) / step
+    return np.hstack([value, slope])
+
+
+def epoch_slices(epochs):
+    # Start/stop row positions of each run of equal values in an epoch-sorted array
+    boundaries = np.flatnonzero(epochs[1:] != epochs[:-1]) + 1
+    return np.r_[0, boundaries], np.r_[boundaries, len(epochs)]
+
+
+def process_epochs(measurements, manager, constellations=None, orbit_cache=None):
+    # Satellite positions and corrected pseudoranges for every usable epoch of a preprocessed frame.
+    # constellations are the systems to load ephemerides for, by default those of each epoch.
+    # With an OrbitCache the satellite states are interpolated from it instead of computed exactly.
+    selected = epoch_ephemerides(measurements, manager, constellations)
+    if selected is None:
+        return pd.DataFrame()
+    return satellite_frame(*selected, orbit_cache=orbit_cache)
+
+
+def epoch_ephemerides(measurements, manager, constellations=None):
+    # The rows of every usable epoch of a preprocessed frame with their GPS time strings and the
+    # parameters_to_arrays of each row's satellite, None when no epoch is usable
+    valid = measurements.loc[measurements['prSeconds'] < 0.1]
+    valid = valid.drop_duplicates(subset=['Epoch', 'SvName'])
+    svs = valid['SvName'].to_numpy()
+    unix_time = valid['UnixTime']
+    starts, stops = epoch_slices(valid['Epoch'].to_numpy())
+
+    rows, times, parameters = [], [], []
+    for start, stop in zip(starts, stops):
+        if stop - start <= 4:
+            continue
+        timestamp = unix_time.iloc[start].to_pydatetime(warn=False)
+        # Satellites without an ephemeris get NaN rows and so NaN positions
+        parameters.append(manager.get_parameters(timestamp, svs[start:stop].tolist(), constellations))
+        rows.append(np.arange(start, stop))
+        times.append(np.full(stop - start, timestamp.isoformat(), dtype=object))
+    if not rows:
+        return None
+    rows = np.concatenate(rows)
+    return valid.iloc[rows], np.concatenate(times), parameters_to_arrays(np.concatenate(parameters), svs[rows])
+
+
+def satellite_frame(rows, times, eph, orbit_cache=None):
+    # process_epochs output for an epoch_ephemerides result, with one kernel call per kind of orbit
+    # for all rows of all epochs
+    transmit_time = rows['tTxSeconds'].to_numpy()
+    if orbit_cache is not None:
+        x_k, y_k, z_k, delT_sv, vx_k, vy_k, vz_k, delT_sv_dot = orbit_cache.states(eph, transmit_time)
+    else:
+        x_k, y_k, z_k, delT_sv, vx_k, vy_k, vz_k, delT_sv_dot = satellite_states(eph, transmit_time)
+    return pd.DataFrame({
+        "GPS time": times,
+        "SatPRN (ID)": rows['SvName'].to_numpy(),
+        "Sat.X": x_k,
+        "Sat.Y": y_k,
+        "Sat.Z": z_k,
+        "Pseudo-Range": rows['PrM'].to_numpy() + LIGHTSPEED * delT_sv,
+        "CN0": rows['Cn0DbHz'].to_numpy(),
+        "Sat.VX": vx_k,
+        "Sat.VY": vy_k,
+        "Sat.VZ": vz_k,
+        "Pseudo-Range-Rate": rows['PseudorangeRateMetersPerSecond'].to_numpy() + LIGHTSPEED * delT_sv_dot,
+    })
+
+
+# Columns process_epochs needs, shipped to workers through shared memory
+EPOCH_COLUMNS = ['SvName', 'UnixTime', 'Epoch', 'prSeconds', 'tTxSeconds', 'PrM', 'Cn0DbHz',
+                 'PseudorangeRateMetersPerSecond']
+worker_manager = None
+worker_orbit_cache = None
+
+
+def process_epoch_range(shm_name, specs, start, stop, constellations=None, exact_orbits=False):
+    # Worker side of parallel_process_epochs, each process keeps one EphemerisManager and OrbitCache
+    global worker_manager, worker_orbit_cache
+    if worker_manager is None:
+        worker_manager = EphemerisManager("data")
+        worker_orbit_cache = OrbitCache()
+    arrays = attach_arrays(shm_name, specs, start, stop)
+    arrays['UnixTime'] = pd.to_datetime(arrays['UnixTime'], utc=True)
+    return process_epochs(pd.DataFrame(arrays), worker_manager, constellations,
+                          None if exact_orbits else worker_orbit_cache)
+
+
+def parallel_process_epochs(measurements, executor, epochs_per_task=EPOCHS_PER_TASK, constellations=None,
+                            exact_orbits=False):
+    # Split a preprocessed frame into contiguous epoch ranges and solve them on a process pool
+    arrays = {col: measurements[col].to_numpy() for col in EPOCH_COLUMNS}
+    arrays['SvName'] = arrays['SvName'].astype(str)
+    arrays['UnixTime'] = measurements['UnixTime'].dt.tz_localize(None).to_numpy().astype('datetime64[ns]')
+    starts, stops = epoch_slices(arrays['Epoch'])
+    task_starts = starts[::epochs_per_task]
+    task_stops = np.r_[task_starts[1:], len(arrays['Epoch'])]
+
+    shm, specs = share_arrays(arrays)
+    try:
+        frames = list(executor.map(process_epoch_range, [shm.name] * len(task_starts), [specs] * len(task_starts),
+                                   task_starts, task_stops, [constellations] * len(task_starts),
+                                   [exact_orbits] * len(task_starts)))
+    finally:
+        release(shm)
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def parse_gnss_log(input_filepath, output_path, chunk_rows=CHUNK_ROWS, workers=None, output_format='csv',
+                   constellations=DEFAULT_CONSTELLATIONS, exact_orbits=False):
+    # Convert a log into output_path plus the output_format's extension and return the written rows
+    # as one DataFrame. See stream_gnss_log, which does the same without keeping the rows.
+    frames = []
+    stream_gnss_log(input_filepath, output_path, chunk_rows, workers, output_format, constellations, exact_orbits,
+                    frames)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def stream_gnss_log(input_filepath, output_path, chunk_rows=CHUNK_ROWS, workers=None, output_format='csv',
+                    constellations=DEFAULT_CONSTELLATIONS, exact_orbits=False, frames=None):
+    # Convert a log chunk by chunk, each chunk is written as soon as it is done so memory stays bounded
+    # by chunk_rows whatever the log's length. Returns the number of rows written; with a frames list
+    # the chunks are also appended to it.
+    # workers > 1 solves the epochs of each chunk on a process pool. output_format is a FORMATS key,
+    # binary formats store int64 nanosecond GPS time. constellations are the RINEX letters of the
+    # systems to convert, e.g. 'GREC' for GPS, GLONASS, Galileo and BeiDou.
+    # Satellite states are interpolated by an OrbitCache unless exact_orbits is set.
     manager = EphemerisManager("data")
+    orbit_cache = None if exact_orbits else OrbitCache()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+
+    try:
+        with FrameWriter(output_path + FORMATS[output_format]) as writer:
+            for measurements in preprocess_chunks(read_data_chunks(input_filepath, chunk_rows), constellations):
+                if executor:
+                    chunk_df = parallel_process_epochs(measurements, executor, constellations=set(constellations),
+                                                       exact_orbits=exact_orbits)
+                else:
+                    chunk_df = process_epochs(measurements, manager, set(constellations), orbit_cache)
+                if chunk_df.empty:
+                    continue
+                writer.write(chunk_df)
+                if frames is not None:
+                    frames.append(chunk_df)
+    finally:
+        if executor:
+            executor.shutdown()
+    return writer.rows
+
+
+def convert_log(input_filepath, output_path, output_format='csv', use_store=False,
+                constellations=DEFAULT_CONSTELLATIONS, exact_orbits=False):
+    # Worker for convert_logs, returns (input file, seconds, output rows, error message)
+    start = time.perf_counter()
+    try:
+        log_path = ingest(input_filepath) if use_store else input_filepath
+        n_rows = stream_gnss_log(log_path, output_path, output_format=output_format, constellations=constellations,
+                                 exact_orbits=exact_orbits)
+        return input_filepath, time.perf_counter() - start, n_rows, None
+    except Exception as err:
+        return input_filepath, time.perf_counter() - start, 0, repr(err)
+
+
+def find_logs(inputs):
+    # A directory means every .txt log in it, anything else is treated as a glob pattern
+    if os.path.isdir(inputs):
+        inputs = os.path.join(inputs, '*.txt')
+    return sorted(glob.glob(inputs))
+
+
+def convert_logs(inputs, output_directory=None, workers=None, output_format='csv', use_store=False,
+                 constellations=DEFAULT_CONSTELLATIONS, exact_orbits=False):
+    # Convert many GnssLogger files in parallel. Ephemeris files are shared through the
+    # EphemerisManager data directory, which serializes downloads with file locks.
+    input_filepaths = find_logs(inputs)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for input_filepath in input_filepaths:
+            output_path = os.path.splitext(input_filepath)[0]
+            if output_directory:
+                output_path = os.path.join(output_directory, os.path.basename(output_path))
+            futures.append(executor.submit(convert_log, input_filepath, output_path, output_format, use_store,
+                                           constellations, exact_orbits))
+        for future in as_completed(futures):
+            input_filepath, seconds, rows, error = future.result()
+            if error:
+                print(f"FAILED {input_filepath} after {seconds:.2f} s: {error}")
+            else:
+                print(f"{input_filepath}: {rows} rows in {seconds:.2f} s")
+            results.append(future.result())
+
+    failures = [result for result in results if result[3]]
+    print(f"Converted {len(results) - len(failures)} of {len(results)} logs in {time.perf_counter() - start:.2f} s")
+    return results
+
 
-    csv_output = []
-    for epoch in measurements['Epoch'].unique():
-        one_epoch = measurements.loc[(measurements['Epoch'] == epoch) & (measurements['prSeconds'] < 0.1)]
-        one_epoch = one_epoch.drop_duplicates(subset='SvName').set_index('SvName')
-        if len(one_epoch.index) > 4:
-            timestamp = one_epoch.iloc[0]['UnixTime'].to_pydatetime(warn=False)
-
-            sats = one_epoch.index.unique().tolist()
-            ephemeris = manager.get_ephemeris(timestamp, sats)
-            sv_position = calculate_satellite_position(ephemeris, one_epoch['tTxSeconds'])
-
-            sv_position.index = sv_position.index.map(str)
-            one_epoch = one_epoch.join(sv_position[['delT_sv']], how='left')
-            one_epoch['PrM_corrected'] = one_epoch['PrM'] + LIGHTSPEED * one_epoch['delT_sv']
-            try:
-                one_epoch['CarrierFrequencyHz'] = pd.to_numeric(one_epoch['CarrierFrequencyHz'])
-            except Exception:
-                pass
-
-            for sv in one_epoch.index:
-                csv_output.append({
-                    "GPS time": timestamp.isoformat(),
-                    "SatPRN (ID)": sv,
-                    "Sat.X": sv_position.at[sv, 'x_k'] if sv in sv_position.index else np.nan,
-                    "Sat.Y": sv_position.at[sv, 'y_k'] if sv in sv_position.index else np.nan,
-                    "Sat.Z": sv_position.at[sv, 'z_k'] if sv in sv_position.index else np.nan,
-                    "Pseudo-Range": one_epoch.at[sv, 'PrM_corrected'],
-                    "CN0": one_epoch.at[sv, 'Cn0DbHz'],
-                })
-
-    csv_df = pd.DataFrame(csv_output)
-    csv_df.to_csv(output_path + '.csv', index=False)
-    return csv_df
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert GnssLogger logs to satellite position files')
+    parser.add_argument('inputs', help='directory of .txt logs or a glob pattern')
+    parser.add_argument('--output-directory', help='write output files here instead of next to each log')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='output file format (default: csv)')
+    parser.add_argument('--store', action='store_true',
+                        help='read the logs through their memory-mapped stores, ingesting them on first use')
+    parser.add_argument('--constellations', default=DEFAULT_CONSTELLATIONS,
+                        help='RINEX letters of the systems to convert, e.g. GREC (default: G)')
+    parser.add_argument('--exact-orbits', action='store_true',
+                        help='compute every satellite state from the ephemeris instead of interpolating')
+    args = parser.parse_args()
+    convert_logs(args.inputs, args.output_directory, args.workers, args.format, args.store, args.constellations,
+                 args.exact_orbits)
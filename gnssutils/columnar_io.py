@@ -0,0 +1,126 @@
+import os
+import pandas as pd
+
+"""
+Typed columnar files for converted logs and positioning results. `write_frame` and `read_frame`
+pick the format from the file extension: CSV, Parquet, Feather (both need pyarrow) or HDF5 (needs
+PyTables). Binary formats store 'GPS time' as int64 nanoseconds since the Unix epoch (UTC) instead
+of ISO strings, and `read_frame` turns it back into a UTC datetime column.
+"""
+
+TIME_COLUMN = 'GPS time'
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'hdf5': '.h5',
+}
+
+
+def time_to_nanoseconds(times):
+    # ISO strings or datetimes to int64 nanoseconds, parsing each distinct time only once
+    codes, uniques = pd.factorize(times)
+    nanoseconds = pd.to_datetime(uniques, utc=True).as_unit('ns').asi8
+    return nanoseconds[codes]
+
+
+def binary_frame(frame):
+    # frame as stored in the binary formats: default index, GPS time as int64 nanoseconds
+    frame = frame.reset_index(drop=True)
+    if TIME_COLUMN in frame and len(frame):
+        frame = frame.assign(**{TIME_COLUMN: time_to_nanoseconds(frame[TIME_COLUMN])})
+    return frame
+
+
+def write_frame(frame, filepath):
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        frame.to_csv(filepath, index=False)
+        return
+    frame = binary_frame(frame)
+    if extension == '.parquet':
+        frame.to_parquet(filepath, index=False)
+    elif extension == '.feather':
+        frame.to_feather(filepath)
+    elif extension in ('.h5', '.hdf5'):
+        frame.to_hdf(filepath, key='data', mode='w', format='table')
+    else:
+        raise ValueError(f"unsupported output format {extension!r}")
+
+
+class FrameWriter():
+    # Writes a file chunk by chunk in any write_frame format, so a long conversion never holds the whole
+    # frame: CSV is appended to, Parquet gets a row group and Feather a record batch per chunk, HDF5 a
+    # table append. Every chunk must have the columns and dtypes of the first one.
+    HDF5_STRING_SIZE = 64  # characters reserved for each string column of an HDF5 table
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.extension = os.path.splitext(filepath)[1].lower()
+        if self.extension not in ('.csv', '.parquet', '.feather', '.h5', '.hdf5'):
+            raise ValueError(f"unsupported output format {self.extension!r}")
+        self.rows = 0
+        self.writer = None
+        self.sink = None
+        self.schema = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, frame):
+        if frame.empty:
+            return
+        if self.extension == '.csv':
+            frame.to_csv(self.filepath, index=False, header=not self.rows, mode='a' if self.rows else 'w')
+        elif self.extension in ('.h5', '.hdf5'):
+            frame = binary_frame(frame)
+            frame.index += self.rows
+            if self.writer is None:
+                self.writer = pd.HDFStore(self.filepath, mode='w')
+            strings = {col: self.HDF5_STRING_SIZE for col in frame.columns if frame[col].dtype == object}
+            self.writer.append('data', frame, format='table', min_itemsize=strings or None)
+        else:
+            import pyarrow as pa
+            table = pa.Table.from_pandas(binary_frame(frame), schema=self.schema, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                if self.extension == '.parquet':
+                    import pyarrow.parquet as pq
+                    self.writer = pq.ParquetWriter(self.filepath, self.schema)
+                else:
+                    # Feather version 2 is the Arrow IPC file format, compressed like DataFrame.to_feather
+                    options = pa.ipc.IpcWriteOptions(compression='lz4' if pa.Codec.is_available('lz4') else None)
+                    self.sink = pa.OSFile(self.filepath, 'wb')
+                    self.writer = pa.ipc.new_file(self.sink, self.schema, options=options)
+            self.writer.write_table(table)
+        self.rows += len(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        if not self.rows:
+            write_frame(pd.DataFrame(), self.filepath)
+
+
+def read_frame(filepath, columns=None):
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(filepath, usecols=columns)
+    if extension == '.parquet':
+        frame = pd.read_parquet(filepath, columns=columns)
+    elif extension == '.feather':
+        frame = pd.read_feather(filepath, columns=columns)
+    elif extension in ('.h5', '.hdf5'):
+        frame = pd.read_hdf(filepath, key='data', columns=columns)
+    else:
+        raise ValueError(f"unsupported input format {extension!r}")
+    if TIME_COLUMN in frame and pd.api.types.is_integer_dtype(frame[TIME_COLUMN]):
+        frame[TIME_COLUMN] = pd.to_datetime(frame[TIME_COLUMN], unit='ns', utc=True)
+    return frame
@@ -1,22 +1,79 @@
 from ftplib import FTP_TLS, FTP
 import ftplib
 import gzip
+import zlib
 import shutil
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
-import georinex
+from gnssutils import rinex_nav
 import unlzw3
 import pandas as pd
 import numpy as np
 
+try:
+    import georinex
+except ImportError:  # Only needed for files the native RINEX reader can't parse
+    georinex = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 """""
 This script defines a class called `EphemerisManager` for retrieving and processing satellite ephemeris data from FTP servers.
  It organizes data into DataFrames, allows filtering by satellite ID and timestamp, and handles decompression of files. 
 The main section demonstrates usage by retrieving ephemeris data for specific satellites at a given timestamp.
 """""
 
+# Broadcast parameters in the column order of EphemerisManager.parameters, which is what
+# the position kernels in gnss_to_csv index by name
+EPHEMERIS_FIELDS = ['t_oe', 't_oc', 'sqrtA', 'deltaN', 'M_0', 'e', 'omega', 'i_0', 'IDOT', 'Omega_0', 'OmegaDot',
+                    'C_us', 'C_uc', 'C_rs', 'C_rc', 'C_is', 'C_ic', 'SVclockBias', 'SVclockDrift', 'SVclockDriftRate']
+# GLONASS broadcast state (positions in m, see rinex_nav)
+GLONASS_FIELDS = ['X', 'Y', 'Z', 'dX', 'dY', 'dZ', 'dX2', 'dY2', 'dZ2', 'SVrelFreqBias', 'Leap Seconds']
+PARAMETER_FIELDS = EPHEMERIS_FIELDS + GLONASS_FIELDS
+
+
+@contextmanager
+def file_lock(lock_filepath):
+    # Exclusive inter-process lock, so workers sharing a data directory don't fetch the same file twice
+    with open(lock_filepath, 'a+b') as handle:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 class EphemerisManager():
-    def __init__(self, data_directory=os.path.join(os.getcwd(), 'data', 'ephemeris')):
+    # Start loading the next day's broadcast file this long before UTC midnight
+    PREFETCH_WINDOW = timedelta(minutes=30)
+    # Concurrent downloads in prefetch, each with its own reused FTP connection
+    PREFETCH_WORKERS = 4
+    DOWNLOAD_ATTEMPTS = 3
+    DOWNLOAD_BLOCKSIZE = 1 << 16
+
+    def __init__(self, data_directory=os.path.join(os.getcwd(), 'data', 'ephemeris'), max_days=3, servers=None):
+        # servers optionally redirects an archive host to (host, port, secure), e.g. a local test server
         self.data_directory = data_directory
         nasa_dir = os.path.join(data_directory, 'nasa')
         igs_dir = os.path.join(data_directory, 'igs')
@@ -24,91 +81,256 @@ class EphemerisManager():
         os.makedirs(igs_dir, exist_ok=True)
         self.data = None
         self.leapseconds = None
+        self.sv_index = {}
+        self.parameters = np.empty((0, len(PARAMETER_FIELDS)))
+        # Loaded broadcast data keyed by UTC date, least recently used first
+        self.days = OrderedDict()
+        self.max_days = max_days
+        self.active_days = ()
+        self.prefetch_threads = {}
+        self.lock = threading.Lock()
+        self.servers = servers or {}
+        self.idle_connections = {}  # (url, secure) -> logged in FTP connections ready for reuse
 
-    def get_ephemeris(self, timestamp, satellites):
-        systems = EphemerisManager.get_constellations(satellites)
-        if not isinstance(self.data, pd.DataFrame):
-            self.load_data(timestamp, systems)
-        data = self.data
-        if satellites:
-            data = data.loc[data['sv'].isin(satellites)]
-        data = data.loc[data['time'] < timestamp]
-        # data = data.sort_values('time').groupby('sv').last().drop('index', 'columns')
-        data = data.sort_values('time').groupby('sv').last().drop(['index'], axis=1) ## Depcreated stuff again
-
+    def get_ephemeris(self, timestamp, satellites, constellations=None):
+        # constellations overrides the systems to load, which are otherwise those of satellites
+        satellites, rows = self.find_records(timestamp, sorted(set(satellites)) if satellites else satellites,
+                                             constellations)
+        data = self.data.iloc[rows[rows >= 0]].set_index('sv').drop(['index'], axis=1)
 
         data['Leap Seconds'] = self.leapseconds
         return data
 
+    def get_parameters(self, timestamp, satellites, constellations=None):
+        # Rows of self.parameters for satellites, in their order, NaN for those without an ephemeris
+        satellites, rows = self.find_records(timestamp, satellites, constellations)
+        parameters = np.full((len(rows), len(PARAMETER_FIELDS)), np.nan)
+        found = rows >= 0
+        parameters[found] = self.parameters[rows[found]]
+        return parameters
+
+    def find_records(self, timestamp, satellites, constellations=None):
+        # Activate the days timestamp needs and look satellites up, all loaded satellites when empty
+        systems = set(constellations) if constellations else EphemerisManager.get_constellations(satellites)
+        day = timestamp.astimezone(timezone.utc).date()
+        previous_day = day - timedelta(days=1)
+        self.activate_days([previous_day, day] if previous_day in self.active_days else [day], systems)
+        satellites = satellites if satellites else sorted(self.sv_index)
+        rows = self.lookup(timestamp, satellites)
+        if (rows < 0).any() and previous_day not in self.active_days:
+            # Shortly after midnight the latest record may still be in the previous day's file
+            self.activate_days([previous_day, day], systems)
+            rows = self.lookup(timestamp, satellites)
+        self.prefetch_next_day(timestamp, systems)
+        return satellites, rows
+
+    def lookup(self, timestamp, satellites):
+        # Binary search each satellite's sorted record times for the row of its last record before
+        # timestamp, -1 when it has none
+        timestamp_ns = EphemerisManager.to_nanoseconds(timestamp)
+        rows = np.full(len(satellites), -1, dtype=np.intp)
+        for k, sv in enumerate(satellites):
+            if sv not in self.sv_index:
+                continue
+            times, positions = self.sv_index[sv]
+            i = np.searchsorted(times, timestamp_ns, side='left')
+            if i > 0:
+                rows[k] = positions[i - 1]
+        return rows
+
+    def activate_days(self, days, constellations):
+        # Merge the given days into self.data, only rebuilding the index when the set changes
+        days = tuple(days)
+        if days == self.active_days:
+            return
+        frames = [self.get_day_data(day, constellations) for day in days]
+        frames = [frame for frame in frames if not frame.empty]
+        if frames:
+            data = pd.concat(frames, ignore_index=True)
+            data.sort_values('time', inplace=True, ignore_index=True)
+        else:
+            data = pd.DataFrame(columns=['index', 'time', 'sv'])
+        self.data = data
+        self.active_days = days
+        self.build_index()
+
+    def get_day_data(self, day, constellations):
+        with self.lock:
+            if day in self.days:
+                self.days.move_to_end(day)
+                return self.days[day]
+            thread = self.prefetch_threads.get(day)
+        if thread is not None:
+            thread.join()
+            with self.lock:
+                if day in self.days:
+                    self.days.move_to_end(day)
+                    return self.days[day]
+        return self.store_day(day, constellations)
+
+    def store_day(self, day, constellations):
+        data = self.load_data(datetime(day.year, day.month, day.day, tzinfo=timezone.utc), constellations)
+        with self.lock:
+            self.prefetch_threads.pop(day, None)
+            # A missing file for a finished day stays missing, for today it may still be published later
+            if not data.empty or day < datetime.now(timezone.utc).date():
+                self.days[day] = data
+                self.days.move_to_end(day)
+                while len(self.days) > self.max_days:
+                    self.days.popitem(last=False)
+        return data
+
+    def prefetch_next_day(self, timestamp, constellations):
+        # Load the next day's file in the background once the epoch stream nears UTC midnight
+        timestamp = timestamp.astimezone(timezone.utc)
+        next_day = timestamp.date() + timedelta(days=1)
+        next_midnight = datetime(next_day.year, next_day.month, next_day.day, tzinfo=timezone.utc)
+        if next_midnight - timestamp > EphemerisManager.PREFETCH_WINDOW or \
+                next_day > datetime.now(timezone.utc).date():
+            return
+        with self.lock:
+            if next_day in self.days or next_day in self.prefetch_threads:
+                return
+            thread = threading.Thread(target=self.store_day, args=(next_day, constellations), daemon=True)
+            self.prefetch_threads[next_day] = thread
+        thread.start()
+
+    def build_index(self):
+        # Map every satellite to its record times (sorted, int64 ns) and their row positions in self.data,
+        # and lay the records out as a float64 matrix of PARAMETER_FIELDS, one row per row of self.data
+        self.sv_index = {}
+        parameters = self.data.reindex(columns=PARAMETER_FIELDS)
+        parameters['Leap Seconds'] = self.leapseconds
+        self.parameters = parameters.to_numpy(dtype=float)
+        if self.data.empty:
+            return
+        times = EphemerisManager.to_nanoseconds(self.data['time'])
+        order = np.lexsort((times, self.data['sv'].to_numpy()))
+        svs = self.data['sv'].to_numpy()[order]
+        starts = np.flatnonzero(np.r_[True, svs[1:] != svs[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            self.sv_index[svs[start]] = (times[order[start:end]], order[start:end])
+
+    @staticmethod
+    def to_nanoseconds(time):
+        # UTC nanoseconds since the Unix epoch for a datetime or a Series of tz-aware datetimes
+        if isinstance(time, pd.Series):
+            return time.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy().astype('datetime64[ns]').astype(np.int64)
+        return pd.Timestamp(time).tz_convert('UTC').tz_localize(None).as_unit('ns').value
+
     def get_leapseconds(self, timestamp):
         return self.leapseconds
 
-    def load_data(self, timestamp, constellations=None):
+    @staticmethod
+    def select_files(timestamp, constellations=None):
+        # The broadcast files load_data reads for a timestamp and set of constellations
         filepaths = EphemerisManager.get_filepaths(timestamp)
-        data_list = []
         timestamp_age = datetime.now(timezone.utc) - timestamp
         if constellations == None:
-            for fileinfo in filepaths.values():
-                data = self.get_ephemeris_dataframe(fileinfo)
-                data_list.append(data)
-        else:
-            legacy_systems = set(['G', 'R'])
-            legacy_systems_only = len(constellations - legacy_systems) == 0
-            if timestamp_age.days > 0:
-                if legacy_systems_only:
-                    data_list.append(self.get_ephemeris_dataframe(
-                        filepaths['nasa_daily_gps']))
-                    if 'R' in constellations:
-                        data_list.append(self.get_ephemeris_dataframe(
-                            filepaths['nasa_daily_glonass']))
-                else:
-                    data_list.append(self.get_ephemeris_dataframe(
-                        filepaths['nasa_daily_combined']))
+            return list(filepaths.values())
+        legacy_systems = set(['G', 'R'])
+        legacy_systems_only = len(constellations - legacy_systems) == 0
+        if timestamp_age.days > 0:
+            if legacy_systems_only:
+                fileinfos = [filepaths['nasa_daily_gps']]
+                if 'R' in constellations:
+                    fileinfos.append(filepaths['nasa_daily_glonass'])
             else:
-                data_list.append(self.get_ephemeris_dataframe(
-                    filepaths['nasa_daily_gps']))
-                if not legacy_systems_only:
-                    data_list.append(self.get_ephemeris_dataframe(
-                        filepaths['bkg_daily_combined']))
+                fileinfos = [filepaths['nasa_daily_combined']]
+        else:
+            fileinfos = [filepaths['nasa_daily_gps']]
+            if not legacy_systems_only:
+                fileinfos.append(filepaths['bkg_daily_combined'])
+        return fileinfos
+
+    def load_data(self, timestamp, constellations=None):
+        data_list = [self.get_ephemeris_dataframe(fileinfo)
+                     for fileinfo in EphemerisManager.select_files(timestamp, constellations)]
 
         data = pd.DataFrame()
         data = pd.concat(data_list, ignore_index=True) ## DataFrame.append is deprectaed...
+        if data.empty:
+            return data
         data.reset_index(inplace=True)
         data.sort_values('time', inplace=True, ignore_index=True)
-        self.data = data
+        return data
 
     def get_ephemeris_dataframe(self, fileinfo, constellations=None):
-        filepath = fileinfo['filepath']
+        url, directory, filename, dest_filepath = self.file_location(fileinfo)
+        decompressed_filename = os.path.splitext(dest_filepath)[0]
+        with file_lock(decompressed_filename + '.lock'):
+            return self.load_ephemeris_file(url, directory, filename, dest_filepath, constellations)
+
+    def file_location(self, fileinfo):
+        # (server, remote directory, filename, local path of the compressed file)
         url = fileinfo['url']
-        directory = os.path.split(filepath)[0]
-        filename = os.path.split(filepath)[1]
+        directory, filename = os.path.split(fileinfo['filepath'])
         if url == 'igs.bkg.bund.de':
             dest_filepath = os.path.join(self.data_directory, 'igs', filename)
         else:
             dest_filepath = os.path.join(self.data_directory, 'nasa', filename)
-        decompressed_filename = os.path.splitext(dest_filepath)[0]
-        if not os.path.isfile(decompressed_filename):
-            if url == 'gdc.cddis.eosdis.nasa.gov':
-                secure = True
-            else:
-                secure = False
+        return url, directory, filename, dest_filepath
+
+    def fetch_file(self, url, directory, filename, dest_filepath):
+        # Download and decompress one file unless it is already here, returns False on an FTP error
+        if os.path.isfile(os.path.splitext(dest_filepath)[0]):
+            return True
+        secure = url == 'gdc.cddis.eosdis.nasa.gov'
+        try:
+            self.retrieve_file(url, directory, filename, dest_filepath, secure)
+        except ftplib.error_perm:
+            print('ftp error')
+            return False
+        return True
+
+    def prefetch(self, date_range, constellations=None, workers=None):
+        # Download every broadcast file the days of date_range need before a batch job, through
+        # a pool of reused connections. date_range is a (first, last) pair of dates or datetimes,
+        # both included, or any iterable of them. Returns {local file: True if it is available}.
+        if isinstance(date_range, tuple) and len(date_range) == 2:
+            first, last = (pd.Timestamp(day) for day in date_range)
+            date_range = pd.date_range(first.normalize(), last.normalize(), freq='D')
+        locations = {}
+        for day in date_range:
+            timestamp = pd.Timestamp(day)
+            timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+            for fileinfo in EphemerisManager.select_files(timestamp.to_pydatetime(), constellations):
+                location = self.file_location(fileinfo)
+                locations[location[3]] = location
+
+        def fetch_locked(location):
+            # One failed file (timeout, dropped connection, corrupt archive) must not abort the others
             try:
-                self.retrieve_file(url, directory, filename,
-                                   dest_filepath, secure)
-                self.decompress_file(dest_filepath)
-            except ftplib.error_perm as err:
-                print('ftp error')
-                return pd.DataFrame()
+                with file_lock(os.path.splitext(location[3])[0] + '.lock'):
+                    return self.fetch_file(*location)
+            except (OSError, EOFError, ftplib.Error, zlib.error) as err:
+                print(f'prefetch of {location[3]} failed: {err!r}')
+                return False
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers or EphemerisManager.PREFETCH_WORKERS) as executor:
+                results = dict(zip(locations, executor.map(fetch_locked, locations.values())))
+        finally:
+            self.close_connections()
+        return results
+
+    def load_ephemeris_file(self, url, directory, filename, dest_filepath, constellations=None):
+        decompressed_filename = os.path.splitext(dest_filepath)[0]
+        if not self.fetch_file(url, directory, filename, dest_filepath):
+            return pd.DataFrame()
+        # Parsed files are cached as Parquet next to the RINEX file, so later runs skip parsing
+        cache_filepath = decompressed_filename + '.parquet'
+        if not constellations:
+            data = EphemerisManager.load_cache(cache_filepath, decompressed_filename)
+            if data is not None:
+                if not self.leapseconds:
+                    self.leapseconds = EphemerisManager.load_leapseconds(
+                        decompressed_filename)
+                return data
+        data, leapseconds = EphemerisManager.parse_rinex(decompressed_filename, constellations)
         if not self.leapseconds:
-            self.leapseconds = EphemerisManager.load_leapseconds(
-                decompressed_filename)
-        if constellations:
-            data = georinex.load(decompressed_filename,
-                                 use=constellations).to_dataframe()
-        else:
-            data = georinex.load(decompressed_filename).to_dataframe()
-        data.dropna(how='all', inplace=True)
-        data.reset_index(inplace=True)
+            self.leapseconds = leapseconds
         data['source'] = decompressed_filename
         WEEKSEC = 604800
         data['t_oc'] = pd.to_numeric(data['time'] - datetime(1980, 1, 6, 0, 0, 0))
@@ -116,8 +338,51 @@ class EphemerisManager():
         data['time'] = data['time'].dt.tz_localize('UTC')
         data.rename(columns={'M0': 'M_0', 'Eccentricity': 'e', 'Toe': 't_oe', 'DeltaN': 'deltaN', 'Cuc': 'C_uc', 'Cus': 'C_us',
                              'Cic': 'C_ic', 'Crc': 'C_rc', 'Cis': 'C_is', 'Crs': 'C_rs', 'Io': 'i_0', 'Omega0': 'Omega_0'}, inplace=True)
+        if not constellations:
+            EphemerisManager.save_cache(data, cache_filepath)
         return data
 
+    @staticmethod
+    def parse_rinex(filename, constellations=None):
+        # Returns (data, leap seconds), with the header read in the same pass. georinex is the
+        # fallback for files the native reader doesn't handle or can't make sense of, e.g. a
+        # download cut off in the middle of a record.
+        try:
+            data, header = rinex_nav.read_nav(filename, use=constellations)
+            return data, header.get('leap_seconds')
+        except (NotImplementedError, ValueError, IndexError):
+            if georinex is None:
+                raise
+        if constellations:
+            data = georinex.load(filename, use=constellations).to_dataframe()
+        else:
+            data = georinex.load(filename).to_dataframe()
+        data.dropna(how='all', inplace=True)
+        data.reset_index(inplace=True)
+        return data, EphemerisManager.load_leapseconds(filename)
+
+    @staticmethod
+    def load_cache(cache_filepath, source_filepath):
+        if not os.path.isfile(cache_filepath) or \
+                os.path.getmtime(cache_filepath) < os.path.getmtime(source_filepath):
+            return None
+        try:
+            return pd.read_parquet(cache_filepath)
+        except (ImportError, OSError, ValueError) as err:
+            print('Ignoring ephemeris cache ' + cache_filepath + ': ' + str(err))
+            return None
+
+    @staticmethod
+    def save_cache(data, cache_filepath):
+        # Write to a temporary file first so an interrupted run never leaves a truncated cache
+        tmp_filepath = cache_filepath + '.' + str(os.getpid()) + '.tmp'
+        try:
+            data.to_parquet(tmp_filepath, index=False)
+            os.replace(tmp_filepath, cache_filepath)
+        except ImportError:
+            # Parquet needs pyarrow or fastparquet, without either we just parse the RINEX file every run
+            pass
+
     @staticmethod
     def get_filetype(timestamp):
         # IGS switched from .Z to .gz compression format on December 1st, 2020
@@ -151,42 +416,133 @@ class EphemerisManager():
         pass
 
     def retrieve_file(self, url, directory, filename, dest_filepath, secure=False):
+        # Download into dest_filepath + '.part' and write the decompressed file next to it. A broken
+        # transfer is resumed from the end of the .part file on a fresh connection. gzip files are
+        # decompressed while they arrive; unlzw3 has no streaming API, so .Z files (IGS archives
+        # before December 2020) are decompressed once complete.
         print('Retrieving ' + directory + '/' + filename + ' from ' + url)
-        ftp = self.connect(url, secure)
         src_filepath = directory + '/' + filename
+        part_filepath = dest_filepath + '.part'
+        decompressed_path = os.path.splitext(dest_filepath)[0]
+        for attempt in range(EphemerisManager.DOWNLOAD_ATTEMPTS):
+            try:
+                self.download(url, secure, src_filepath, part_filepath, decompressed_path)
+                break
+            except ftplib.error_perm as err:
+                print('Failed to retrieve ' + src_filepath + ' from ' + url)
+                print(err)
+                if os.path.exists(part_filepath):
+                    os.remove(part_filepath)
+                raise
+            except (OSError, EOFError, ftplib.error_temp, ftplib.error_reply) as err:
+                print('Transfer of ' + src_filepath + ' interrupted (' + str(err) + ')')
+                if attempt + 1 == EphemerisManager.DOWNLOAD_ATTEMPTS:
+                    raise
+        if os.path.splitext(dest_filepath)[1] == '.gz':
+            os.remove(part_filepath)
+        else:
+            os.replace(part_filepath, dest_filepath)
+            self.decompress_file(dest_filepath)
+
+    def download(self, url, secure, src_filepath, part_filepath, decompressed_path):
+        offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+        streaming = part_filepath.endswith('.gz.part')
+        tmp_path = decompressed_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
         try:
-            with open(dest_filepath, 'wb') as handle:
-                ftp.retrbinary(
-                    'RETR ' + src_filepath, handle.write)
-        except ftplib.error_perm as err:
-            print('Failed to retrieve ' + src_filepath + ' from ' + url)
-            print(err)
-            os.remove(dest_filepath)
-            raise ftplib.error_perm
+            # Only gzip files are decompressed while they arrive, .Z files are decompressed once complete
+            with open(part_filepath, 'ab') as part, \
+                    (open(tmp_path, 'wb') if streaming else nullcontext()) as output:
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if streaming else None
+                if decompressor and offset:
+                    # Rebuild the decompressor state from the bytes we already have
+                    with open(part_filepath, 'rb') as existing:
+                        for block in iter(lambda: existing.read(EphemerisManager.DOWNLOAD_BLOCKSIZE), b''):
+                            output.write(decompressor.decompress(block))
+
+                def write(block):
+                    part.write(block)
+                    if decompressor:
+                        output.write(decompressor.decompress(block))
+
+                with self.connection(url, secure) as ftp:
+                    try:
+                        ftp.retrbinary('RETR ' + src_filepath, write, EphemerisManager.DOWNLOAD_BLOCKSIZE,
+                                       rest=offset or None)
+                    except ftplib.error_perm:
+                        if not offset:
+                            raise
+                        # The server refused REST, start over
+                        part.truncate(0)
+                        if output:
+                            output.truncate(0)
+                            output.seek(0)
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if streaming else None
+                        ftp.retrbinary('RETR ' + src_filepath, write, EphemerisManager.DOWNLOAD_BLOCKSIZE)
+                if decompressor:
+                    output.write(decompressor.flush())
+                    if not decompressor.eof:
+                        raise EOFError('incomplete gzip stream')
+            if streaming:
+                os.replace(tmp_path, decompressed_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     def decompress_file(self, filepath):
         extension = os.path.splitext(filepath)[1]
         decompressed_path = os.path.splitext(filepath)[0]
+        # Decompress next to the target and rename, so a half-written file is never picked up
+        tmp_path = decompressed_path + '.' + str(os.getpid()) + '.tmp'
         if extension == '.gz':
             with gzip.open(filepath, 'rb') as f_in:
-                with open(decompressed_path, 'wb') as f_out:
+                with open(tmp_path, 'wb') as f_out:
                     shutil.copyfileobj(f_in, f_out)
         elif extension == '.Z':
             with open(filepath, 'rb') as f_in:
-                with open(decompressed_path, 'wb') as f_out:
+                with open(tmp_path, 'wb') as f_out:
                     f_out.write(unlzw3.unlzw(f_in.read()))
+        os.replace(tmp_path, decompressed_path)
         os.remove(filepath)
 
     def connect(self, url, secure):
+        host, port, secure = self.servers.get(url, (url, 0, secure))
         if secure:
-            ftp = FTP_TLS(url)
+            ftp = FTP_TLS()
+            ftp.connect(host, port)
             ftp.login()
             ftp.prot_p()
         else:
-            ftp = FTP(url)
+            ftp = FTP()
+            ftp.connect(host, port)
             ftp.login()
         return ftp
 
+    @contextmanager
+    def connection(self, url, secure):
+        # Borrow a logged in connection from the pool, it goes back only if the transfer succeeded
+        with self.lock:
+            idle = self.idle_connections.get((url, secure))
+            ftp = idle.pop() if idle else None
+        if ftp is None:
+            ftp = self.connect(url, secure)
+        try:
+            yield ftp
+        except BaseException:
+            ftp.close()
+            raise
+        with self.lock:
+            self.idle_connections.setdefault((url, secure), []).append(ftp)
+
+    def close_connections(self):
+        with self.lock:
+            connections = [ftp for idle in self.idle_connections.values() for ftp in idle]
+            self.idle_connections = {}
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except (OSError, EOFError, ftplib.Error):
+                ftp.close()
+
     def listdir(self, url, directory, secure):
         ftp = self.connect(url, secure)
         dirlist = ftp.nlst(directory)
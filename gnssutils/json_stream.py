@@ -0,0 +1,137 @@
+import json
+import re
+
+"""
+Incremental framing for a stream of JSON messages, as sent by the RealTimeGNSS phone app.
+`JsonStreamDecoder` keeps one bytes buffer per connection and returns every complete message
+on each `feed`. It understands newline-delimited JSON, 4-byte big-endian length-prefixed JSON
+and plain back-to-back JSON objects/arrays, which are found with an incremental bracket scanner
+so a partial message is never re-parsed from the start.
+"""
+
+MAX_BUFFER_SIZE = 1 << 20
+LENGTH_PREFIX_SIZE = 4
+WHITESPACE = b' \t\r\n'
+OPENING = b'{['
+CLOSING = b'}]'
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+SPECIAL_BYTES = re.compile(rb'[{}\[\]"\\]')
+
+
+class FramingError(ValueError):
+    pass
+
+
+class JsonStreamDecoder():
+    def __init__(self, max_buffer_size=MAX_BUFFER_SIZE):
+        self.buffer = bytearray()
+        self.max_buffer_size = max_buffer_size
+        self.invalid_messages = 0
+        self.reset_scan()
+
+    def reset_scan(self):
+        # Bracket scanner progress through the unframed message at the start of the buffer
+        self.scan_offset = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, data):
+        # Add received bytes and return all messages completed by them
+        self.buffer += data
+        messages = []
+        start = 0
+        while True:
+            start = self.skip_whitespace(start)
+            if start >= len(self.buffer):
+                break
+            end, message = self.next_message(start)
+            if end is None:
+                break
+            if message is not None:
+                messages.append(message)
+            start = end
+        # Drop consumed bytes once per feed rather than once per message
+        del self.buffer[:start]
+
+        if len(self.buffer) > self.max_buffer_size:
+            self.buffer.clear()
+            self.reset_scan()
+            raise FramingError(f"incomplete message exceeds {self.max_buffer_size} bytes")
+        return messages
+
+    def skip_whitespace(self, start):
+        while start < len(self.buffer) and self.buffer[start] in WHITESPACE:
+            start += 1
+        return start
+
+    def next_message(self, start):
+        # Returns (end, message) for the message at start, or (None, None) while it is incomplete
+        buffer = self.buffer
+        # A zero first byte can't start JSON text, so it marks a length prefix
+        if buffer[start] == 0:
+            if len(buffer) - start < LENGTH_PREFIX_SIZE:
+                return None, None
+            end = start + LENGTH_PREFIX_SIZE + int.from_bytes(buffer[start:start + LENGTH_PREFIX_SIZE], 'big')
+            if len(buffer) < end:
+                return None, None
+            return end, self.decode(start + LENGTH_PREFIX_SIZE, end)
+
+        if self.scan_offset == 0:
+            newline = buffer.find(b'\n', start)
+            if newline != -1:
+                try:
+                    return newline + 1, json.loads(buffer[start:newline])
+                except ValueError:
+                    # Not one message per line, fall back to scanning
+                    pass
+            if buffer[start] not in OPENING:
+                self.buffer.clear()
+                raise FramingError(f"unexpected byte {bytes(buffer[start:start + 1])!r} at message start")
+        end = self.scan(start)
+        if end is None:
+            return None, None
+        return end, self.decode(start, end)
+
+    def scan(self, start):
+        # Resume the bracket scan, skipping ordinary bytes with a regex search
+        buffer = self.buffer
+        pos = start + self.scan_offset
+        if self.escape:
+            if pos >= len(buffer):
+                return None
+            pos += 1
+            self.escape = False
+        while True:
+            match = SPECIAL_BYTES.search(buffer, pos)
+            if match is None:
+                self.scan_offset = len(buffer) - start
+                return None
+            char = buffer[match.start()]
+            pos = match.start() + 1
+            if self.in_string:
+                if char == BACKSLASH:
+                    if pos >= len(buffer):
+                        self.escape = True
+                        self.scan_offset = pos - start
+                        return None
+                    pos += 1
+                elif char == QUOTE:
+                    self.in_string = False
+            elif char == QUOTE:
+                self.in_string = True
+            elif char in OPENING:
+                self.depth += 1
+            elif char in CLOSING:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.reset_scan()
+                    return pos
+
+    def decode(self, start, end):
+        try:
+            return json.loads(self.buffer[start:end])
+        except ValueError:
+            self.invalid_messages += 1
+            return None
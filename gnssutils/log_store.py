@@ -0,0 +1,374 @@
+import io
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+"""
+One-time ingest of a GnssLogger text log into a memory-mapped columnar store, so later analysis
+jobs don't re-tokenize the whole text file. Every record type (Raw, Fix, Status, NMEA, ...) becomes
+a table directory with one flat binary file per column: numeric columns are opened with np.memmap,
+strings are kept as offsets plus UTF-8 bytes. Each table also gets a per-row time index in
+nanoseconds since the Unix epoch (GPS time for Raw, UnixTimeMillis/utcTimeMillis otherwise), and
+Raw gets the first row of every epoch, so a time range is sliced with a binary search.
+
+    store = open_store('gnss_log.txt')
+    raw = store.read_time_range('Raw', '2024-04-13T10:00:00Z', '2024-04-13T10:05:00Z')
+"""
+
+CHUNK_ROWS = 100000
+STORE_VERSION = 2
+GPS_EPOCH_NANOS = 315964800 * 10 ** 9  # 1980-01-06 in Unix nanoseconds
+MILLIS_COLUMNS = ['UnixTimeMillis', 'utcTimeMillis']
+TIME_FILE = '_time.bin'
+EPOCH_FILE = '_epoch.bin'
+
+
+def store_directory_for(input_filepath):
+    return os.path.splitext(input_filepath)[0] + '.store'
+
+
+def to_nanoseconds(value):
+    # Unix nanoseconds of a timestamp, datetime or ISO string (naive times are UTC)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value
+
+
+class TableWriter():
+    # Appends parsed chunks of one record type to its column files
+    def __init__(self, directory, name, columns, dtypes):
+        self.directory = os.path.join(directory, name)
+        os.makedirs(self.directory)
+        self.name = name
+        self.columns = columns
+        self.dtypes = dtypes  # column -> 'int64' / 'float64' / 'str', settled on the first chunk
+        if name == 'NMEA':
+            self.dtypes.update({'Message': 'str', 'UnixTimeMillis': 'int64'})
+        self.inferred = set()  # columns typed from the data rather than by the caller, these may widen to 'str'
+        self.undetermined = set()  # inferred columns without any value so far, stored once they get one
+        self.rows = 0
+        self.string_bytes = {}
+        self.time_sorted = True
+        self.last_time = None
+        self.last_time_nanos = None
+        self.has_time = False
+
+    def parse(self, lines):
+        if self.name == 'NMEA':
+            # The sentence itself contains commas, only the last field is the time
+            fields = [line.rstrip('\r\n').rsplit(',', 1) for line in lines]
+            return pd.DataFrame(fields, columns=self.columns).astype({'UnixTimeMillis': 'int64'})
+        text = io.StringIO(''.join(lines))
+        if len(self.dtypes) < len(self.columns):
+            inferred = pd.read_csv(text, header=None, names=self.columns)
+            for col in self.columns:
+                if col not in self.dtypes:
+                    self.inferred.add(col)
+                    if inferred[col].isna().all():
+                        # No value yet says nothing about the type, read it as text until one shows up
+                        self.undetermined.add(col)
+                        self.dtypes[col] = 'str'
+                    else:
+                        self.dtypes[col] = self.kind_dtype(inferred[col].dtype.kind)
+            text.seek(0)
+        read_dtypes = {col: 'Int64' if dtype == 'int64' else dtype for col, dtype in self.dtypes.items()}
+        try:
+            chunk = pd.read_csv(text, header=None, names=self.columns, dtype=read_dtypes)
+        except ValueError:
+            # A value that doesn't fit the settled type. Inferred columns widen to strings, the types the
+            # caller fixed are kept and the value is coerced to missing.
+            text.seek(0)
+            chunk = pd.read_csv(text, header=None, names=self.columns, dtype=str)
+            for col, dtype in list(self.dtypes.items()):
+                if dtype == 'str':
+                    continue
+                values = pd.to_numeric(chunk[col], errors='coerce')
+                lost = values.isna() & chunk[col].notna()
+                if dtype == 'int64':
+                    lost |= values.notna() & (values % 1 != 0)
+                if col in self.inferred and lost.any():
+                    self.widen(col)
+                elif dtype == 'int64':
+                    chunk[col] = values.where(~lost).astype(read_dtypes[col])
+                else:
+                    chunk[col] = values.astype(read_dtypes[col])
+        for col in [col for col in self.columns if col in self.undetermined]:
+            if chunk[col].notna().any():
+                self.settle(col, chunk)
+        for col, dtype in self.dtypes.items():
+            if dtype == 'int64':
+                chunk[col] = chunk[col].fillna(0).astype('int64')
+        return chunk
+
+    @staticmethod
+    def kind_dtype(kind):
+        return 'int64' if kind in 'iu' else 'float64' if kind == 'f' else 'str'
+
+    def settle(self, col, chunk):
+        # First values of a column that was empty so far: type it the way read_csv would have
+        try:
+            kind = pd.to_numeric(chunk[col].dropna()).dtype.kind
+        except ValueError:
+            kind = 'O'
+        self.dtypes[col] = self.kind_dtype(kind)
+        self.undetermined.discard(col)
+        self.backfill(col)
+        if self.dtypes[col] != 'str':
+            chunk[col] = pd.to_numeric(chunk[col])
+
+    def backfill(self, col):
+        # Store the rows before a column's first value as missing, 0 for integers
+        if not self.rows:
+            return
+        dtype = self.dtypes[col]
+        if dtype == 'str':
+            self.write_strings(col, [None] * self.rows, True)
+        else:
+            with open(os.path.join(self.directory, col + '.bin'), 'ab') as handle:
+                handle.write(np.zeros(self.rows, dtype=dtype).tobytes() if dtype == 'int64' else
+                             np.full(self.rows, np.nan).tobytes())
+
+    def finish(self):
+        # Columns that never got a value are empty strings
+        for col in sorted(self.undetermined):
+            self.backfill(col)
+        self.undetermined.clear()
+
+    def widen(self, col):
+        # Turn a numeric column into a string column, rewriting the rows already stored
+        path = os.path.join(self.directory, col)
+        if os.path.exists(path + '.bin'):
+            stored = np.fromfile(path + '.bin', dtype=self.dtypes[col])
+            os.remove(path + '.bin')
+            self.write_strings(col, [str(value) if value == value else None for value in stored.tolist()], True)
+        self.dtypes[col] = 'str'
+
+    def write_strings(self, col, values, first):
+        path = os.path.join(self.directory, col)
+        encoded = [value.encode() if isinstance(value, str) else b'' for value in values]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        offsets = self.string_bytes.get(col, 0) + np.cumsum(lengths)
+        if first:
+            offsets = np.r_[0, offsets]
+        with open(path + '.offsets.bin', 'ab') as handle:
+            handle.write(offsets.astype(np.int64).tobytes())
+        with open(path + '.data.bin', 'ab') as handle:
+            handle.write(b''.join(encoded))
+        self.string_bytes[col] = int(offsets[-1]) if offsets.size else self.string_bytes.get(col, 0)
+
+    def append(self, lines):
+        chunk = self.parse(lines)
+        for col in self.columns:
+            if col in self.undetermined:
+                continue
+            dtype = self.dtypes.get(col, 'str')
+            path = os.path.join(self.directory, col)
+            if dtype == 'str':
+                self.write_strings(col, chunk[col].to_numpy(), self.rows == 0)
+            else:
+                with open(path + '.bin', 'ab') as handle:
+                    handle.write(chunk[col].to_numpy(dtype=dtype).tobytes())
+
+        time = self.row_times(chunk)
+        if time is not None:
+            self.has_time = True
+            if time.size:
+                previous = self.last_time if self.last_time is not None else time[0]
+                self.time_sorted &= bool(previous <= time[0] and (np.diff(time) >= 0).all())
+                self.last_time = time[-1]
+            with open(os.path.join(self.directory, TIME_FILE), 'ab') as handle:
+                handle.write(time.tobytes())
+            if self.name == 'Raw':
+                # First row of every epoch, an epoch being a run of rows with the same TimeNanos
+                time_nanos = chunk['TimeNanos'].to_numpy()
+                starts = np.flatnonzero(np.r_[True, time_nanos[1:] != time_nanos[:-1]])
+                if self.last_time_nanos == time_nanos[0]:
+                    starts = starts[1:]
+                self.last_time_nanos = time_nanos[-1]
+                with open(os.path.join(self.directory, EPOCH_FILE), 'ab') as handle:
+                    handle.write((starts + self.rows).astype(np.int64).tobytes())
+        self.rows += len(chunk)
+
+    def row_times(self, chunk):
+        if self.name == 'Raw' and {'TimeNanos', 'FullBiasNanos', 'BiasNanos'}.issubset(chunk.columns):
+            # Same GPS time as preprocess_measurements' GpsTimeNanos, moved to the Unix epoch
+            bias = np.round(chunk['BiasNanos'].fillna(0).to_numpy()).astype(np.int64)
+            return chunk['TimeNanos'].to_numpy() - (chunk['FullBiasNanos'].to_numpy() - bias) + GPS_EPOCH_NANOS
+        for col in MILLIS_COLUMNS:
+            if col in chunk.columns and self.dtypes.get(col) in ('int64', 'float64'):
+                return (np.nan_to_num(chunk[col].to_numpy(dtype=float)) * 1e6).astype(np.int64)
+        return None
+
+    def metadata(self):
+        return {'rows': self.rows, 'columns': self.columns,
+                'dtypes': {col: self.dtypes.get(col, 'str') for col in self.columns},
+                'has_time': self.has_time, 'time_sorted': self.time_sorted}
+
+
+def ingest_log(input_filepath, store_directory=None, dtypes=None, chunk_rows=CHUNK_ROWS):
+    # Convert a GnssLogger text file into a store in one pass. dtypes optionally fixes column
+    # types per table, e.g. {'Raw': {'Svid': 'int64', ...}}; other columns are inferred from
+    # their first chunk. Missing integers become 0, the same as gnss_to_csv.parse_raw_chunk.
+    store_directory = store_directory or store_directory_for(input_filepath)
+    tmp_directory = f"{store_directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    dtypes = dtypes or {}
+    headers, writers, pending = {}, {}, {}
+
+    def flush(name):
+        if name not in writers:
+            writers[name] = TableWriter(tmp_directory, name, headers[name], dict(dtypes.get(name, {})))
+        writers[name].append(pending.pop(name))
+
+    try:
+        with open(input_filepath, encoding='utf-8', errors='replace') as logfile:
+            for line in logfile:
+                if line.startswith('#'):
+                    header = line[1:].strip().split(',')
+                    if len(header) > 1 and header[0].strip():
+                        headers.setdefault(header[0].strip(), [col.strip() for col in header[1:]])
+                    continue
+                name, _, rest = line.partition(',')
+                if name == 'NMEA':
+                    headers[name] = ['Message', 'UnixTimeMillis']
+                elif name not in headers or not rest:
+                    continue
+                lines = pending.setdefault(name, [])
+                lines.append(rest)
+                if len(lines) >= chunk_rows:
+                    flush(name)
+        for name in list(pending):
+            flush(name)
+        for writer in writers.values():
+            writer.finish()
+
+        stat = os.stat(input_filepath)
+        meta = {'version': STORE_VERSION, 'source': os.path.abspath(input_filepath), 'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime, 'tables': {name: writer.metadata() for name, writer in writers.items()}}
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle, indent=1)
+        shutil.rmtree(store_directory, ignore_errors=True)
+        os.replace(tmp_directory, store_directory)
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+    return LogStore(store_directory)
+
+
+def open_store(input_filepath, store_directory=None, dtypes=None):
+    # Open the store of a log, ingesting it first if it is missing or older than the log
+    store_directory = store_directory or store_directory_for(input_filepath)
+    try:
+        store = LogStore(store_directory)
+        stat = os.stat(input_filepath)
+        if store.meta.get('version') == STORE_VERSION and store.meta['source_size'] == stat.st_size \
+                and store.meta['source_mtime'] == stat.st_mtime:
+            return store
+    except (OSError, ValueError, KeyError):
+        pass
+    return ingest_log(input_filepath, store_directory, dtypes)
+
+
+class LogStore():
+    def __init__(self, store_directory):
+        self.directory = store_directory
+        with open(os.path.join(store_directory, 'meta.json')) as handle:
+            self.meta = json.load(handle)
+        self.tables = self.meta['tables']
+        self.maps = {}
+
+    def __contains__(self, table):
+        return table in self.tables
+
+    def rows(self, table):
+        return self.tables[table]['rows']
+
+    def array(self, table, filename, dtype):
+        # Cached read-only memory map of one file of a table
+        key = (table, filename)
+        if key not in self.maps:
+            path = os.path.join(self.directory, table, filename)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                self.maps[key] = np.empty(0, dtype=dtype)
+            else:
+                self.maps[key] = np.memmap(path, dtype=dtype, mode='r')
+        return self.maps[key]
+
+    def column(self, table, column, start=0, stop=None):
+        # Rows [start:stop] of a column: a memory-mapped view for numbers, an object array for strings
+        dtype = self.tables[table]['dtypes'][column]
+        stop = self.rows(table) if stop is None else stop
+        if dtype != 'str':
+            return self.array(table, column + '.bin', dtype)[start:stop]
+        offsets = self.array(table, column + '.offsets.bin', np.int64)[start:stop + 1]
+        if offsets.size == 0:
+            return np.empty(0, dtype=object)
+        data = self.array(table, column + '.data.bin', np.uint8)[offsets[0]:offsets[-1]].tobytes()
+        offsets = offsets - offsets[0]
+        values = np.array([data[a:b].decode() for a, b in zip(offsets[:-1], offsets[1:])], dtype=object)
+        values[values == ''] = np.nan
+        return values
+
+    def read(self, table, start=0, stop=None, columns=None):
+        columns = columns or self.tables[table]['columns']
+        return pd.DataFrame({col: self.column(table, col, start, stop) for col in columns}, copy=False)
+
+    def times(self, table):
+        return self.array(table, TIME_FILE, np.int64)
+
+    def epochs(self, table='Raw'):
+        # First row of every epoch
+        return self.array(table, EPOCH_FILE, np.int64)
+
+    def time_slice(self, table, start=None, stop=None):
+        # Row range [first, last) with start <= time < stop, found by binary search on the time index.
+        # For a table whose times go backwards it is the smallest range covering every such row.
+        if not self.tables[table]['has_time']:
+            raise ValueError(f"table {table!r} has no time column")
+        times = self.times(table)
+        start = to_nanoseconds(start) if start is not None else None
+        stop = to_nanoseconds(stop) if stop is not None else None
+        if self.tables[table]['time_sorted']:
+            first = int(np.searchsorted(times, start, 'left')) if start is not None else 0
+            last = int(np.searchsorted(times, stop, 'left')) if stop is not None else times.size
+            return first, max(first, last)
+        inside = np.ones(times.size, dtype=bool)
+        if start is not None:
+            inside &= times >= start
+        if stop is not None:
+            inside &= times < stop
+        rows = np.flatnonzero(inside)
+        return (int(rows[0]), int(rows[-1]) + 1) if rows.size else (0, 0)
+
+    def read_time_range(self, table, start=None, stop=None, columns=None):
+        first, last = self.time_slice(table, start, stop)
+        frame = self.read(table, first, last, columns)
+        if not self.tables[table]['time_sorted']:
+            times = self.times(table)[first:last]
+            inside = np.ones(times.size, dtype=bool)
+            if start is not None:
+                inside &= times >= to_nanoseconds(start)
+            if stop is not None:
+                inside &= times < to_nanoseconds(stop)
+            frame = frame.loc[inside].reset_index(drop=True)
+        return frame
+
+    def iter_chunks(self, table, chunk_rows=CHUNK_ROWS, columns=None):
+        for start in range(0, self.rows(table), chunk_rows):
+            yield self.read(table, start, start + chunk_rows, columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest GnssLogger text logs into memory-mapped stores')
+    parser.add_argument('inputs', nargs='+', help='GnssLogger .txt files')
+    args = parser.parse_args()
+    for input_filepath in args.inputs:
+        store = ingest_log(input_filepath)
+        print(f"{input_filepath}: " + ', '.join(f"{name} {store.rows(name)} rows" for name in store.tables))
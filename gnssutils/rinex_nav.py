@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+
+"""
+Vectorized reader for RINEX 2 and 3 broadcast navigation files, a fast path for the georinex.load
+call in `EphemerisManager`. The file is read once into a (lines, 80) character array, records are
+grouped by system and the fixed-width 19 character fields of a group are decoded to float with
+array operations instead of per-field Python code. The returned frame has georinex's layout and
+field names (one row per record, 'time' and 'sv' columns), so the renaming and t_oc code
+downstream is unchanged.
+
+Supported are GPS, QZSS, Galileo and BeiDou (Keplerian, 8-line records) and GLONASS (4-line
+records, positions converted from km to m as georinex does). Other systems are skipped. Unlike
+georinex, an SV with a repeated epoch keeps its first record instead of being dropped or renamed.
+"""
+
+FIELD_WIDTH = 19
+LINE_WIDTH = 80
+
+GPS_FIELDS = ['SVclockBias', 'SVclockDrift', 'SVclockDriftRate', 'IODE', 'Crs', 'DeltaN', 'M0', 'Cuc',
+              'Eccentricity', 'Cus', 'sqrtA', 'Toe', 'Cic', 'Omega0', 'Cis', 'Io', 'Crc', 'omega', 'OmegaDot',
+              'IDOT', 'CodesL2', 'GPSWeek', 'L2Pflag', 'SVacc', 'health', 'TGD', 'IODC', 'TransTime', 'FitIntvl']
+GALILEO_FIELDS = ['SVclockBias', 'SVclockDrift', 'SVclockDriftRate', 'IODnav', 'Crs', 'DeltaN', 'M0', 'Cuc',
+                  'Eccentricity', 'Cus', 'sqrtA', 'Toe', 'Cic', 'Omega0', 'Cis', 'Io', 'Crc', 'omega', 'OmegaDot',
+                  'IDOT', 'DataSrc', 'GALWeek', 'spare0', 'SISA', 'health', 'BGDe5a', 'BGDe5b', 'TransTime']
+BEIDOU_FIELDS = ['SVclockBias', 'SVclockDrift', 'SVclockDriftRate', 'AODE', 'Crs', 'DeltaN', 'M0', 'Cuc',
+                 'Eccentricity', 'Cus', 'sqrtA', 'Toe', 'Cic', 'Omega0', 'Cis', 'Io', 'Crc', 'omega', 'OmegaDot',
+                 'IDOT', 'spare0', 'BDTWeek', 'spare1', 'SVacc', 'SatH1', 'TGD1', 'TGD2', 'TransTime', 'AODC']
+GLONASS_FIELDS = ['SVclockBias', 'SVrelFreqBias', 'MessageFrameTime', 'X', 'dX', 'dX2', 'health', 'Y', 'dY', 'dY2',
+                  'FreqNum', 'Z', 'dZ', 'dZ2', 'AgeOpInfo']
+SYSTEM_FIELDS = {'G': GPS_FIELDS, 'J': GPS_FIELDS, 'E': GALILEO_FIELDS, 'C': BEIDOU_FIELDS, 'R': GLONASS_FIELDS}
+# Lines per record including the epoch line, for skipping systems we don't parse
+RECORD_LINES = {'G': 8, 'J': 8, 'E': 8, 'C': 8, 'I': 8, 'R': 4, 'S': 4}
+# RINEX 2 file type letter to system
+RINEX2_SYSTEMS = {'N': 'G', 'G': 'R'}
+GLONASS_KM_FIELDS = ['X', 'dX', 'dX2', 'Y', 'dY', 'dY2', 'Z', 'dZ', 'dZ2']
+
+
+def read_header(text):
+    # Returns (header dict, offset of the first data line in text)
+    header = {}
+    start = 0
+    while start < len(text):
+        end = text.find(b'\n', start)
+        end = len(text) if end < 0 else end + 1
+        line = text[start:end].decode('ascii', 'replace').rstrip('\r\n')
+        start = end
+        label = line[60:].strip()
+        if label == 'RINEX VERSION / TYPE':
+            header['version'] = float(line[:9])
+            header['filetype'] = line[20]
+            header['system'] = line[40].strip() or 'G'
+        elif label == 'LEAP SECONDS':
+            header['leap_seconds'] = int(line[:6])
+        elif label == 'END OF HEADER':
+            return header, start
+    raise ValueError('RINEX navigation header without END OF HEADER')
+
+
+def line_array(text):
+    # Non-blank lines of text padded to LINE_WIDTH, as one (n_lines, LINE_WIDTH) uint8 character array
+    text = text.replace(b'\r', b'')
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    buffer = np.frombuffer(text, dtype=np.uint8)
+    ends = np.flatnonzero(buffer == ord('\n'))
+    width = ends[0] if len(ends) else 0
+    if 0 < width <= LINE_WIDTH and len(ends) * (width + 1) == len(buffer) and (np.diff(ends) == width + 1).all():
+        # Common case of equal-length lines: no per-line work
+        characters = buffer.reshape(len(ends), width + 1)[:, :width]
+        if not (characters.view(f'S{width}')[:, 0] == b' ' * width).any():
+            return np.pad(characters, ((0, 0), (0, LINE_WIDTH - width)), constant_values=ord(' '))
+    lines = [line for line in text.splitlines() if line.strip()]
+    return np.frombuffer(b''.join(line[:LINE_WIDTH].ljust(LINE_WIDTH) for line in lines),
+                         dtype=np.uint8).reshape(len(lines), LINE_WIDTH)
+
+
+def text_columns(characters, start, stop):
+    # (n, LINE_WIDTH) uint8 characters -> (n,) fixed-width byte strings of columns start:stop
+    return np.ascontiguousarray(characters[:, start:stop]).view(f'S{stop - start}')[:, 0]
+
+
+# Powers of ten that are exact doubles: scaling by them rounds only once
+EXACT_POWERS = 10.0 ** np.arange(23)
+
+
+def parse_numbers(fields):
+    # (n, FIELD_WIDTH) uint8 characters -> n floats. Fields in the usual ' d.ddddddddddddD+ee' layout
+    # are decoded from their digits: mantissa and power of ten are exact, so the quotient is correctly
+    # rounded and equals float(). Anything else (other layouts, very small exponents) goes through
+    # NumPy's string conversion, and blank fields are NaN.
+    # One contiguous row per character position: reductions along the short field axis are slow
+    columns = np.ascontiguousarray(fields.T)
+    digits = columns - np.uint8(ord('0'))  # non-digits wrap around to >= 10
+    sign, point, marker, exponent_sign = columns[0], columns[2], columns[15], columns[16]
+    regular = (((sign == ord(' ')) | (sign == ord('-'))) & (point == ord('.'))
+               & ((marker == ord('D')) | (marker == ord('E')) | (marker == ord('d')) | (marker == ord('e')))
+               & ((exponent_sign == ord('+')) | (exponent_sign == ord('-')))
+               & (digits[17] < 10) & (digits[18] < 10))
+    mantissa = np.zeros(len(fields), dtype=np.int64)
+    for i in (1, *range(3, 15)):
+        regular &= digits[i] < 10
+        mantissa *= 10
+        mantissa += digits[i]
+    scale = digits[17].astype(np.int64) * 10 + digits[18]
+    scale = np.where(exponent_sign == ord('-'), -scale, scale) - 12
+    regular &= np.abs(scale) < len(EXACT_POWERS)
+    power = EXACT_POWERS[np.where(regular, np.abs(scale), 0)]
+    values = np.where(scale < 0, mantissa / power, mantissa * power)
+    values = np.where(sign == ord('-'), -values, values)
+
+    irregular = np.flatnonzero(~regular)
+    if irregular.size:
+        other = fields[irregular].copy()
+        other[(other == ord('D')) | (other == ord('d'))] = ord('E')
+        other = other.view(f'S{FIELD_WIDTH}')[:, 0]
+        values[irregular] = np.where(other == b' ' * FIELD_WIDTH, b'nan', other).astype(float)
+    return values
+
+
+def parse_fields(records, data_start, continuation_start, n_fields):
+    # records: (n_records, n_lines, LINE_WIDTH) uint8 characters of one system. Lay the data fields
+    # of each record out in one row of 19 character fields and convert them with a single astype;
+    # blank fields become NaN.
+    n_records = len(records)
+    rows = np.concatenate([records[:, 0, data_start:data_start + 3 * FIELD_WIDTH],
+                           records[:, 1:, continuation_start:continuation_start + 4 * FIELD_WIDTH]
+                           .reshape(n_records, -1)], axis=1)
+    width = rows.shape[1] // FIELD_WIDTH
+    values = parse_numbers(rows.reshape(n_records * width, FIELD_WIDTH)).reshape(n_records, width)
+    if width < n_fields:
+        values = np.hstack([values, np.full((n_records, n_fields - width), np.nan)])
+    return values[:, :n_fields]
+
+
+# Columns of year, month, day, hour, minute and seconds in the epoch line
+RINEX3_EPOCH = [(4, 8), (9, 11), (12, 14), (15, 17), (18, 20), (21, 23)]
+RINEX2_EPOCH = [(3, 5), (6, 8), (9, 11), (12, 14), (15, 17), (17, 22)]
+
+
+def epoch_times(epoch_lines, version):
+    # Times of clock as datetime64[ns] from the fixed columns of the (n, LINE_WIDTH) epoch lines
+    columns = RINEX3_EPOCH if version >= 3 else RINEX2_EPOCH
+    year, month, day, hour, minute, second = (text_columns(epoch_lines, a, b).astype(float) for a, b in columns)
+    if version < 3:
+        year = np.where(year < 80, year + 2000, year + 1900)
+    months = ((year - 1970) * 12 + month - 1).astype('int64').astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1).astype('int64')
+    nanoseconds = np.round((hour * 3600 + minute * 60 + second) * 1e9).astype('int64')
+    return days.astype('datetime64[ns]') + nanoseconds.astype('timedelta64[ns]')
+
+
+def read_nav(filepath, use=None):
+    # Parse a navigation file into (DataFrame, header). use optionally limits the systems, e.g. {'G'}.
+    # Raises NotImplementedError for files this reader doesn't handle, so callers can fall back.
+    with open(filepath, 'rb') as f:
+        text = f.read()
+    header, body_start = read_header(text)
+    version = header['version']
+    if header['filetype'] not in ('N', 'G'):
+        raise NotImplementedError(f"not a navigation file: {filepath}")
+
+    characters = line_array(text[body_start:])
+    n_lines = len(characters)
+
+    # First line of each record, per system
+    starts = {}
+    if version >= 3:
+        i = 0
+        systems = characters[:, 0].tobytes().decode('ascii', 'replace')
+        while i < n_lines:
+            system = systems[i]
+            if system not in RECORD_LINES:
+                i += 1  # garbage line
+                continue
+            starts.setdefault(system, []).append(i)
+            i += RECORD_LINES[system]
+        data_start, continuation_start = 23, 4
+    else:
+        system = RINEX2_SYSTEMS[header['filetype']]
+        starts[system] = list(range(0, n_lines, RECORD_LINES[system]))
+        data_start, continuation_start = 22, 3
+
+    frames = []
+    for system, indices in starts.items():
+        if system not in SYSTEM_FIELDS or (use is not None and system not in use):
+            continue
+        # Drop a truncated last record
+        indices = np.array(indices)
+        indices = indices[indices + RECORD_LINES[system] <= n_lines]
+        records = characters[indices[:, None] + np.arange(RECORD_LINES[system])]
+        fields = SYSTEM_FIELDS[system]
+        values = parse_fields(records, data_start, continuation_start, len(fields))
+        if system == 'R':
+            km = [fields.index(field) for field in GLONASS_KM_FIELDS]
+            values[:, km] *= 1e3
+        prn = records[:, 0, :3].copy() if version >= 3 else np.insert(records[:, 0, :2], 0, ord(system), axis=1)
+        prn[prn == ord(' ')] = ord('0')
+        svs = text_columns(prn, 0, 3).astype(str).astype(object)
+        columns = {'time': epoch_times(records[:, 0], version), 'sv': svs}
+        columns.update((field, values[:, i]) for i, field in enumerate(fields) if not field.startswith('spare'))
+        frames.append(pd.DataFrame(columns))
+    if not frames:
+        return pd.DataFrame(columns=['time', 'sv']), header
+
+    data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # Sort by (time, sv) like georinex, keeping the first record of a repeated (time, sv)
+    times, svs = data['time'].to_numpy(), data['sv'].to_numpy().astype(str)
+    order = np.lexsort((svs, times))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = (times[order][1:] != times[order][:-1]) | (svs[order][1:] != svs[order][:-1])
+    return data.take(order[first]).reset_index(drop=True), header
@@ -0,0 +1,44 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+"""
+Helpers for handing NumPy arrays to worker processes through a single shared memory block
+instead of pickling them. The parent calls `share_arrays` and passes the block name and specs
+to the workers, which call `attach_arrays` and copy out the rows they need.
+"""
+
+ALIGNMENT = 64
+
+
+def share_arrays(arrays):
+    # Copy a dict of numeric/fixed-width arrays into one new shared memory block
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    specs = {}
+    size = 0
+    for name, array in arrays.items():
+        specs[name] = (size, array.shape, array.dtype.str)
+        size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, array in arrays.items():
+        offset, shape, dtype = specs[name]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = array
+    return shm, specs
+
+
+def attach_arrays(shm_name, specs, start=None, stop=None):
+    # Copy rows [start:stop] of every shared array into process-local memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        arrays = {}
+        for name, (offset, shape, dtype) in specs.items():
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            arrays[name] = view[start:stop].copy()
+            del view
+    finally:
+        shm.close()
+    return arrays
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
@@ -1,72 +1,862 @@
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import pyproj
+import pandas as pd
 import simplekml
-from pykalman import KalmanFilter
+
+from gnssutils.shared_arrays import share_arrays, attach_arrays, release
+from gnssutils.columnar_io import write_frame, read_frame
 
 WEEKSEC = 604800
 LIGHTSPEED = 2.99792458e8
+EPOCHS_PER_TASK = 5000
+WGS84_A = 6378137.0  # semi-major axis, meters
+WGS84_F = 1 / 298.257223563  # flattening
+MAX_ITERATIONS = 20  # Gauss-Newton iterations per solve
+DIVERGENCE_LIMIT = 1e8  # meters, a larger position step means the solve is diverging
+MAX_CONDITION = 1e10  # normal matrices worse conditioned than this are treated as singular
+RATE_COLUMNS = ['Sat.VX', 'Sat.VY', 'Sat.VZ', 'Pseudo-Range-Rate']  # Doppler inputs written by gnss_to_csv
+LOCATION_COLUMNS = ['X', 'Y', 'Z', 'Latitude', 'Longitude', 'Altitude']
+VELOCITY_COLUMNS = ['VX', 'VY', 'VZ']
+
+# Satellite filtering and integrity (RAIM) settings
+MIN_CN0 = 15.0  # dB-Hz, weaker signals are dropped before solving
+PR_SIGMA = 10.0  # meters, assumed pseudorange noise for the RAIM test
+RAIM_Z = 3.09  # standard normal quantile of the false alarm probability (1e-3)
+MAX_EXCLUSIONS = 2  # satellites excluded per epoch before giving up
+CN0_UNIFORM_STD = 1.0  # dB-Hz, a spread this small across 5+ satellites suggests a single transmitter
+MAX_SPEED = 100.0  # m/s between consecutive fixes
+MAX_CLOCK_RATE_JUMP = 300.0  # m/s deviation of the clock bias rate from its median
+
+
+geodetic_transformer = None  # built on the first conversion, False when pyproj isn't installed
+
+
+def ecef_to_geodetic(x, y, z):
+    # Closed-form WGS84 ECEF to geodetic conversion (Bowring), for use without pyproj.
+    # Sub-millimeter accurate for points near the Earth's surface.
+    x, y, z = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(z, dtype=float)
+    b = WGS84_A * (1 - WGS84_F)
+    e2 = WGS84_F * (2 - WGS84_F)
+    ep2 = e2 / (1 - e2)
+    p = np.hypot(x, y)
+    theta = np.arctan2(z * WGS84_A, p * b)
+    lat = np.arctan2(z + ep2 * b * np.sin(theta) ** 3, p - e2 * WGS84_A * np.cos(theta) ** 3)
+    lon = np.arctan2(y, x)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    n = WGS84_A / np.sqrt(1 - e2 * sin_lat ** 2)
+    # Near the poles p / cos(lat) is ill-conditioned, use z instead
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alt = np.where(np.abs(cos_lat) > 1e-10, p / cos_lat - n, np.abs(z) - b)
+    return np.degrees(lat), np.degrees(lon), alt
 
 
 def convert_to_geodetic(x, y, z):
-    transformer = pyproj.Transformer.from_crs("EPSG:4978", "EPSG:4326", always_xy=True)
-    lon, lat, alt = transformer.transform(x, y, z)
+    # Accepts scalars or arrays of ECEF coordinates and returns (lat, lon, alt) of the same shape.
+    # pyproj is only imported here, and its transformer built once: both cost far more than a transform.
+    global geodetic_transformer
+    if geodetic_transformer is None:
+        try:
+            import pyproj
+            geodetic_transformer = pyproj.Transformer.from_crs("EPSG:4978", "EPSG:4326", always_xy=True)
+        except ImportError:  # Fall back to the closed-form conversion
+            geodetic_transformer = False
+    if geodetic_transformer is False:
+        return ecef_to_geodetic(x, y, z)
+    lon, lat, alt = geodetic_transformer.transform(x, y, z)
     return lat, lon, alt
 
 
-def filter_satellites(measurements):
-    # Placeholder for satellite filtering logic
-    # Filter satellites based on constellation, CN0, etc.
-    return measurements
+def filter_satellites(measurements, constellations=None, min_cn0=MIN_CN0):
+    # Drop rows that can't be used in a fix, weak signals and unwanted constellations
+    keep = measurements[['Sat.X', 'Sat.Y', 'Sat.Z', 'Pseudo-Range']].notna().all(axis=1)
+    if min_cn0 is not None and 'CN0' in measurements:
+        keep &= measurements['CN0'] >= min_cn0
+    if constellations and 'SatPRN (ID)' in measurements:
+        keep &= measurements['SatPRN (ID)'].str[0].isin(list(constellations))
+    return measurements.loc[keep]
+
+
+def chi2_threshold(dof):
+    # Wilson-Hilferty approximation of the chi-square quantile at RAIM_Z, vectorized over dof
+    dof = np.maximum(dof, 1)
+    h = 2.0 / (9.0 * dof)
+    return dof * (1.0 - h + RAIM_Z * np.sqrt(h)) ** 3
+
+
+def row_clocks(measurements):
+    # One-hot (n_rows, n_systems) map of each row's GNSS, systems in sorted letter order. None for
+    # single-system frames, which are solved with one receiver clock bias as before.
+    if 'SatPRN (ID)' not in measurements:
+        return None
+    codes, systems = pd.factorize(measurements['SatPRN (ID)'].str[0], sort=True)
+    if len(systems) < 2:
+        return None
+    return codes[:, None] == np.arange(len(systems))
+
+
+def pack_clocks(measurements, layout=None):
+    # row_clocks in the pack_epochs layout, (n_epochs, max_sats, n_systems), or None
+    clocks = row_clocks(measurements)
+    if clocks is None:
+        return None
+    times, epoch_idx, sat_idx = layout or epoch_layout(measurements)
+    max_sats = int(sat_idx.max()) + 1 if sat_idx.size else 0
+    packed = np.zeros((len(times), max_sats, clocks.shape[1]), dtype=bool)
+    packed[epoch_idx, sat_idx] = clocks
+    return packed
+
+
+def clock_terms(clock_bias, clocks=None):
+    # Receiver clock bias of every (epoch, satellite) slot: the epoch's single bias, or with clocks
+    # the bias of each satellite's system from clock_bias (n_epochs, n_systems)
+    if clocks is None:
+        return clock_bias[:, None]
+    return np.einsum('eks,es->ek', clocks, clock_bias)
+
+
+def state_count(mask, clocks=None):
+    # Unknowns per epoch: the position plus one clock per system with satellites in the epoch
+    if clocks is None:
+        return np.full(mask.shape[0], 4)
+    return 3 + (clocks & mask[:, :, None]).any(axis=1).sum(axis=1)
+
+
+def normal_matrix(G):
+    # G^T G per epoch. A system without satellites in an epoch leaves its clock column empty, its
+    # unit diagonal keeps the matrix invertible and that clock's correction zero.
+    GtG = np.einsum('eki,ekj->eij', G, G)
+    diagonal = np.arange(GtG.shape[-1])
+    GtG[:, diagonal, diagonal] = np.where(GtG[:, diagonal, diagonal] == 0, 1.0, GtG[:, diagonal, diagonal])
+    return GtG
+
+
+def well_conditioned(GtG):
+    # Epochs whose normal matrix can be solved reliably: finite, with a condition number below MAX_CONDITION
+    good = np.isfinite(GtG).all(axis=(1, 2))
+    eigenvalues = np.linalg.eigvalsh(GtG[good])
+    good[good] = eigenvalues[:, 0] > eigenvalues[:, -1] / MAX_CONDITION
+    return good
+
+
+def pseudorange_residuals(sat_positions, measured_pr, mask, positions, clock_bias, clocks=None):
+    ranges = np.linalg.norm(sat_positions - positions[:, None, :], axis=2)
+    return np.where(mask, measured_pr - ranges - clock_terms(clock_bias, clocks), 0.0)
+
+
+def geometry_matrix(sat_positions, mask, positions, clocks=None):
+    # Stacked (n_epochs, max_sats, 4) linearized geometry, rows of padded satellites are zero.
+    # With clocks there is one clock column per system, (n_epochs, max_sats, 3 + n_systems).
+    los = sat_positions - positions[:, None, :]
+    ranges = np.linalg.norm(los, axis=2)
+    ranges[~mask] = 1.0
+    G = np.ones(los.shape[:2] + (4 if clocks is None else 3 + clocks.shape[2],))
+    G[:, :, :3] = -los / ranges[:, :, None]
+    if clocks is not None:
+        G[:, :, 3:] = clocks
+    return G * mask[:, :, None]
+
+
+def leave_one_out(G, residuals):
+    # Fault exclusion by rank-one downdating of the converged normal equations. For every epoch and
+    # satellite k, Sherman-Morrison gives the state correction and residual sum of squares of the
+    # solution without k: dx_k = -P g_k r_k / (1 - h_k) and SSE_k = SSE - r_k^2 / (1 - h_k).
+    P = np.linalg.inv(normal_matrix(G))
+    Pg = np.einsum('eij,ekj->eki', P, G)
+    leverage = np.einsum('eki,eki->ek', G, Pg)
+    scaled = residuals / np.clip(1.0 - leverage, 1e-9, None)
+    sse = (residuals ** 2).sum(axis=1)
+    return sse[:, None] - residuals * scaled, -Pg * scaled[:, :, None]
+
+
+def raim_fde(sat_positions, measured_pr, mask, initial_pos, initial_bias=0.0, max_exclusions=MAX_EXCLUSIONS,
+             clocks=None):
+    # Batched RAIM: solve all epochs once, then for epochs failing the chi-square residual test drop
+    # the satellite whose removal leaves the smallest residual, up to max_exclusions times. Exclusions
+    # downdate the converged fix instead of re-solving it. clocks is an optional pack_clocks map.
+    active = mask.copy()
+    positions, clock_bias, _, _ = trilateration_batch(sat_positions, measured_pr, active, initial_pos, initial_bias,
+                                                      clocks=clocks)
+    residuals = pseudorange_residuals(sat_positions, measured_pr, active, positions, clock_bias, clocks)
+    for _ in range(max_exclusions + 1):
+        n_sats = active.sum(axis=1)
+        n_states = state_count(active, clocks)
+        statistic = (residuals ** 2).sum(axis=1) / PR_SIGMA ** 2
+        fault = (n_sats > n_states) & (statistic > chi2_threshold(n_sats - n_states))
+        # Identifying the faulty satellite needs a redundant measurement left after excluding it
+        idx = np.flatnonzero(fault & (n_sats > n_states + 1) & ((mask.sum(axis=1) - n_sats) < max_exclusions))
+        if idx.size == 0:
+            break
+        epoch_clocks = None if clocks is None else clocks[idx]
+        G = geometry_matrix(sat_positions[idx], active[idx], positions[idx], epoch_clocks)
+        conditioned = well_conditioned(normal_matrix(G))
+        if not conditioned.all():
+            idx, G = idx[conditioned], G[conditioned]
+            epoch_clocks = None if clocks is None else epoch_clocks[conditioned]
+        sse_without, corrections = leave_one_out(G, residuals[idx])
+        worst = np.where(active[idx], sse_without, np.inf).argmin(axis=1)
+        rows = np.arange(idx.size)
+        positions[idx] += corrections[rows, worst, :3]
+        clock_bias[idx] += corrections[rows, worst, 3] if clocks is None else corrections[rows, worst, 3:]
+        active[idx, worst] = False
+        residuals[idx] = pseudorange_residuals(sat_positions[idx], measured_pr[idx], active[idx],
+                                               positions[idx], clock_bias[idx], epoch_clocks)
+    return positions, clock_bias, active, residuals, statistic, fault
+
+
+def integrity_report(measurements):
+    # Per-epoch RAIM, CN0 and jump checks over a whole log in array operations.
+    # Returns (epoch report indexed by GPS time, per-row residuals, per-row exclusion flags)
+    layout = epoch_layout(measurements)
+    times, epoch_idx, sat_idx = layout
+    _, sat_pos, measured_pr, mask = pack_epochs(measurements, layout)
+    clocks = pack_clocks(measurements, layout)
+    counts = np.maximum(mask.sum(axis=1), 1)
+    initial_pos = (sat_pos * mask[:, :, None]).sum(axis=1) / counts[:, None]
+    positions, clock_bias, active, residuals, statistic, fault = raim_fde(sat_pos, measured_pr, mask, initial_pos,
+                                                                          clocks=clocks)
+    if clocks is not None:
+        # Jumps are checked on the clock of the system with the most measurements
+        main = clocks[mask].sum(axis=0).argmax()
+        clock_bias = np.where((clocks[:, :, main] & active).any(axis=1), clock_bias[:, main], np.nan)
+
+    report = pd.DataFrame(index=pd.Index(times, name='GPS time'))
+    report['Satellites'] = mask.sum(axis=1)
+    report['Excluded'] = (mask & ~active).sum(axis=1)
+    report['RAIM statistic'] = statistic
+    report['RAIM fault'] = fault
+
+    # A spoofer transmits every satellite from one antenna, so CN0 is suspiciously uniform
+    if 'CN0' in measurements:
+        cn0 = np.full(mask.shape, np.nan)
+        cn0[epoch_idx, sat_idx] = measurements['CN0'].to_numpy(dtype=float)
+        cn0[~active] = np.nan
+        with np.errstate(invalid='ignore'):
+            report['CN0 std'] = np.nanstd(cn0, axis=1)
+        report['CN0 uniform'] = (active.sum(axis=1) >= 5) & (report['CN0 std'] < CN0_UNIFORM_STD)
+    else:
+        report['CN0 uniform'] = False
+
+    # Epoch-to-epoch position and clock bias jumps
+    seconds = (pd.to_datetime(pd.Index(times), utc=True) - pd.Timestamp(0, tz='UTC')).total_seconds().to_numpy()
+    dt = np.diff(seconds, prepend=np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.linalg.norm(np.diff(positions, axis=0, prepend=np.nan), axis=1) / dt
+        clock_rate = np.diff(clock_bias, prepend=np.nan) / dt
+        report['Speed'] = speed
+        report['Position jump'] = speed > MAX_SPEED
+        report['Clock jump'] = np.abs(clock_rate - np.nanmedian(clock_rate)) > MAX_CLOCK_RATE_JUMP \
+            if np.isfinite(clock_rate).any() else False
+    report['Spoofed'] = report['RAIM fault'] | report['CN0 uniform'] | report['Position jump'] | report['Clock jump']
+
+    row_residuals = residuals[epoch_idx, sat_idx]
+    row_excluded = mask[epoch_idx, sat_idx] & ~active[epoch_idx, sat_idx]
+    return report, row_residuals, row_excluded
 
 
 def detect_jamming(measurements):
-    # Placeholder for jamming detection logic
-    # Implement your algorithm to detect and handle jamming
+    # Annotate every measurement with its residual, whether RAIM excluded it and whether its epoch
+    # looks spoofed or jammed. Rows are kept; solvers drop the 'Excluded' ones.
+    if measurements.empty:
+        return measurements
+    report, residuals, excluded = integrity_report(measurements)
+    measurements = measurements.copy()
+    measurements['Residual'] = residuals
+    measurements['Excluded'] = excluded
+    measurements['Spoofed'] = measurements['GPS time'].map(report['Spoofed']).to_numpy(dtype=bool)
     return measurements
 
 
-def trilateration(sat_positions, measured_pr, initial_pos, initial_bias):
-    position_corr = 100 * np.ones(3)
-    clock_bias = initial_bias
+def usable_measurements(measurements):
+    measurements = filter_satellites(measurements)
+    measurements = detect_jamming(measurements)
+    if 'Excluded' in measurements:
+        measurements = measurements.loc[~measurements['Excluded']]
+    return measurements
+
 
-    while np.linalg.norm(position_corr) > 1e-3:
-        ranges = np.linalg.norm(sat_positions - initial_pos, axis=1)
-        pred_pr = ranges + clock_bias
+def trilateration_state(sat_positions, measured_pr, initial_pos, initial_bias, max_iterations=MAX_ITERATIONS,
+                        clocks=None):
+    # Gauss-Newton position and clock bias solve. Returns (position, clock_bias, iterations, converged).
+    # With clocks, a (n_sats, n_systems) row_clocks map, clock_bias is an array of per-system biases.
+    position = np.array(initial_pos, dtype=float)
+    if clocks is None:
+        clock_bias = float(initial_bias)
+    else:
+        clock_bias = np.broadcast_to(np.asarray(initial_bias, dtype=float), clocks.shape[1:]).copy()
+
+    for iteration in range(1, max_iterations + 1):
+        ranges = np.linalg.norm(sat_positions - position, axis=1)
+        pred_pr = ranges + (clock_bias if clocks is None else clocks @ clock_bias)
         residuals = measured_pr - pred_pr
 
-        G = np.ones((measured_pr.size, 4))
-        G[:, :3] = -(sat_positions - initial_pos) / ranges[:, None]
-        corrections = np.linalg.inv(G.T @ G) @ G.T @ residuals
+        G = np.ones((measured_pr.size, 4 if clocks is None else 3 + clocks.shape[1]))
+        G[:, :3] = -(sat_positions - position) / ranges[:, None]
+        if clocks is not None:
+            G[:, 3:] = clocks
+        GtG = G.T @ G
+        if clocks is not None:
+            # Same unit diagonal for absent systems as normal_matrix
+            absent = np.flatnonzero(np.diag(GtG) == 0)
+            GtG[absent, absent] = 1.0
+        try:
+            corrections = np.linalg.solve(GtG, G.T @ residuals)
+        except np.linalg.LinAlgError:
+            return position, clock_bias, iteration, False
 
-        position_corr, clock_bias_corr = corrections[:3], corrections[3]
-        initial_pos += position_corr
+        position_corr, clock_bias_corr = corrections[:3], corrections[3] if clocks is None else corrections[3:]
+        step = np.linalg.norm(position_corr)
+        if not np.isfinite(step) or step > DIVERGENCE_LIMIT:
+            return position, clock_bias, iteration, False
+        position += position_corr
         clock_bias += clock_bias_corr
+        if step <= 1e-3:
+            return position, clock_bias, iteration, True
 
-    lat, lon, alt = convert_to_geodetic(*initial_pos)
-    return initial_pos[0], initial_pos[1], initial_pos[2], lat, lon, alt
+    return position, clock_bias, max_iterations, False
 
 
-def calculate_locations_real_time(measurements):
-    measurements = filter_satellites(measurements)
-    measurements = detect_jamming(measurements)
+def trilateration(sat_positions, measured_pr, initial_pos, initial_bias, max_iterations=MAX_ITERATIONS):
+    # (x, y, z, lat, lon, alt) of the last iterate, use trilateration_state to know whether it converged
+    position, _, _, _ = trilateration_state(sat_positions, measured_pr, initial_pos, initial_bias, max_iterations)
+    lat, lon, alt = convert_to_geodetic(*position)
+    return position[0], position[1], position[2], lat, lon, alt
+
+
+def epoch_layout(measurements):
+    # Sorted epoch times plus each row's epoch and slot within the epoch
+    grouped = measurements.groupby('GPS time', sort=True)
+    epoch_idx = grouped.ngroup().to_numpy()
+    sat_idx = grouped.cumcount().to_numpy()
+    return list(grouped.groups.keys()), epoch_idx, sat_idx
+
+
+def pack_epochs(measurements, layout=None):
+    # Pack every epoch into padded (n_epochs, max_sats, ...) arrays plus a validity mask
+    times, epoch_idx, sat_idx = layout or epoch_layout(measurements)
+    n_epochs = len(times)
+    max_sats = int(sat_idx.max()) + 1 if sat_idx.size else 0
+
+    sat_positions = np.zeros((n_epochs, max_sats, 3))
+    measured_pr = np.zeros((n_epochs, max_sats))
+    mask = np.zeros((n_epochs, max_sats), dtype=bool)
+    sat_positions[epoch_idx, sat_idx] = measurements[['Sat.X', 'Sat.Y', 'Sat.Z']].to_numpy(dtype=float)
+    measured_pr[epoch_idx, sat_idx] = measurements['Pseudo-Range'].to_numpy(dtype=float)
+    mask[epoch_idx, sat_idx] = True
+    return times, sat_positions, measured_pr, mask
+
+
+def pack_rates(measurements, layout=None):
+    # Satellite velocities and pseudorange rates in the pack_epochs layout, rates are NaN where missing
+    times, epoch_idx, sat_idx = layout or epoch_layout(measurements)
+    max_sats = int(sat_idx.max()) + 1 if sat_idx.size else 0
+    sat_velocities = np.zeros((len(times), max_sats, 3))
+    rates = np.full((len(times), max_sats), np.nan)
+    if set(RATE_COLUMNS).issubset(measurements.columns):
+        sat_velocities[epoch_idx, sat_idx] = measurements[RATE_COLUMNS[:3]].to_numpy(dtype=float)
+        rates[epoch_idx, sat_idx] = measurements['Pseudo-Range-Rate'].to_numpy(dtype=float)
+    return sat_velocities, rates
+
+
+def velocity_batch(sat_positions, sat_velocities, rates, mask, positions):
+    # Receiver velocity and clock drift from pseudorange rates, one linear least-squares solve per epoch.
+    # The rate of satellite k is u_k . (v_sat - v) + drift, so the position fix's geometry matrix
+    # (rows [-u_k, 1]) is also the velocity design matrix. Returns (velocities (n_epochs, 3), clock_drift)
+    mask = mask & np.isfinite(rates) & np.isfinite(positions).all(axis=1)[:, None]
+    G = geometry_matrix(sat_positions, mask, np.nan_to_num(positions))
+    observed = np.where(mask, rates + np.einsum('eki,eki->ek', G[:, :, :3], sat_velocities), 0.0)
+
+    solution = np.full((mask.shape[0], 4), np.nan)
+    solvable = mask.sum(axis=1) >= 4
+    GtG = np.einsum('eki,ekj->eij', G[solvable], G[solvable])
+    conditioned = well_conditioned(GtG)
+    solvable[solvable] = conditioned
+    GtG = GtG[conditioned]
+    Gty = np.einsum('eki,ek->ei', G[solvable], observed[solvable])
+    solution[solvable] = np.linalg.solve(GtG, Gty[:, :, None])[:, :, 0]
+    return solution[:, :3], solution[:, 3]
+
+
+def calculate_velocities(measurements, coordinates=None):
+    # Doppler velocity for every epoch as {GPS time: (vx, vy, vz)} in ECEF m/s. The geometry comes
+    # from coordinates (any calculate_locations result) or else from a batch position solve.
+    measurements = usable_measurements(measurements)
+    layout = epoch_layout(measurements)
+    times, sat_pos, measured_pr, mask = pack_epochs(measurements, layout)
+    sat_vel, rates = pack_rates(measurements, layout)
+    if coordinates is None:
+        counts = np.maximum(mask.sum(axis=1), 1)
+        initial_pos = (sat_pos * mask[:, :, None]).sum(axis=1) / counts[:, None]
+        positions, _, _, _ = trilateration_batch(sat_pos, measured_pr, mask, initial_pos, 0.0,
+                                                 clocks=pack_clocks(measurements, layout))
+    else:
+        positions = np.array([coordinates[time][:3] if time in coordinates else (np.nan,) * 3 for time in times],
+                             dtype=float).reshape(-1, 3)
+    velocities, _ = velocity_batch(sat_pos, sat_vel, rates, mask, positions)
+    return {time: tuple(velocities[i]) for i, time in enumerate(times) if np.isfinite(velocities[i]).all()}
+
 
+def trilateration_batch(sat_positions, measured_pr, mask, initial_pos, initial_bias, max_iterations=MAX_ITERATIONS,
+                        tol=1e-3, clocks=None):
+    # Gauss-Newton over all epochs at once, padded satellites are masked out of the normal equations.
+    # With a pack_clocks map every system gets its own receiver clock and clock_bias is returned
+    # as (n_epochs, n_systems); a system absent from an epoch keeps its initial bias there.
+    # Epochs that are underdetermined, singular or diverge come back NaN and not converged.
+    positions = np.array(initial_pos, dtype=float)
+    bias_shape = positions.shape[:1] if clocks is None else positions.shape[:1] + clocks.shape[2:]
+    clock_bias = np.broadcast_to(np.asarray(initial_bias, dtype=float), bias_shape).copy()
+    n_epochs = positions.shape[0]
+    weights = mask.astype(float)
+
+    # Epochs with fewer satellites than unknowns are singular, never iterate on them
+    solvable = mask.sum(axis=1) >= state_count(mask, clocks)
+    active = solvable.copy()
+    converged = np.zeros(n_epochs, dtype=bool)
+    iterations = np.zeros(n_epochs, dtype=int)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        los = sat_positions[idx] - positions[idx, None, :]
+        ranges = np.linalg.norm(los, axis=2)
+        ranges[~mask[idx]] = 1.0
+        epoch_clocks = None if clocks is None else clocks[idx]
+        residuals = (measured_pr[idx] - ranges - clock_terms(clock_bias[idx], epoch_clocks)) * weights[idx]
+
+        G = np.ones((idx.size, los.shape[1], 4 if clocks is None else 3 + clocks.shape[2]))
+        G[:, :, :3] = -los / ranges[:, :, None]
+        if clocks is not None:
+            G[:, :, 3:] = epoch_clocks
+        G *= weights[idx, :, None]
+        GtG = normal_matrix(G)
+        # Degenerate geometry (repeated or collinear satellites) makes an epoch unsolvable rather than
+        # failing the solve of the whole stack
+        singular = ~well_conditioned(GtG)
+        if singular.any():
+            solvable[idx[singular]] = False
+            active[idx[singular]] = False
+            keep = ~singular
+            idx, G, GtG, residuals = idx[keep], G[keep], GtG[keep], residuals[keep]
+        Gtr = np.einsum('eki,ek->ei', G, residuals)
+        corrections = np.linalg.solve(GtG, Gtr[:, :, None])[:, :, 0]
+
+        # Like trilateration_state, an epoch whose step blows up is diverging and gets no fix
+        step = np.linalg.norm(corrections[:, :3], axis=1)
+        diverged = ~(step <= DIVERGENCE_LIMIT)
+        if diverged.any():
+            solvable[idx[diverged]] = False
+            active[idx[diverged]] = False
+            keep = ~diverged
+            idx, corrections, step = idx[keep], corrections[keep], step[keep]
+
+        positions[idx] += corrections[:, :3]
+        clock_bias[idx] += corrections[:, 3] if clocks is None else corrections[:, 3:]
+        iterations[idx] += 1
+
+        done = step <= tol
+        converged[idx[done]] = True
+        active[idx[done]] = False
+
+    positions[~solvable] = np.nan
+    clock_bias[~solvable] = np.nan
+    return positions, clock_bias, converged, iterations
+
+
+def solve_epoch_range(shm_name, specs, start, stop):
+    # Worker side of parallel_trilateration
+    arrays = attach_arrays(shm_name, specs, start, stop)
+    positions, _, converged, _ = trilateration_batch(arrays['sat_pos'], arrays['measured_pr'], arrays['mask'],
+                                                     arrays['initial_pos'], 0.0, clocks=arrays.get('clocks'))
+    return positions, converged
+
+
+def parallel_trilateration(sat_pos, measured_pr, mask, initial_pos, workers=None, epochs_per_task=EPOCHS_PER_TASK,
+                           clocks=None):
+    # Solve chunks of epochs on a process pool, the packed arrays go through shared memory
+    task_starts = np.arange(0, sat_pos.shape[0], epochs_per_task)
+    task_stops = np.r_[task_starts[1:], sat_pos.shape[0]]
+    arrays = {'sat_pos': sat_pos, 'measured_pr': measured_pr, 'mask': mask, 'initial_pos': initial_pos}
+    if clocks is not None:
+        arrays['clocks'] = clocks
+    shm, specs = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(solve_epoch_range, [shm.name] * len(task_starts),
+                                        [specs] * len(task_starts), task_starts, task_stops))
+    finally:
+        release(shm)
+    if not results:
+        return np.empty((0, 3)), np.empty(0, dtype=bool)
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def calculate_locations_batch(measurements, workers=None):
+    measurements = usable_measurements(measurements)
+
+    layout = epoch_layout(measurements)
+    times, sat_pos, measured_pr, mask = pack_epochs(measurements, layout)
+    clocks = pack_clocks(measurements, layout)
+    counts = np.maximum(mask.sum(axis=1), 1)
+    initial_pos = (sat_pos * mask[:, :, None]).sum(axis=1) / counts[:, None]
+
+    if workers and workers > 1:
+        positions, converged = parallel_trilateration(sat_pos, measured_pr, mask, initial_pos, workers, clocks=clocks)
+    else:
+        positions, _, converged, _ = trilateration_batch(sat_pos, measured_pr, mask, initial_pos, 0.0, clocks=clocks)
+    lat, lon, alt = convert_to_geodetic(positions[:, 0], positions[:, 1], positions[:, 2])
+
+    # Like the sequential solver, epochs with too few satellites or without a converged fix are skipped
+    solved = converged & np.isfinite(positions).all(axis=1)
+    result_coords = {}
+    for i in np.flatnonzero(solved):
+        result_coords[times[i]] = (positions[i, 0], positions[i, 1], positions[i, 2], lat[i], lon[i], alt[i])
+    return result_coords
+
+
+def trilateration_fde(sat_positions, measured_pr, initial_pos, initial_bias, max_exclusions=MAX_EXCLUSIONS):
+    # trilateration with fault detection and exclusion. Returns the corrected fix in trilateration's
+    # (x, y, z, lat, lon, alt) form, a boolean mask of the satellites used and the final test statistics.
+    mask = np.ones((1, measured_pr.size), dtype=bool)
+    positions, clock_bias, used, residuals, statistic, fault = raim_fde(
+        sat_positions[None], measured_pr[None], mask, np.asarray(initial_pos, dtype=float)[None],
+        initial_bias, max_exclusions)
+    position, used = positions[0], used[0]
+    n_sats = used.sum()
+    statistics = {
+        'statistic': statistic[0],
+        'threshold': chi2_threshold(n_sats - 4) if n_sats > 4 else np.nan,
+        'fault': bool(fault[0]),
+        'excluded': np.flatnonzero(~used),
+        'residuals': residuals[0],
+        'clock_bias': clock_bias[0],
+    }
+    lat, lon, alt = convert_to_geodetic(*position)
+    return (position[0], position[1], position[2], lat, lon, alt), used, statistics
+
+
+def calculate_locations_sequential(measurements, extrapolate=True):
+    # Solve epochs in time order, warm-starting each from the previous fix and clock bias (moved
+    # forward by the velocity and clock drift when extrapolate is set, from Doppler when the frame
+    # has pseudorange rates, else from the last two fixes). Falls back to a cold start from the
+    # satellite centroid when a warm start fails.
+    # Returns (result_coords, iterations used per epoch)
+    measurements = usable_measurements(measurements)
+    layout = epoch_layout(measurements)
+    times, sat_pos, measured_pr, mask = pack_epochs(measurements, layout)
+    sat_vel, rates = pack_rates(measurements, layout)
+    clocks = pack_clocks(measurements, layout)
+    n_states = state_count(mask, clocks)
+    seconds = (pd.to_datetime(pd.Index(times), utc=True) - pd.Timestamp(0, tz='UTC')).total_seconds().to_numpy()
+
+    positions = np.full((len(times), 3), np.nan)
+    iterations = np.zeros(len(times), dtype=int)
+    previous = []  # up to two (seconds, position, clock_bias) of the latest fixes
+    velocity = None  # (velocity, clock_drift) at the latest fix
+    for i in range(len(times)):
+        valid = mask[i]
+        if valid.sum() < n_states[i]:
+            continue
+        sats, pr = sat_pos[i, valid], measured_pr[i, valid]
+        epoch_clocks = None if clocks is None else clocks[i, valid]
+        converged = False
+        if previous:
+            t_last, initial_pos, initial_bias = previous[-1]
+            if extrapolate and velocity is not None:
+                initial_pos = initial_pos + velocity[0] * (seconds[i] - t_last)
+                initial_bias = initial_bias + velocity[1] * (seconds[i] - t_last)
+            elif extrapolate and len(previous) == 2 and seconds[i] > t_last > previous[0][0]:
+                scale = (seconds[i] - t_last) / (t_last - previous[0][0])
+                initial_pos = initial_pos + scale * (initial_pos - previous[0][1])
+                initial_bias = initial_bias + scale * (initial_bias - previous[0][2])
+            position, clock_bias, used, converged = trilateration_state(sats, pr, initial_pos, initial_bias,
+                                                                        clocks=epoch_clocks)
+            iterations[i] = used
+        if not converged:
+            position, clock_bias, used, converged = trilateration_state(sats, pr, sats.mean(axis=0), 0.0,
+                                                                        clocks=epoch_clocks)
+            iterations[i] += used
+        if converged:
+            positions[i] = position
+            previous = (previous + [(seconds[i], position, clock_bias)])[-2:]
+            if extrapolate:
+                epoch_velocity, clock_drift = velocity_batch(sat_pos[i:i + 1], sat_vel[i:i + 1], rates[i:i + 1],
+                                                             mask[i:i + 1], position[None])
+                velocity = (epoch_velocity[0], clock_drift[0]) if np.isfinite(clock_drift[0]) else None
+
+    lat, lon, alt = convert_to_geodetic(positions[:, 0], positions[:, 1], positions[:, 2])
+    result_coords = {}
+    for i, time in enumerate(times):
+        if np.isfinite(positions[i, 0]):
+            result_coords[time] = (positions[i, 0], positions[i, 1], positions[i, 2], lat[i], lon[i], alt[i])
+    return result_coords, dict(zip(times, iterations))
+
+
+class NavigationFilter():
+    # Extended Kalman filter over [x, y, z, vx, vy, vz, clock bias, clock drift] (meters, m/s), fed
+    # with pseudoranges and, when available, pseudorange rates. Measurements are applied one at a
+    # time as scalar updates, so an epoch costs O(n_sats) with no matrix inversion.
+    # With several systems (letters, the first one is the reference clock) the state gains one
+    # inter-system bias per other system, the offset of its receiver clock from the reference.
+    accel_psd = 1.0  # m^2/s^3, white acceleration noise of the constant velocity model
+    bias_psd = 1.0  # m^2/s, receiver clock phase noise
+    drift_psd = 10.0  # m^2/s^3, receiver clock frequency noise
+    isb_psd = 0.01  # m^2/s, inter-system bias random walk
+    isb_sigma = 1000.0  # meters, initial uncertainty of an inter-system bias not yet observed
+    pr_sigma = PR_SIGMA  # meters
+    rate_sigma = 0.5  # m/s
+    gate = 5.0  # innovations beyond this many standard deviations are rejected
+    clock_reset = 1000.0  # meters, a common pseudorange offset this large is a receiver clock jump
+
+    def __init__(self, keep_history=False, systems=None):
+        self.systems = list(systems) if systems is not None and len(systems) > 1 else None
+        self.dimension = 8 if self.systems is None else 7 + len(self.systems)
+        self.state = None
+        self.covariance = None
+        self.time = None
+        # (transition, predicted state, predicted covariance, state, covariance) per epoch for smoothing
+        self.history = [] if keep_history else None
+
+    def step(self, epoch_measurements):
+        # Update with one epoch of parse_gnss_log rows and return the filtered state (None until initialized)
+        seconds = (pd.Timestamp(epoch_measurements['GPS time'].iloc[0]) - pd.Timestamp(0, tz='UTC')).total_seconds()
+        sat_positions = epoch_measurements[['Sat.X', 'Sat.Y', 'Sat.Z']].to_numpy(dtype=float)
+        measured_pr = epoch_measurements['Pseudo-Range'].to_numpy(dtype=float)
+        sat_velocities = rates = None
+        if set(RATE_COLUMNS).issubset(epoch_measurements.columns):
+            sat_velocities = epoch_measurements[RATE_COLUMNS[:3]].to_numpy(dtype=float)
+            rates = epoch_measurements['Pseudo-Range-Rate'].to_numpy(dtype=float)
+        clocks = None
+        if self.systems is not None:
+            clocks = epoch_measurements['SatPRN (ID)'].str[0].to_numpy()[:, None] == np.array(self.systems)
+        return self.update_epoch(seconds, sat_positions, measured_pr, sat_velocities, rates, clocks)
+
+    def update_epoch(self, seconds, sat_positions, measured_pr, sat_velocities=None, rates=None, clocks=None):
+        # clocks is a (n_sats, n_systems) one-hot map over self.systems, needed when there are several
+        dt = seconds - self.time if self.time is not None else 0.0
+        if self.state is None or dt > 60.0:
+            return self.initialize(seconds, sat_positions, measured_pr, clocks)
+        transition = self.predict(dt)
+        self.time = seconds
+
+        # Android receiver clocks jump by whole milliseconds, absorb a common offset into the bias
+        ranges = np.linalg.norm(sat_positions - self.state[:3], axis=1)
+        isb = 0.0 if clocks is None else clocks[:, 1:] @ self.state[8:]
+        offset = np.median(measured_pr - ranges - self.state[6] - isb)
+        if abs(offset) > self.clock_reset:
+            self.state[6] += offset
+            self.covariance[6, 6] += offset ** 2
+        predicted_state, predicted_covariance = self.state.copy(), self.covariance.copy()
+
+        h = np.zeros(self.dimension)
+        accepted = 0
+        for i in range(measured_pr.size):
+            line_of_sight = sat_positions[i] - self.state[:3]
+            distance = np.linalg.norm(line_of_sight)
+            unit = line_of_sight / distance
+            h[:] = 0.0
+            h[:3] = -unit
+            h[6] = 1.0
+            if clocks is not None:
+                h[8:] = clocks[i, 1:]
+            isb = 0.0 if clocks is None else h[8:] @ self.state[8:]
+            accepted += self.update(h, measured_pr[i] - distance - self.state[6] - isb, self.pr_sigma ** 2)
+            if rates is not None and np.isfinite(rates[i]):
+                h[:] = 0.0
+                h[3:6] = -unit
+                h[7] = 1.0
+                predicted_rate = unit @ (sat_velocities[i] - self.state[3:6]) + self.state[7]
+                self.update(h, rates[i] - predicted_rate, self.rate_sigma ** 2)
+        if 2 * accepted < measured_pr.size:
+            # Most pseudoranges disagree with the prediction, start over from a snapshot fix
+            return self.initialize(seconds, sat_positions, measured_pr, clocks)
+
+        if self.history is not None:
+            self.history.append((transition, predicted_state, predicted_covariance, self.state.copy(),
+                                 self.covariance.copy()))
+        return self.state.copy()
+
+    def initialize(self, seconds, sat_positions, measured_pr, clocks=None):
+        self.time = seconds
+        position, clock_bias, _, converged = trilateration_state(sat_positions, measured_pr,
+                                                                 sat_positions.mean(axis=0), 0.0, clocks=clocks)
+        # The reference system must be seen to anchor the clock, the other biases start from it
+        present = np.ones(1, dtype=bool) if clocks is None else clocks.any(axis=0)
+        if measured_pr.size < 3 + present.sum() or not present[0] or not converged:
+            self.state = self.covariance = None
+            return None
+        self.state = np.zeros(self.dimension)
+        self.state[:3] = position
+        self.state[6] = clock_bias if clocks is None else clock_bias[0]
+        variances = [PR_SIGMA ** 2] * 3 + [30.0 ** 2] * 3 + [PR_SIGMA ** 2, 100.0 ** 2]
+        if clocks is not None:
+            self.state[8:] = np.where(present[1:], clock_bias[1:] - clock_bias[0], 0.0)
+            variances += list(np.where(present[1:], PR_SIGMA ** 2, self.isb_sigma ** 2))
+        self.covariance = np.diag(variances)
+        if self.history is not None:
+            # No transition marks the start of a new segment for the smoother
+            self.history.append((None, None, None, self.state.copy(), self.covariance.copy()))
+        return self.state.copy()
+
+    def predict(self, dt):
+        transition = np.eye(self.dimension)
+        transition[:3, 3:6] = dt * np.eye(3)
+        transition[6, 7] = dt
+        noise = np.zeros((self.dimension, self.dimension))
+        axis = self.accel_psd * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        for i in range(3):
+            noise[np.ix_([i, i + 3], [i, i + 3])] = axis
+        noise[6:8, 6:8] = self.drift_psd * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        noise[6, 6] += self.bias_psd * dt
+        noise[np.arange(8, self.dimension), np.arange(8, self.dimension)] = self.isb_psd * dt
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+        return transition
+
+    def update(self, h, innovation, variance):
+        # Scalar measurement update, returns whether the measurement passed the innovation gate
+        ph = self.covariance @ h
+        innovation_variance = h @ ph + variance
+        if innovation ** 2 > self.gate ** 2 * innovation_variance:
+            return False
+        gain = ph / innovation_variance
+        self.state += gain * innovation
+        self.covariance -= np.outer(gain, ph)
+        return True
+
+    def smooth(self):
+        # Rauch-Tung-Striebel backward pass over the kept history, returns smoothed states (n_epochs, dimension)
+        states = np.array([entry[3] for entry in self.history])
+        smoothed, smoothed_covariance = states[-1], self.history[-1][4]
+        for k in range(len(self.history) - 2, -1, -1):
+            transition, predicted_state, predicted_covariance = self.history[k + 1][:3]
+            state, covariance = self.history[k][3:]
+            if transition is None:
+                smoothed, smoothed_covariance = state, covariance
+                continue
+            gain = np.linalg.solve(predicted_covariance, transition @ covariance).T
+            smoothed = state + gain @ (smoothed - predicted_state)
+            smoothed_covariance = covariance + gain @ (smoothed_covariance - predicted_covariance) @ gain.T
+            states[k] = smoothed
+        return states
+
+
+def calculate_locations_kalman(measurements, smooth=False):
+    # Run the navigation filter over a whole log, optionally followed by the RTS smoother
+    measurements = usable_measurements(measurements)
+    layout = epoch_layout(measurements)
+    times, epoch_idx, sat_idx = layout
+    _, sat_pos, measured_pr, mask = pack_epochs(measurements, layout)
+    seconds = (pd.to_datetime(pd.Index(times), utc=True) - pd.Timestamp(0, tz='UTC')).total_seconds().to_numpy()
+    sat_vel, rates = pack_rates(measurements, layout)
+    clocks = pack_clocks(measurements, layout)
+    systems = None
+    if clocks is not None:
+        # The system with the most measurements is the filter's reference clock
+        order = np.argsort(-clocks[mask].sum(axis=0), kind='stable')
+        clocks = clocks[:, :, order]
+        systems = np.sort(measurements['SatPRN (ID)'].str[0].unique())[order]
+
+    navigation = NavigationFilter(keep_history=smooth, systems=systems)
+    solved = []
+    states = []
+    for i in range(len(times)):
+        valid = mask[i]
+        state = navigation.update_epoch(seconds[i], sat_pos[i, valid], measured_pr[i, valid], sat_vel[i, valid],
+                                        rates[i, valid], None if clocks is None else clocks[i, valid])
+        if state is not None:
+            solved.append(i)
+            states.append(state)
+    states = navigation.smooth() if smooth and solved else np.array(states).reshape(-1, navigation.dimension)
+
+    lat, lon, alt = convert_to_geodetic(states[:, 0], states[:, 1], states[:, 2])
     result_coords = {}
-    for time, group in measurements.groupby('GPS time'):
+    for k, i in enumerate(solved):
+        result_coords[times[i]] = (states[k, 0], states[k, 1], states[k, 2], lat[k], lon[k], alt[k])
+    return result_coords
+
+
+def calculate_locations_real_time(measurements, batch=True, workers=None, sequential=False, kalman=False,
+                                  smooth=False):
+    if kalman:
+        return calculate_locations_kalman(measurements, smooth)
+    if sequential:
+        result_coords, iterations = calculate_locations_sequential(measurements)
+        if iterations:
+            print(f"Average Gauss-Newton iterations per epoch: {np.mean(list(iterations.values())):.2f}")
+        return result_coords
+    if batch:
+        return calculate_locations_batch(measurements, workers)
+
+    measurements = usable_measurements(measurements)
+    clocks = row_clocks(measurements)
+
+    times, positions = [], []
+    grouped = measurements.groupby('GPS time')
+    for time, group in grouped:
         sat_pos = group[['Sat.X', 'Sat.Y', 'Sat.Z']].values
         measured_pr = group['Pseudo-Range'].values
         initial_pos = np.array([group['Sat.X'].mean(), group['Sat.Y'].mean(), group['Sat.Z'].mean()])
         initial_bias = 0
+        epoch_clocks = None if clocks is None else clocks[grouped.indices[time]]
+        # Like the sequential solver, skip underdetermined epochs and those that don't converge
+        mask = np.ones((1, len(group)), dtype=bool)
+        if len(group) < state_count(mask, None if epoch_clocks is None else epoch_clocks[None])[0]:
+            continue
+
+        position, _, _, converged = trilateration_state(sat_pos, measured_pr, initial_pos, initial_bias,
+                                                        clocks=epoch_clocks)
+        if not converged:
+            continue
+        times.append(time)
+        positions.append(position)
 
-        coords = trilateration(sat_pos, measured_pr, initial_pos, initial_bias)
-        result_coords[time] = coords
+    # One geodetic conversion pass over all epochs
+    positions = np.array(positions).reshape(-1, 3)
+    lat, lon, alt = convert_to_geodetic(positions[:, 0], positions[:, 1], positions[:, 2])
+    result_coords = {}
+    for i, time in enumerate(times):
+        result_coords[time] = (positions[i, 0], positions[i, 1], positions[i, 2], lat[i], lon[i], alt[i])
 
     return result_coords
 
 
-def export_to_kml(coordinates, output_filepath):
+def locations_to_frame(coordinates, velocities=None):
+    # One row per epoch of a calculate_locations result, plus velocity columns when given
+    frame = pd.DataFrame(np.array(list(coordinates.values()), dtype=float).reshape(-1, 6), columns=LOCATION_COLUMNS)
+    frame.insert(0, 'GPS time', list(coordinates))
+    if velocities is not None:
+        frame[VELOCITY_COLUMNS] = np.array([velocities.get(time, (np.nan,) * 3) for time in coordinates],
+                                           dtype=float).reshape(-1, 3)
+    return frame
+
+
+def save_locations(coordinates, output_filepath, velocities=None):
+    # The format follows the extension: .csv, .parquet, .feather or .h5
+    write_frame(locations_to_frame(coordinates, velocities), output_filepath)
+
+
+def load_locations(input_filepath):
+    # Inverse of save_locations, returns (coordinates, velocities or None)
+    frame = read_frame(input_filepath)
+    times = frame['GPS time'].tolist()
+    coordinates = dict(zip(times, map(tuple, frame[LOCATION_COLUMNS].to_numpy())))
+    velocities = None
+    if set(VELOCITY_COLUMNS).issubset(frame.columns):
+        velocities = {time: tuple(v) for time, v in zip(times, frame[VELOCITY_COLUMNS].to_numpy())
+                      if np.isfinite(v).all()}
+    return coordinates, velocities
+
+
+def export_to_kml(coordinates, output_filepath, velocities=None):
+    # velocities is an optional calculate_velocities result, shown in each point's description
     kml = simplekml.Kml()
     for time, (x, y, z, lat, lon, alt) in coordinates.items():
-        pnt = kml.newpoint(name=str(time), coords=[(lon, lat, alt)])
-        pnt.timestamp.when = time
+        when = time.isoformat() if isinstance(time, pd.Timestamp) else time
+        pnt = kml.newpoint(name=str(when), coords=[(lon, lat, alt)])
+        pnt.timestamp.when = when
+        if velocities and time in velocities:
+            vx, vy, vz = velocities[time]
+            pnt.description = f"Speed: {np.sqrt(vx ** 2 + vy ** 2 + vz ** 2):.2f} m/s, " \
+                              f"ECEF velocity: ({vx:.2f}, {vy:.2f}, {vz:.2f}) m/s"
     kml.save(output_filepath)
     print(f"KML file saved to: {output_filepath}")
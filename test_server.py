@@ -1,6 +1,8 @@
 import socket
 import json
 
+from gnssutils.json_stream import JsonStreamDecoder, FramingError
+
 # Define constants and configurations
 HOST = '192.168.1.106'  # Your server's IP address
 PORT = 5001
@@ -55,44 +57,36 @@ def start_server():
         connection, address = server_socket.accept()
         print(f"Connection established with {address}")
 
-        buffer = ''
+        decoder = JsonStreamDecoder()
         while True:
             try:
                 data = connection.recv(4096)
                 if not data:
                     break
 
-                data = data.decode('utf-8')
-                print(f"Received data: {data}")
-                buffer += data
-
-                # Attempt to process complete JSON objects from the buffer
-                while True:
-                    try:
-                        gnss_data, index = json.JSONDecoder().raw_decode(buffer)
-                        buffer = buffer[index:].strip()
+                print(f"Received data: {data.decode('utf-8', errors='replace')}")
 
-                        if isinstance(gnss_data, dict):
-                            gnss_data = [gnss_data]
+                # Process every complete JSON message, the decoder keeps the incomplete tail
+                for gnss_data in decoder.feed(data):
+                    if isinstance(gnss_data, dict):
+                        gnss_data = [gnss_data]
 
-                        print(f"Parsed GNSS data: {gnss_data}")
+                    print(f"Parsed GNSS data: {gnss_data}")
 
-                        # Focus on the first valid data point for simplicity
-                        for location in gnss_data:
-                            print(f"Processing location data: {location}")
-                            latitude = location.get('latitude', None)
-                            longitude = location.get('longitude', None)
-                            print(f"Extracted coordinates: Latitude={latitude}, Longitude={longitude}")
+                    # Focus on the first valid data point for simplicity
+                    for location in gnss_data:
+                        print(f"Processing location data: {location}")
+                        latitude = location.get('latitude', None)
+                        longitude = location.get('longitude', None)
+                        print(f"Extracted coordinates: Latitude={latitude}, Longitude={longitude}")
 
-                            if latitude is not None and longitude is not None and latitude != 0.0 and longitude != 0.0:
-                                generate_or_update_html(latitude, longitude, location)
-                                break  # Only process the first valid location for now
-                        break  # Stop after processing the first set of data for now
-
-                    except json.JSONDecodeError:
-                        # If JSONDecodeError occurs, break the loop and wait for more data
-                        break
+                        if latitude is not None and longitude is not None and latitude != 0.0 and longitude != 0.0:
+                            generate_or_update_html(latitude, longitude, location)
+                            break  # Only process the first valid location for now
 
+            except FramingError as e:
+                print(f"Bad message framing: {e}")
+                break
             except Exception as e:
                 print(f"Error receiving data: {e}")
                 break
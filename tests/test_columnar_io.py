@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gnssutils.columnar_io import FrameWriter, read_frame, write_frame
+
+
+def sample_frame(n_rows=30):
+    rng = np.random.default_rng(0)
+    times = pd.Timestamp('2024-04-13', tz='UTC') + pd.to_timedelta(np.arange(n_rows) // 3, unit='s')
+    return pd.DataFrame({
+        'GPS time': [time.isoformat() for time in times],
+        'SatPRN (ID)': ['G%02d' % (i % 3 + 1) for i in range(n_rows)],
+        'Sat.X': rng.normal(size=n_rows),
+        'CN0': rng.uniform(20, 50, n_rows),
+    })
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather', '.h5'])
+def test_chunked_writes_match_write_frame(tmp_path, extension):
+    if extension != '.csv':
+        pytest.importorskip('tables' if extension == '.h5' else 'pyarrow')
+    frame = sample_frame()
+    with FrameWriter(str(tmp_path / ('chunked' + extension))) as writer:
+        for start in range(0, len(frame), 7):
+            writer.write(frame.iloc[start:start + 7])
+    assert writer.rows == len(frame)
+    write_frame(frame, str(tmp_path / ('whole' + extension)))
+    pd.testing.assert_frame_equal(read_frame(str(tmp_path / ('chunked' + extension))),
+                                  read_frame(str(tmp_path / ('whole' + extension))))
+
+
+def test_nothing_written(tmp_path):
+    filepath = str(tmp_path / 'empty.csv')
+    with FrameWriter(filepath) as writer:
+        writer.write(pd.DataFrame())
+    assert writer.rows == 0
+    with open(filepath) as f:
+        assert f.read().strip() == ''
@@ -0,0 +1,111 @@
+import ftplib
+import gzip
+import os
+import socket
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gnssutils.ephemeris_manager import EphemerisManager, PARAMETER_FIELDS
+
+
+def test_parameters_without_records(tmp_path):
+    # A failed download leaves empty days in the cache, every satellite then gets a NaN row
+    manager = EphemerisManager(str(tmp_path))
+    for day in (date(2024, 4, 12), date(2024, 4, 13)):
+        manager.days[day] = pd.DataFrame()
+    parameters = manager.get_parameters(datetime(2024, 4, 13, 12, tzinfo=timezone.utc), ['G01', 'G02'])
+    assert parameters.shape == (2, len(PARAMETER_FIELDS))
+    assert np.isnan(parameters).all()
+
+
+class FakeFTP():
+    # Stands in for ftplib.FTP: serves files from a dict, optionally dropping a transfer after
+    # drop_after bytes once per file or failing a path on every attempt
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        path = cmd[len('RETR '):]
+        self.server['requests'].append((path, rest))
+        if path in self.server['failing']:
+            raise socket.timeout('timed out')
+        if rest and self.server.get('refuse_rest'):
+            raise ftplib.error_perm('502 REST not implemented')
+        content = self.server['files'][path]
+        drop_after = self.server['drop_after'].pop(path, None)
+        for start in range(rest or 0, len(content), blocksize):
+            if drop_after is not None and start >= drop_after:
+                raise EOFError('connection dropped')
+            callback(content[start:start + blocksize])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def fake_manager(tmp_path, server):
+    manager = EphemerisManager(str(tmp_path))
+    server.setdefault('requests', [])
+    server.setdefault('failing', set())
+    server.setdefault('drop_after', {})
+    server['connections'] = []
+
+    def connect(url, secure):
+        ftp = FakeFTP(server)
+        server['connections'].append(ftp)
+        return ftp
+    manager.connect = connect
+    return manager
+
+
+def nav_text(seed=0):
+    rng = np.random.default_rng(seed)
+    return ''.join('%19.12E\n' % value for value in rng.normal(size=20000)).encode()
+
+
+@pytest.mark.parametrize('refuse_rest', [False, True])
+def test_resume_after_partial_transfer(tmp_path, refuse_rest):
+    text = nav_text()
+    compressed = gzip.compress(text)
+    blocksize = EphemerisManager.DOWNLOAD_BLOCKSIZE
+    dropped_at = len(compressed) // 2 // blocksize * blocksize
+    assert dropped_at > 0
+    server = {'files': {'brdc/brdc1040.24n.gz': compressed}, 'drop_after': {'brdc/brdc1040.24n.gz': dropped_at},
+              'refuse_rest': refuse_rest}
+    manager = fake_manager(tmp_path, server)
+    dest_filepath = str(tmp_path / 'nasa' / 'brdc1040.24n.gz')
+    manager.retrieve_file('example.org', 'brdc', 'brdc1040.24n.gz', dest_filepath)
+
+    # The second attempt continues from the bytes already received, or starts over when REST is refused
+    offsets = [rest for _, rest in server['requests']]
+    assert offsets[:2] == [None, dropped_at]
+    if refuse_rest:
+        assert offsets[2:] == [None]
+    # gzip is decoded while it arrives, only the decompressed file is left
+    with open(dest_filepath[:-3], 'rb') as f:
+        assert f.read() == text
+    assert os.listdir(tmp_path / 'nasa') == ['brdc1040.24n']
+
+
+def test_prefetch_survives_a_failing_file(tmp_path):
+    day = date(2024, 4, 13)
+    probe = EphemerisManager(str(tmp_path))
+    locations = [probe.file_location(fileinfo) for fileinfo in
+                 EphemerisManager.select_files(datetime(day.year, day.month, day.day, tzinfo=timezone.utc))]
+    paths = [directory + '/' + filename for _, directory, filename, _ in locations]
+    server = {'files': {path: gzip.compress(nav_text(i)) for i, path in enumerate(paths)}, 'failing': {paths[0]}}
+    manager = fake_manager(tmp_path, server)
+
+    results = manager.prefetch((day, day), workers=2)
+    assert results == {dest_filepath: dest_filepath != locations[0][3] for *_, dest_filepath in locations}
+    for *_, dest_filepath in locations[1:]:
+        assert os.path.isfile(os.path.splitext(dest_filepath)[0])
+    # Every pooled connection is closed when prefetch returns
+    assert manager.idle_connections == {}
+    assert all(ftp.closed for ftp in server['connections'])
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from gnssutils.json_stream import FramingError, JsonStreamDecoder
+
+MESSAGES = [
+    {'latitude': 32.1, 'longitude': 34.8, 'satellites': [{'svid': 5, 'cn0': 41.5}]},
+    [{'note': 'braces } ] { [ and an escaped \\" quote'}],
+    {'empty': {}, 'text': 'line\nbreak'},
+]
+
+
+def feed_all(decoder, chunks):
+    messages = []
+    for chunk in chunks:
+        messages.extend(decoder.feed(chunk))
+    return messages
+
+
+def length_prefixed(message):
+    payload = json.dumps(message).encode()
+    return len(payload).to_bytes(4, 'big') + payload
+
+
+@pytest.mark.parametrize('encode', [
+    lambda messages: b''.join(json.dumps(message).encode() + b'\n' for message in messages),
+    lambda messages: b''.join(json.dumps(message).encode() for message in messages),
+    lambda messages: b' \r\n'.join(json.dumps(message, indent=2).encode() for message in messages),
+    lambda messages: b''.join(length_prefixed(message) for message in messages),
+], ids=['newline-delimited', 'concatenated', 'pretty-printed', 'length-prefixed'])
+def test_framings(encode):
+    stream = encode(MESSAGES)
+    # Several messages in one read
+    assert JsonStreamDecoder().feed(stream) == MESSAGES
+    # Every message split across reads, down to single bytes
+    for size in (1, 2, 7, 64):
+        decoder = JsonStreamDecoder()
+        chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+        assert feed_all(decoder, chunks) == MESSAGES
+        assert decoder.buffer == bytearray()
+
+
+def test_partial_message_is_kept():
+    decoder = JsonStreamDecoder()
+    stream = json.dumps(MESSAGES[0]).encode()
+    assert decoder.feed(stream[:-1]) == []
+    assert decoder.feed(stream[-1:] + b'{"next"') == [MESSAGES[0]]
+    assert decoder.feed(b': 1}') == [{'next': 1}]
+
+
+def test_invalid_message_is_skipped():
+    decoder = JsonStreamDecoder()
+    assert decoder.feed(b'{"a": nope}{"b": 2}') == [{'b': 2}]
+    assert decoder.invalid_messages == 1
+
+
+def test_oversized_buffer():
+    decoder = JsonStreamDecoder(max_buffer_size=64)
+    with pytest.raises(FramingError):
+        decoder.feed(b'{"data": "' + b'x' * 100)
+    # The decoder starts over with an empty buffer
+    assert decoder.buffer == bytearray()
+    assert decoder.feed(b'{"ok": true}') == [{'ok': True}]
+
+
+def test_garbage_at_message_start():
+    with pytest.raises(FramingError):
+        JsonStreamDecoder().feed(b'hello {"a": 1}')
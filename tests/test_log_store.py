@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gnssutils.log_store import LogStore, ingest_log, open_store
+
+FIX_COLUMNS = ['Provider', 'LatitudeDegrees', 'LongitudeDegrees', 'AccuracyMeters', 'UnixTimeMillis', 'Note']
+START_MILLIS = 1713002400000  # 2024-04-13T10:00:00Z
+
+
+def write_log(path, fix_rows, note=lambda i: ''):
+    rng = np.random.default_rng(0)
+    lines = ['# Header comment\n', '# Fix,' + ','.join(FIX_COLUMNS) + '\n',
+             '# Status,UnixTimeMillis,Svid,Cn0DbHz\n']
+    for i in range(fix_rows):
+        lines.append(f"Fix,{'gps' if i % 2 else 'fused'},{rng.uniform(-90, 90)!r},{rng.uniform(-180, 180)!r},"
+                     f"{rng.uniform(1, 20)!r},{START_MILLIS + 1000 * i},{note(i)}\n")
+        lines.append(f"Status,{START_MILLIS + 1000 * i},{i % 32 + 1},{rng.uniform(20, 50)!r}\n")
+    path.write_text(''.join(lines))
+    return path
+
+
+def expected_fix(path):
+    lines = [line[len('Fix,'):] for line in path.read_text().splitlines(keepends=True) if line.startswith('Fix,')]
+    return pd.read_csv(pd.io.common.StringIO(''.join(lines)), header=None, names=FIX_COLUMNS)
+
+
+def test_round_trip(tmp_path):
+    log = write_log(tmp_path / 'log.txt', 50)
+    store = ingest_log(str(log), str(tmp_path / 'log.store'), chunk_rows=8)
+    assert store.rows('Fix') == 50 and store.rows('Status') == 50
+    expected = expected_fix(log)
+    frame = store.read('Fix')
+    for col in FIX_COLUMNS[:-1]:
+        np.testing.assert_array_equal(frame[col].to_numpy(), expected[col].to_numpy())
+    assert frame['Note'].isna().all()
+    assert store.tables['Fix']['dtypes']['UnixTimeMillis'] == 'int64'
+
+    reopened = open_store(str(log), str(tmp_path / 'log.store'))
+    pd.testing.assert_frame_equal(reopened.read('Fix', 10, 20), frame.iloc[10:20].reset_index(drop=True))
+
+
+def test_time_range(tmp_path):
+    log = write_log(tmp_path / 'log.txt', 50)
+    store = ingest_log(str(log), str(tmp_path / 'log.store'), chunk_rows=8)
+    start = pd.Timestamp(START_MILLIS + 12000, unit='ms', tz='UTC')
+    stop = '2024-04-13T10:00:30Z'
+    assert store.time_slice('Fix', start, stop) == (12, 30)
+    frame = store.read_time_range('Status', start, stop)
+    np.testing.assert_array_equal(frame['UnixTimeMillis'], START_MILLIS + 1000 * np.arange(12, 30))
+    assert store.time_slice('Fix', stop) == (30, 50)
+    assert store.time_slice('Fix', None, start) == (0, 12)
+
+
+def test_unsorted_time_range(tmp_path):
+    log = write_log(tmp_path / 'log.txt', 20)
+    lines = log.read_text().splitlines(keepends=True)
+    header, body = lines[:3], lines[3:]
+    log.write_text(''.join(header + body[20:] + body[:20]))  # second half of the log first
+    store = LogStore(ingest_log(str(log), str(tmp_path / 'log.store'), chunk_rows=8).directory)
+    assert not store.tables['Fix']['time_sorted']
+    frame = store.read_time_range('Fix', START_MILLIS * 10 ** 6 + 5 * 10 ** 9, START_MILLIS * 10 ** 6 + 15 * 10 ** 9)
+    assert sorted(frame['UnixTimeMillis']) == list(START_MILLIS + 1000 * np.arange(5, 15))
+
+
+@pytest.mark.parametrize('note, dtype, expected', [
+    (lambda i: str(i), 'int64', lambda i: i if i >= 12 else 0),
+    (lambda i: f'{i}.5', 'float64', lambda i: i + 0.5 if i >= 12 else np.nan),
+    (lambda i: f'n{i}', 'str', lambda i: f'n{i}' if i >= 12 else np.nan),
+])
+def test_column_empty_in_first_chunk_is_typed_later(tmp_path, note, dtype, expected):
+    log = write_log(tmp_path / 'log.txt', 20, lambda i: note(i) if i >= 12 else '')
+    store = ingest_log(str(log), str(tmp_path / 'log.store'), chunk_rows=8)
+    assert store.tables['Fix']['dtypes']['Note'] == dtype
+    values = np.asarray(store.column('Fix', 'Note'))
+    pd.testing.assert_series_equal(pd.Series(values), pd.Series([expected(i) for i in range(20)],
+                                                                dtype=None if dtype == 'str' else dtype))
+
+
+def test_numeric_column_widens_to_strings(tmp_path):
+    log = write_log(tmp_path / 'log.txt', 20, lambda i: str(i) if i != 17 else 'late')
+    store = ingest_log(str(log), str(tmp_path / 'log.store'), chunk_rows=8)
+    assert store.tables['Fix']['dtypes']['Note'] == 'str'
+    assert list(store.column('Fix', 'Note')) == [str(i) if i != 17 else 'late' for i in range(20)]
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+import benchmark
+from gnssutils import rinex_nav
+from gnssutils.ephemeris_manager import EphemerisManager
+
+N_SATS = 4
+N_RECORDS = 13
+
+
+def write_nav(filepath, version):
+    records = benchmark.broadcast_records(benchmark.synthetic_ephemeris(N_SATS), '2024-04-13', N_RECORDS)
+    benchmark.write_rinex_nav(records, filepath, version)
+    with open(filepath) as f:
+        return f.read().splitlines(True)
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_complete_file(tmp_path, version):
+    filepath = str(tmp_path / 'brdc.nav')
+    write_nav(filepath, version)
+    data, leap_seconds = EphemerisManager.parse_rinex(filepath)
+    assert len(data) == N_SATS * N_RECORDS
+    assert leap_seconds == 18
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_truncated_between_lines(tmp_path, version):
+    # The native reader drops a last record with missing lines
+    filepath = str(tmp_path / 'brdc.nav')
+    lines = write_nav(filepath, version)
+    with open(filepath, 'w') as f:
+        f.writelines(lines[:-3])
+    data, _ = rinex_nav.read_nav(filepath)
+    assert len(data) == N_SATS * N_RECORDS - 1
+    assert data[['sqrtA', 'Eccentricity', 'M0']].notna().all().all()
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_truncated_inside_number(tmp_path, version):
+    # A download cut off in the middle of a number trips the native reader, parse_rinex falls back
+    # to georinex instead of failing the day
+    pytest.importorskip('georinex')
+    filepath = str(tmp_path / 'brdc.nav')
+    lines = write_nav(filepath, version)
+    indent = 4 if version >= 3 else 3
+    with open(filepath, 'w') as f:
+        f.writelines(lines[:-1] + [lines[-1][:indent + 17]])
+    with pytest.raises(ValueError):
+        rinex_nav.read_nav(filepath)
+    data, leap_seconds = EphemerisManager.parse_rinex(filepath)
+    assert len(data) >= N_SATS * N_RECORDS - 1
+    assert leap_seconds == 18
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_matches_georinex(tmp_path, version):
+    georinex = pytest.importorskip('georinex')
+    filepath = str(tmp_path / 'brdc.nav')
+    write_nav(filepath, version)
+    data, header = rinex_nav.read_nav(filepath)
+    # georinex's frame also has the spare fields and all-NaN rows of satellites missing at an epoch
+    reference = georinex.load(filepath).to_dataframe().dropna(how='all').reset_index()
+    reference = reference.sort_values(['time', 'sv'], ignore_index=True)
+    assert set(data.columns) <= set(reference.columns)
+    pd.testing.assert_frame_equal(data, reference[data.columns], check_exact=True)
+    assert header['leap_seconds'] == 18
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import benchmark
+import solution
+
+
+def degenerate_input(n_epochs=10, bad_epoch=3):
+    # Synthetic epochs where every satellite of bad_epoch sits at the same position
+    measurements, receiver = benchmark.synthetic_solution_input(n_epochs)
+    bad_time = measurements['GPS time'].unique()[bad_epoch]
+    rows = measurements['GPS time'] == bad_time
+    columns = ['Sat.X', 'Sat.Y', 'Sat.Z']
+    measurements.loc[rows, columns] = measurements.loc[rows, columns].iloc[0].to_numpy()
+    return measurements, receiver, bad_time
+
+
+@pytest.mark.parametrize('options', [{}, {'batch': False}, {'sequential': True}, {'kalman': True}])
+def test_singular_epoch_is_skipped(options):
+    measurements, receiver, bad_time = degenerate_input()
+    coordinates = solution.calculate_locations_real_time(measurements, **options)
+    assert bad_time not in coordinates
+    assert len(coordinates) >= 8
+    positions = np.array([coordinates[time][:3] for time in coordinates])
+    assert np.linalg.norm(positions - receiver, axis=1).max() < 100.0
+
+
+def test_batch_marks_diverging_epochs():
+    # Pseudoranges no receiver can match make the Gauss-Newton steps blow up
+    measurements, receiver = benchmark.synthetic_solution_input(4)
+    layout = solution.epoch_layout(measurements)
+    times, sat_pos, measured_pr, mask = solution.pack_epochs(measurements, layout)
+    measured_pr[1] = np.random.default_rng(0).uniform(0.0, 1e9, measured_pr.shape[1])
+    initial_pos = sat_pos.mean(axis=1)
+    positions, _, converged, iterations = solution.trilateration_batch(sat_pos, measured_pr, mask, initial_pos, 0.0)
+    # Dropped at the first oversized step instead of iterating on
+    assert not converged[1] and np.isnan(positions[1]).all() and iterations[1] <= 1
+    assert converged[[0, 2, 3]].all()
+    assert np.linalg.norm(positions[[0, 2, 3]] - receiver, axis=1).max() < 100.0
+
+
+def test_leave_one_out_matches_resolving():
+    # Sherman-Morrison downdate against an explicit least-squares solve without each satellite, at a
+    # converged solution (residuals orthogonal to the geometry) of random well-conditioned epochs
+    rng = np.random.default_rng(1)
+    n_epochs, max_sats = 6, 9
+    directions = rng.normal(size=(n_epochs, max_sats, 3))
+    directions /= np.linalg.norm(directions, axis=2, keepdims=True)
+    G = np.concatenate([directions, np.ones((n_epochs, max_sats, 1))], axis=2)
+    mask = np.ones((n_epochs, max_sats), dtype=bool)
+    mask[::2, 7:] = False  # padded slots
+    G[~mask] = 0.0
+    residuals = np.where(mask, rng.normal(scale=5.0, size=(n_epochs, max_sats)), 0.0)
+    for e in range(n_epochs):
+        residuals[e] -= G[e] @ np.linalg.lstsq(G[e], residuals[e], rcond=None)[0]
+    assert max(np.linalg.cond(G[e, mask[e]]) for e in range(n_epochs)) < 100
+
+    sse_without, corrections = solution.leave_one_out(G, residuals)
+    for e in range(n_epochs):
+        for k in np.flatnonzero(mask[e]):
+            keep = mask[e] & (np.arange(max_sats) != k)
+            correction = np.linalg.lstsq(G[e, keep], residuals[e, keep], rcond=None)[0]
+            sse = ((residuals[e, keep] - G[e, keep] @ correction) ** 2).sum()
+            np.testing.assert_allclose(corrections[e, k], correction, rtol=1e-9, atol=1e-9)
+            np.testing.assert_allclose(sse_without[e, k], sse, rtol=1e-9, atol=1e-9)
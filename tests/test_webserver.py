@@ -0,0 +1,103 @@
+import asyncio
+import json
+from collections import deque
+
+import numpy as np
+
+import webserver
+
+
+def reference_detect_spoofing(gnss_data_window):
+    # detect_spoofing as it was before SpoofingDetector, recomputed from the whole window
+    all_satellites = [sat for data in gnss_data_window for sat in data['satellites']]
+    cn0_values = [sat['cn0'] for sat in all_satellites if 'cn0' in sat]
+    doppler_values = [sat['doppler'] for sat in all_satellites if 'doppler' in sat]
+    if not cn0_values or not doppler_values:
+        return False
+    average_cn0 = sum(cn0_values) / len(cn0_values)
+    max_doppler_change = max(doppler_values) - min(doppler_values)
+    distance_change = webserver.haversine(gnss_data_window[0]['latitude'], gnss_data_window[0]['longitude'],
+                                          gnss_data_window[-1]['latitude'], gnss_data_window[-1]['longitude'])
+    return average_cn0 < 30.0 or max_doppler_change > 1000 or distance_change > 100.0
+
+
+def random_messages(rng, n_messages):
+    # Quarter dB-Hz CN0 values keep the sums exact, so ties with the threshold are compared exactly too
+    latitude, longitude = 32.1, 34.8
+    messages = []
+    for _ in range(n_messages):
+        latitude += rng.normal(scale=2e-4)
+        longitude += rng.normal(scale=2e-4)
+        satellites = []
+        for _ in range(rng.integers(0, 5)):
+            sat = {}
+            if rng.random() < 0.8:
+                sat['cn0'] = float(np.round(rng.normal(31.0, 3.0) * 4) / 4)
+            if rng.random() < 0.8:
+                sat['doppler'] = float(rng.normal(0.0, 300.0))
+            satellites.append(sat)
+        messages.append({'latitude': latitude, 'longitude': longitude, 'satellites': satellites})
+    return messages
+
+
+def test_incremental_detector_matches_window_recomputation():
+    rng = np.random.default_rng(0)
+    verdicts = []
+    for _ in range(20):
+        detector = webserver.SpoofingDetector()
+        window = deque(maxlen=webserver.WINDOW_SIZE)
+        for message in random_messages(rng, 200):
+            detector.push(message)
+            window.append(message)
+            assert len(detector) == len(window)
+            if len(window) == webserver.WINDOW_SIZE:
+                expected = reference_detect_spoofing(list(window))
+                assert detector.is_spoofed() == expected
+                assert webserver.detect_spoofing(list(window)) == expected
+                verdicts.append(expected)
+    # Both verdicts occur, so the comparison means something
+    assert any(verdicts) and not all(verdicts)
+
+
+def test_reconnect_from_same_address_takes_over_device():
+    async def wait_for(condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('timed out')
+
+    async def scenario():
+        queue = asyncio.Queue()
+        consumer = asyncio.create_task(webserver.process_messages(queue))
+        server = await asyncio.start_server(lambda reader, writer: webserver.handle_connection(reader, writer, queue),
+                                            '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        message = json.dumps({'latitude': 32.1, 'longitude': 34.8, 'satellites': []}).encode()
+        try:
+            first_reader, first_writer = await asyncio.open_connection('127.0.0.1', port)
+            first_writer.write(message)
+            await wait_for(lambda: '127.0.0.1' in webserver.latest_positions)
+
+            # Same address from a new port: the old connection is closed, the device state survives it
+            second_reader, second_writer = await asyncio.open_connection('127.0.0.1', port)
+            assert await asyncio.wait_for(first_reader.read(), 2) == b''
+            first_writer.close()
+            await wait_for(lambda: isinstance(webserver.device_connections.get('127.0.0.1'), asyncio.StreamWriter)
+                           and webserver.device_connections['127.0.0.1'].get_extra_info('peername')
+                           == second_writer.get_extra_info('sockname'))
+            await asyncio.sleep(0.05)
+            assert '127.0.0.1' in webserver.latest_positions and '127.0.0.1' in webserver.device_detectors
+
+            second_writer.write(message)
+            await wait_for(lambda: len(webserver.device_detectors['127.0.0.1']) == 2)
+
+            # The device's own last connection closing cleans its state up
+            second_writer.close()
+            await wait_for(lambda: '127.0.0.1' not in webserver.device_connections)
+            assert '127.0.0.1' not in webserver.latest_positions and '127.0.0.1' not in webserver.device_detectors
+        finally:
+            server.close()
+            consumer.cancel()
+
+    asyncio.run(scenario())
@@ -1,20 +1,37 @@
-import socket
+import asyncio
 import json
+from math import radians, sin, cos, sqrt, atan2
 from collections import deque
 from datetime import datetime
 
+from gnssutils.json_stream import JsonStreamDecoder, FramingError
+
 # Define constants and configurations
 HOST = '10.0.0.2'  # Your server's IP address
 PORT = 5001
-HTML_FILE = 'gnss_location.html'  # Use a constant file name for updating
+HTML_FILE = 'gnss_location.html'  # Static map page, written once at startup
+MAP_PORT = 8080  # Serves the map page and the latest positions
+MAP_UPDATE_INTERVAL = 1.0  # Seconds between position updates published to the map
+
+# Latest position per device and its serialized GeoJSON for the map endpoint
+latest_positions = {}
+positions_dirty = False
+positions_payload = b'{"type": "FeatureCollection", "features": []}'
 
-# GNSS data sliding window size
+# GNSS data sliding window size, one spoofing detector per connected device
 WINDOW_SIZE = 5
-gnss_data_window = deque(maxlen=WINDOW_SIZE)
+device_detectors = {}
+
+# Open connection (its StreamWriter) of each device, queued messages carry it so those of a closed connection
+# are dropped. A device is its IP address, a phone reconnecting from a new port takes over its own state.
+device_connections = {}
+
+# Parsed messages waiting to be processed before readers stop pulling from their sockets
+MAX_PENDING_MESSAGES = 1000
 
-# Function to generate or update HTML using OpenStreetMap and Leaflet.js
-def generate_or_update_html(latitude, longitude, location_data):
-    print(f"Updating HTML for coordinates: Latitude={latitude}, Longitude={longitude}")
+# Function to write the static map page once, it polls the map endpoint for the latest positions
+def write_static_html():
+    positions_url = f"http://{HOST}:{MAP_PORT}/positions.geojson"
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -28,58 +45,172 @@ def generate_or_update_html(latitude, longitude, location_data):
                 width: 100%;
             }}
         </style>
-        <meta http-equiv="refresh" content="5">
     </head>
     <body>
         <h1>GNSS Location</h1>
         <div id="map"></div>
         <script>
-            var map = L.map('map').setView([{latitude}, {longitude}], 15);
+            var map = L.map('map').setView([0, 0], 2);
             L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
                 maxZoom: 19,
                 attribution: '© OpenStreetMap contributors'
             }}).addTo(map);
-            var marker = L.marker([{latitude}, {longitude}]).addTo(map);
+            var markers = {{}};
+            var centered = false;
+            function refresh() {{
+                fetch('{positions_url}').then(function (response) {{ return response.json(); }}).then(function (data) {{
+                    data.features.forEach(function (feature) {{
+                        var device = feature.properties.device;
+                        var latlng = [feature.geometry.coordinates[1], feature.geometry.coordinates[0]];
+                        if (!(device in markers)) {{
+                            markers[device] = L.marker(latlng).addTo(map).bindPopup(device);
+                        }}
+                        markers[device].setLatLng(latlng);
+                        if (!centered) {{
+                            map.setView(latlng, 15);
+                            centered = true;
+                        }}
+                        document.getElementById('data').textContent = JSON.stringify(feature.properties.data, null, 4);
+                    }});
+                }}).catch(function () {{}});
+            }}
+            refresh();
+            setInterval(refresh, {int(MAP_UPDATE_INTERVAL * 1000)});
         </script>
         <h2>Received GNSS Data</h2>
-        <pre>{json.dumps(location_data, indent=4)}</pre>
+        <pre id="data"></pre>
     </body>
     </html>
     """
 
     with open(HTML_FILE, 'w') as file:
         file.write(html_content)
-    print(f"HTML file updated with the location data at {HTML_FILE}.")
-
-# Function to detect spoofing
-def detect_spoofing(gnss_data_window):
+    print(f"Map page written to {HTML_FILE}, positions served at {positions_url}")
+    return html_content.encode('utf-8')
+
+# Record a device's latest position, only touches memory so the receive path never waits on I/O
+def update_position(device, latitude, longitude, location_data):
+    global positions_dirty
+    latest_positions[device] = (latitude, longitude, location_data)
+    positions_dirty = True
+
+# Serialize the latest positions as GeoJSON at most once per MAP_UPDATE_INTERVAL
+async def publish_positions():
+    global positions_dirty, positions_payload
+    while True:
+        if positions_dirty:
+            positions_dirty = False
+            features = [{
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'properties': {'device': device, 'data': location_data},
+            } for device, (latitude, longitude, location_data) in latest_positions.items()]
+            # Swapping in a new bytes object is atomic for the map endpoint
+            positions_payload = json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+        await asyncio.sleep(MAP_UPDATE_INTERVAL)
+
+# Minimal HTTP endpoint for the map page and its GeoJSON positions
+async def handle_map_request(reader, writer, html_page):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # skip headers
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else '/'
+        if path.startswith('/positions'):
+            status, content_type, body = '200 OK', 'application/geo+json', positions_payload
+        elif path in ('/', '/' + HTML_FILE):
+            status, content_type, body = '200 OK', 'text/html; charset=utf-8', html_page
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain', b'Not found'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nCache-Control: no-store\r\nConnection: close\r\n\r\n"
+                     .encode('latin-1') + body)
+        await writer.drain()
+    except Exception as e:
+        print(f"Error serving map request: {e}")
+    finally:
+        writer.close()
+
+# Sliding-window spoofing detector with O(satellites in message) updates. CN0 is tracked with
+# running sums and Doppler min/max with monotonic deques, entries tagged by message sequence number.
+class SpoofingDetector():
     cn0_threshold = 30.0  # CN0 threshold for valid signals
     doppler_change_threshold = 1000  # Doppler change threshold
     max_distance_change = 100.0  # Maximum allowed change in distance in meters
 
-    # Aggregate data from the sliding window
-    all_satellites = [sat for data in gnss_data_window for sat in data['satellites']]
-    last_location = gnss_data_window[-1]
-    first_location = gnss_data_window[0]
-
-    # Track the average CN0 and sudden Doppler changes
-    cn0_values = [sat['cn0'] for sat in all_satellites if 'cn0' in sat]
-    doppler_values = [sat['doppler'] for sat in all_satellites if 'doppler' in sat]
-
-    if not cn0_values or not doppler_values:
-        return False  # Not enough data to detect spoofing
-
-    average_cn0 = sum(cn0_values) / len(cn0_values)
-    max_doppler_change = max(doppler_values) - min(doppler_values)
-
-    # Calculate distance change
-    distance_change = haversine(first_location['latitude'], first_location['longitude'],
-                                last_location['latitude'], last_location['longitude'])
-
-    if average_cn0 < cn0_threshold or max_doppler_change > doppler_change_threshold or distance_change > max_distance_change:
-        return True
-
-    return False
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self.window = deque()  # (sequence, latitude, longitude, cn0 sum, cn0 count, doppler count)
+        self.sequence = 0
+        self.cn0_sum = 0.0
+        self.cn0_count = 0
+        self.doppler_count = 0
+        self.doppler_min = deque()  # (sequence, doppler), increasing doppler
+        self.doppler_max = deque()  # (sequence, doppler), decreasing doppler
+
+    def __len__(self):
+        return len(self.window)
+
+    def push(self, location):
+        satellites = location['satellites']
+        cn0_values = [sat['cn0'] for sat in satellites if 'cn0' in sat]
+        cn0_sum = sum(cn0_values)
+        doppler_count = 0
+        for sat in satellites:
+            if 'doppler' not in sat:
+                continue
+            doppler = sat['doppler']
+            doppler_count += 1
+            while self.doppler_min and self.doppler_min[-1][1] >= doppler:
+                self.doppler_min.pop()
+            self.doppler_min.append((self.sequence, doppler))
+            while self.doppler_max and self.doppler_max[-1][1] <= doppler:
+                self.doppler_max.pop()
+            self.doppler_max.append((self.sequence, doppler))
+
+        self.window.append((self.sequence, location.get('latitude'), location.get('longitude'),
+                            cn0_sum, len(cn0_values), doppler_count))
+        self.cn0_sum += cn0_sum
+        self.cn0_count += len(cn0_values)
+        self.doppler_count += doppler_count
+        self.sequence += 1
+        if len(self.window) > self.window_size:
+            self.evict()
+
+    def evict(self):
+        sequence, _, _, cn0_sum, cn0_count, doppler_count = self.window.popleft()
+        self.cn0_sum -= cn0_sum
+        self.cn0_count -= cn0_count
+        self.doppler_count -= doppler_count
+        if self.cn0_count == 0:
+            self.cn0_sum = 0.0  # drop accumulated rounding error
+        while self.doppler_min and self.doppler_min[0][0] <= sequence:
+            self.doppler_min.popleft()
+        while self.doppler_max and self.doppler_max[0][0] <= sequence:
+            self.doppler_max.popleft()
+
+    def is_spoofed(self):
+        if not self.window or not self.cn0_count or not self.doppler_count:
+            return False  # Not enough data to detect spoofing
+
+        average_cn0 = self.cn0_sum / self.cn0_count
+        max_doppler_change = self.doppler_max[0][1] - self.doppler_min[0][1]
+
+        # Calculate distance change
+        _, first_latitude, first_longitude = self.window[0][:3]
+        _, last_latitude, last_longitude = self.window[-1][:3]
+        distance_change = haversine(first_latitude, first_longitude, last_latitude, last_longitude)
+
+        return average_cn0 < self.cn0_threshold or max_doppler_change > self.doppler_change_threshold or \
+            distance_change > self.max_distance_change
+
+# Function to detect spoofing over a whole window of messages
+def detect_spoofing(gnss_data_window):
+    detector = SpoofingDetector(len(gnss_data_window))
+    for location in gnss_data_window:
+        detector.push(location)
+    return detector.is_spoofed()
 
 # Function to filter satellites by constellation and signal strength
 def filter_satellites(data, constellation=None, cn0_threshold=None):
@@ -102,8 +233,6 @@ def process_gnss_data(data):
 
 # Calculate the Haversine distance between two points in meters
 def haversine(lat1, lon1, lat2, lon2):
-    from math import radians, sin, cos, sqrt, atan2
-
     R = 6371000  # Radius of the Earth in meters
     dlat = radians(lat2 - lat1)
     dlon = radians(lon2 - lon1)
@@ -111,75 +240,102 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
     return R * c
 
-# Start the server
-def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(1)
-    print(f"Server started and listening on {HOST}:{PORT}")
-
+# Handle one parsed JSON message from a device
+def handle_gnss_data(gnss_data, device):
+    if isinstance(gnss_data, dict):
+        gnss_data = [gnss_data]
+
+    # Process the data and update the device's sliding window
+    detector = device_detectors.get(device)
+    if detector is None:
+        detector = device_detectors[device] = SpoofingDetector()
+    processed_data = process_gnss_data(gnss_data)
+    for location in processed_data:
+        detector.push(location)
+
+    # Focus on the first valid data point for simplicity
+    for location in gnss_data:
+        latitude = location.get('latitude', None)
+        longitude = location.get('longitude', None)
+        if latitude is not None and longitude is not None and latitude != 0.0 and longitude != 0.0:
+            update_position(device, latitude, longitude, location)
+            break  # Only process the first valid location for now
+
+    # Check for spoofing
+    if len(detector) == WINDOW_SIZE and detector.is_spoofed():
+        print(f"Spoofing detected for {device}! Data might be unreliable.")
+
+
+# Single consumer for all connections, the bounded queue gives backpressure to the readers
+async def process_messages(queue):
     while True:
-        print("Waiting for connection...")
-        connection, address = server_socket.accept()
-        print(f"Connection established with {address}")
-
-        buffer = ''
+        gnss_data, device, connection = await queue.get()
+        try:
+            # Left over from a connection that is gone, its device state has already been cleaned up
+            if device_connections.get(device) is not connection:
+                continue
+            handle_gnss_data(gnss_data, device)
+        except Exception as e:
+            print(f"Error processing data from {device}: {e}")
+        finally:
+            queue.task_done()
+
+
+async def handle_connection(reader, writer, queue):
+    global positions_dirty
+    address = writer.get_extra_info('peername')
+    device = address[0] if address else 'unknown'
+    print(f"Connection established with {device}")
+    previous = device_connections.get(device)
+    if previous is not None:
+        # The device reconnected, the old socket is usually half-open and would only feed stale messages
+        previous.close()
+    connection = device_connections[device] = writer
+
+    decoder = JsonStreamDecoder()
+    try:
         while True:
-            try:
-                data = connection.recv(4096)
-                if not data:
-                    break
-
-                data = data.decode('utf-8')
-                print(f"Received data: {data}")
-                buffer += data
-
-                # Attempt to process complete JSON objects from the buffer
-                while True:
-                    try:
-                        gnss_data, index = json.JSONDecoder().raw_decode(buffer)
-                        buffer = buffer[index:].strip()
-
-                        if isinstance(gnss_data, dict):
-                            gnss_data = [gnss_data]
-
-                        print(f"Parsed GNSS data: {gnss_data}")
-
-                        # Process the data and update the sliding window
-                        processed_data = process_gnss_data(gnss_data)
-                        for location in processed_data:
-                            gnss_data_window.append(location)
-
-                        # Focus on the first valid data point for simplicity
-                        for location in gnss_data:
-                            print(f"Processing location data: {location}")
-                            latitude = location.get('latitude', None)
-                            longitude = location.get('longitude', None)
-                            print(f"Extracted coordinates: Latitude={latitude}, Longitude={longitude}")
-
-                            if latitude is not None and longitude is not None and latitude != 0.0 and longitude != 0.0:
-                                generate_or_update_html(latitude, longitude, location)
-                                break  # Only process the first valid location for now
-
-                        # Check for spoofing
-                        if len(gnss_data_window) == WINDOW_SIZE:
-                            if detect_spoofing(gnss_data_window):
-                                print("Spoofing detected! Data might be unreliable.")
-                            else:
-                                print("No spoofing detected.")
-                        break  # Stop after processing the first set of data for now
-
-                    except json.JSONDecodeError:
-                        # If JSONDecodeError occurs, break the loop and wait for more data
-                        break
-
-            except Exception as e:
-                print(f"Error receiving data: {e}")
+            data = await reader.read(4096)
+            if not data:
                 break
+            # Queue every complete JSON message, the decoder keeps the incomplete tail
+            for gnss_data in decoder.feed(data):
+                await queue.put((gnss_data, device, connection))
+    except FramingError as e:
+        print(f"Dropping {device}, bad message framing: {e}")
+    except Exception as e:
+        print(f"Error receiving data from {device}: {e}")
+    finally:
+        writer.close()
+        # A newer connection from the same address owns the device state now
+        if device_connections.get(device) is connection:
+            del device_connections[device]
+            device_detectors.pop(device, None)
+            if latest_positions.pop(device, None) is not None:
+                positions_dirty = True
+        print(f"Connection with {device} closed.")
+
+
+async def serve():
+    html_page = write_static_html()
+    queue = asyncio.Queue(maxsize=MAX_PENDING_MESSAGES)
+    background = [asyncio.create_task(process_messages(queue)), asyncio.create_task(publish_positions())]
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, queue),
+                                        HOST, PORT)
+    map_server = await asyncio.start_server(lambda reader, writer: handle_map_request(reader, writer, html_page),
+                                            HOST, MAP_PORT)
+    print(f"Server started and listening on {HOST}:{PORT}")
+    try:
+        async with server, map_server:
+            await asyncio.gather(server.serve_forever(), map_server.serve_forever())
+    finally:
+        for task in background:
+            task.cancel()
 
-        connection.close()
-        print("Connection closed.")
-        break
+
+# Start the server
+def start_server():
+    asyncio.run(serve())
 
 if __name__ == "__main__":
     start_server()